@@ -1,266 +1,1159 @@
-"""AI-related endpoints and logic."""
+"""
+AI-related endpoints and logic.
 
-import pandas as pd
-import psycopg2
+pandas, Prophet (with its Stan backend) and the fast engine are imported
+inside the functions that use them, not here: main imports this module at
+startup, and workers that only serve /products should not pay for loading them.
+"""
 
-from fastapi import APIRouter, HTTPException
-from prophet import Prophet
-from log import logger
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Literal, Optional
 
-from constants import db_config
+import db
+import metrics
+
+from fastapi import APIRouter, HTTPException, Response
+from jobs import JobQueueFull, job_manager
+from pydantic import BaseModel
+from log import get_logger
+from model_cache import model_cache
+
+from constants import (
+    FORECAST_ALL_TIMEOUT,
+    FORECAST_CHUNK_SIZE,
+    FORECAST_PRODUCT_TIMEOUT,
+    FORECAST_WORKERS,
+)
+
+logger = get_logger(__name__)
 
 router = APIRouter(prefix="/ai", tags=["ai"])
 
 
-@router.get("/forecast/id/{product_no}")
-def forecast_product(product_no: str, periods: int = 8, frequency: str = "month"):
-    frequency = frequency.lower()
+class ForecastJobCreate(BaseModel):
+    """Expected format for submitting a background forecast."""
+
+    kind: Literal["product", "all", "total", "refresh"]
+    product_no: Optional[str] = None
+    periods: int = 8
+    frequency: str = "month"
+    engine: str = "prophet"
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool():
+    """Returns the forecast worker pool, creating it on first use."""
+
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn: os.fork() em um processo com threads (pool do banco,
+            # executor) pode herdar locks travados
+            _process_pool = ProcessPoolExecutor(
+                max_workers=FORECAST_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            logger.info("Forecast process pool started (%d workers)", FORECAST_WORKERS)
+        return _process_pool
+
+
+def _discard_process_pool(pool):
+    """Drops a broken pool so the next request starts a fresh one."""
+
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_process_pool():
+    """Stops the forecast worker processes. Called once at shutdown."""
+
+    global _process_pool
+    with _process_pool_lock:
+        pool, _process_pool = _process_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _frequency_settings(frequency: str, detail="Frequência inválida. Use 'week' ou 'month'."):
+    """
+    Maps a forecast frequency to (rollup grain, Prophet frequency).
+    @raises HTTPException: If the frequency is not 'week' or 'month'.
+    """
 
     if frequency == "week":
-        sql_trunc = 'week'
-        prophet_freq = 'W'
-        resample_rule = 'W'
-    elif frequency == "month":
-        sql_trunc = 'month'
-        prophet_freq = 'M'
-        resample_rule = 'M'
-    else:
-        raise HTTPException(
-            status_code=400,
-            detail="Frequência inválida. Use 'week' ou 'month'."
-        )
+        return "week", "W"
+    if frequency == "month":
+        return "month", "ME"
+    raise HTTPException(status_code=400, detail=detail)
+
 
-    # Conexão e consulta
-    conn = psycopg2.connect(**db_config)
-    query = f"""
-        SELECT DATE_TRUNC('{sql_trunc}', transaction_date) AS period_start,
-               SUM(quantity) AS total_sold
-        FROM sales_transaction
-        WHERE product_no = %s
-        GROUP BY period_start
-        ORDER BY period_start;
+# Períodos por estação anual, para o motor rápido
+_SEASON_LENGTH = {"week": 52, "month": 12}
+
+
+def _check_engine(engine):
+    """
+    @raises HTTPException: If the engine is not 'prophet' or 'fast'.
     """
-    df = pd.read_sql(query, conn, params=[product_no])
-    conn.close()
 
-    if df.empty:
-        raise HTTPException(status_code=404, detail="No sales data found for this product")
+    if engine not in ("prophet", "fast"):
+        raise HTTPException(status_code=400, detail="Engine inválido. Use 'prophet' ou 'fast'.")
 
-    # Preparar dados
-    df = df.rename(columns={"period_start": "ds", "total_sold": "y"})
-    df["ds"] = pd.to_datetime(df["ds"], utc=True)
-    if df["ds"].dt.tz is not None:
-        df["ds"] = df["ds"].dt.tz_localize(None)
 
-    # # Datas contínuas
-    df = df.set_index("ds").resample(resample_rule).sum().reset_index()
-    df["y"] = df["y"].fillna(0)
+def _series_frame(ds, y):
+    """Prophet's ds/y frame from arrays of period labels and values."""
 
-    # Capacidade máxima para crescimento logístico
-    df["cap"] = df["y"].max() * 1.2
-    df["floor"] = 0
+    import pandas as pd
 
-    # Modelo Prophet
-    model = Prophet(
-        growth="logistic",
-        weekly_seasonality=True,
-        yearly_seasonality=False,
+    return pd.DataFrame({"ds": pd.to_datetime(ds), "y": y})
+
+
+def _active_span(y):
+    """Slice of y from its first to its last period with sales."""
+
+    import numpy as np
+
+    sold = np.flatnonzero(y)
+    if len(sold) == 0:
+        return slice(0, 0)
+    return slice(sold[0], sold[-1] + 1)
+
+
+def _watermark(df):
+    """Fingerprint of a prepared series: last period, number of periods and total sold."""
+
+    return f"{df['ds'].iloc[-1]:%Y-%m-%d}:{len(df)}:{float(df['y'].sum()):.4f}"
+
+
+def _future_dates(ds, periods, prophet_freq):
+    """The `periods` period labels after ds[-1], as 'YYYY-MM-DD' strings."""
+
+    import pandas as pd
+
+    # Mesmas datas futuras que Prophet.make_future_dataframe
+    last = pd.Timestamp(ds[-1])
+    future = pd.date_range(start=last, periods=periods + 1, freq=prophet_freq)
+    return future[future > last][:periods].strftime("%Y-%m-%d").tolist()
+
+
+def _array_records(labels, future, yhat, yhat_lower, yhat_upper):
+    """
+    Turns (series, periods) forecast arrays into {label: ds/yhat/yhat_lower/yhat_upper records}.
+    @param future: Period labels of the arrays' columns.
+    """
+
+    columns = zip(yhat.tolist(), yhat_lower.tolist(), yhat_upper.tolist())
+    return {
+        label: [
+            {"ds": ds, "yhat": yhat, "yhat_lower": lower, "yhat_upper": upper}
+            for ds, yhat, lower, upper in zip(future, yhats, lowers, uppers)
+        ]
+        for label, (yhats, lowers, uppers) in zip(labels, columns)
+    }
+
+
+def _fast_records(labels, ds, Y, periods, prophet_freq, frequency):
+    """
+    Forecasts every row of the (series, periods) array Y with the vectorized engine.
+    @param labels: Key of each row in the result.
+    @param ds: Period labels of Y's columns.
+    @return: {label: ds/yhat/yhat_lower/yhat_upper records}, like _future_records.
+    """
+
+    import fast_forecast
+
+    forecast = fast_forecast.forecast_matrix(Y, periods, _SEASON_LENGTH[frequency])
+    return _array_records(
+        labels,
+        _future_dates(ds, periods, prophet_freq),
+        forecast["yhat"],
+        forecast["yhat_lower"],
+        forecast["yhat_upper"],
     )
-    model.fit(df)
 
-    # Dataframe futuro
+
+def _fast_single(ds, y, periods, prophet_freq, frequency):
+    """Forecasts one series with the vectorized engine."""
+
+    if len(y) < 2:
+        raise HTTPException(status_code=404, detail="Not enough sales data to forecast")
+    return _fast_records([0], ds, y.reshape(1, -1), periods, prophet_freq, frequency)[0]
+
+
+def _model_key(cache_key, prophet_kwargs):
+    return (cache_key, tuple(sorted(prophet_kwargs.items())))
+
+
+def _warm_start(key):
+    """
+    Initial point for refitting the model stored under key: the previous fit's
+    parameters, or None if the series was never fitted or its parameters cannot
+    be read (a cold fit then). Prophet falls back to its default for any
+    parameter whose shape no longer matches (e.g. a new changepoint after the
+    history grew).
+    """
+
+    import numpy as np
+
+    previous = model_cache.previous(key)
+    if previous is None:
+        return None
+
+    # Um ajuste otimizado guarda cada parâmetro como (1, n); numa série
+    # constante com crescimento linear ou plano o Prophet pula o Stan e guarda
+    # escalares como (1,)
+    params = previous[1].params
+    try:
+        init = {name: float(np.ravel(params[name])[0]) for name in ("k", "m", "sigma_obs")}
+        init.update({name: np.atleast_2d(params[name])[0] for name in ("delta", "beta")})
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+    return init
+
+
+def _fit_new(prophet_kwargs, df, init=None, **fit_kwargs):
+    """Fits a new Prophet model, starting the optimizer from init when given."""
+
+    from prophet import Prophet
+
+    model = Prophet(**prophet_kwargs)
+    if init is not None:
+        fit_kwargs["init"] = init
+    model.fit(df, **fit_kwargs)
+    return model
+
+
+def _fit(cache_key, df, **prophet_kwargs):
+    """
+    Returns a Prophet model fitted on df, reusing the cached one when the
+    series has not changed since it was fitted and warm-starting from it
+    when it has.
+    """
+
+    key = _model_key(cache_key, prophet_kwargs)
+    watermark = _watermark(df)
+
+    model = model_cache.get(key, watermark)
+    if model is None:
+        with metrics.FORECAST_FIT.time(kind=cache_key[0]):
+            model = _fit_new(prophet_kwargs, df, _warm_start(key))
+        model_cache.put(key, watermark, model)
+    return model
+
+
+def _predict(model, df, periods, prophet_freq, logistic):
+    """Predicts history plus `periods` future periods, with non-negative rounded values."""
+
     future = model.make_future_dataframe(periods=periods, freq=prophet_freq)
     if future['ds'].dt.tz is not None:
         future['ds'] = future['ds'].dt.tz_localize(None)
-    future["cap"] = df["cap"].max()
-    future["floor"] = 0
+    if logistic:
+        future["cap"] = df["cap"].max()
+        future["floor"] = 0
 
-    # Previsão
     forecast = model.predict(future)
 
-    logger.info(forecast)
-    logger.info("\n")
-    logger.info(df)
     # Garantir valores positivos e arredondar
     forecast["yhat"] = forecast["yhat"].clip(lower=0).round(0)
     forecast["yhat_lower"] = forecast["yhat_lower"].clip(lower=0).round(0)
     forecast["yhat_upper"] = forecast["yhat_upper"].clip(lower=0).round(0)
+    return forecast
+
+
+def _future_records(forecast, periods):
+    """Returns only the future periods as ds/yhat/yhat_lower/yhat_upper records."""
 
-    # Retornar apenas os períodos futuros
     result = forecast[["ds", "yhat", "yhat_lower", "yhat_upper"]].tail(periods)
     result["ds"] = result["ds"].dt.strftime("%Y-%m-%d")
-
     return result.to_dict(orient="records")
 
-@router.get("/forecast/all")
-def forecast_all(periods: int = 8, frequency: str = "month"):
+
+@router.get("/forecast/id/{product_no}")
+def forecast_product(
+    product_no: str, periods: int = 8, frequency: str = "month", engine: str = "prophet"
+):
     frequency = frequency.lower()
+    grain, prophet_freq = _frequency_settings(frequency)
+    _check_engine(engine)
 
-    if frequency == "week":
-        sql_trunc = 'week'
-        prophet_freq = 'W'
-        resample_rule = 'W'
-    elif frequency == "month":
-        sql_trunc = 'month'
-        prophet_freq = 'M'
-        resample_rule = 'M'
-    else:
-        raise HTTPException(
-            status_code=400,
-            detail="Frequência inválida. Use 'week' ou 'month'."
-        )
+    import series_loader
 
-    # Conexão e consulta com join para pegar product_name
-    conn = psycopg2.connect(**db_config)
-    query = f"""
-        SELECT st.product_no,
-               p.product_name,
-               DATE_TRUNC('{sql_trunc}', st.transaction_date) AS period_start,
-               SUM(st.quantity) AS total_sold
-        FROM sales_transaction st
-        JOIN product p ON st.product_no = p.product_no
-        GROUP BY st.product_no, p.product_name, period_start
-        ORDER BY p.product_name, period_start;
-    """
-    df = pd.read_sql(query, conn)
-    conn.close()
-
-    if df.empty:
-        raise HTTPException(status_code=404, detail="No sales data found")
+    # Série contínua do produto, com 0 nos períodos sem venda
+    names, starts, Y = db.run_sync(series_loader.load_product_matrix, grain, product_no)
+
+    if not names:
+        raise HTTPException(status_code=404, detail="No sales data found for this product")
+
+    ds = series_loader.period_ends(starts, grain)
+    if engine == "fast":
+        return _fast_single(ds, Y[0], periods, prophet_freq, frequency)
+    df = _series_frame(ds, Y[0])
+
+    # Capacidade máxima para crescimento logístico
+    df["cap"] = df["y"].max() * 1.2
+    df["floor"] = 0
+
+    model = _fit(
+        ("product", product_no, frequency),
+        df,
+        growth="logistic",
+        weekly_seasonality=True,
+        yearly_seasonality=False,
+    )
+    with metrics.FORECAST_PREDICT.time(kind="product"):
+        forecast = _predict(model, df, periods, prophet_freq, logistic=True)
+
+    # Retornar apenas os períodos futuros
+    return _future_records(forecast, periods)
+
+def _forecast_chunk(tasks, periods, prophet_freq, prophet_kwargs, fit_timeout):
+    """
+    Runs in a worker process: forecasts each series of a chunk with Prophet(**prophet_kwargs),
+    capping logistic growth at 1.2 times the series' maximum.
+    @param tasks: (name, ds, y, model_json, init) tuples, ds and y being arrays of
+    period labels and sales; model_json is the cached model for that series, or
+    None if it must be fitted, starting from the init parameters if any.
+    @param periods: Periods to forecast, or None to only fit the models.
+    @param fit_timeout: Seconds a single fit may take before it is abandoned.
+    @return: One dict per task with its records, the newly fitted model as JSON
+    (None when the cached one was used) and the error, if any.
+    """
+
+    from prophet.serialize import model_from_json, model_to_json
+
+    logistic = prophet_kwargs.get("growth") == "logistic"
+    outcomes = []
+    for name, ds, y, model_json, init in tasks:
+        outcome = {"name": name, "records": None, "model": None, "error": None}
+        try:
+            df = _series_frame(ds, y)
+            if logistic:
+                df["cap"] = df["y"].max() * 1.2
+                df["floor"] = 0
+
+            # Tempos medidos aqui e registrados nas métricas pelo processo principal
+            if model_json is None:
+                started = time.perf_counter()
+                model = _fit_new(prophet_kwargs, df, init, timeout=fit_timeout)
+                outcome["fit_seconds"] = time.perf_counter() - started
+                outcome["model"] = model_to_json(model)
+            else:
+                model = model_from_json(model_json)
+
+            if periods is not None:
+                started = time.perf_counter()
+                forecast = _predict(model, df, periods, prophet_freq, logistic=logistic)
+                outcome["predict_seconds"] = time.perf_counter() - started
+                outcome["records"] = _future_records(forecast, periods)
+        except TimeoutError:
+            outcome["error"] = "timeout"
+        except Exception as e:
+            outcome["error"] = str(e)
+        outcomes.append(outcome)
+    return outcomes
+
+
+def _all_products_kwargs(frequency):
+    """Prophet settings of the per-product models of forecast_all."""
 
-    results = {}
+    return {
+        "growth": "logistic",
+        "weekly_seasonality": frequency == "week",
+        "yearly_seasonality": True,
+    }
 
-    i = 0
-    for product_name, group in df.groupby("product_name"):
-        i += 1
 
-        if i > 10:
-            break
+def _build_forecast_tasks(names, ds, Y, frequency, prophet_kwargs, changed_only=False):
+    """
+    Prepares one worker task per product with at least 2 periods of sales,
+    each trimmed to its own first..last period with sales, attaching the
+    cached model when the product's series has not changed and the previous
+    fit's parameters, as a warm start, when it has.
+    @param changed_only: Leave out products whose cached model is still current.
+    @return: (tasks, {product_name: (cache key, watermark)}), longest series first.
+    """
 
-        # Preparar dados
-        temp_df = group.rename(columns={"period_start": "ds", "total_sold": "y"})
-        temp_df["ds"] = pd.to_datetime(temp_df["ds"], utc=True)
-        if temp_df["ds"].dt.tz is not None:
-            temp_df["ds"] = temp_df["ds"].dt.tz_localize(None)
+    from prophet.serialize import model_to_json
 
-        # Datas contínuas
-        temp_df = temp_df.set_index("ds").resample(resample_rule).sum().reset_index()
-        temp_df["y"] = temp_df["y"].fillna(0)
+    tasks = []
+    keys = {}
+    for product_name, y in zip(names, Y):
+        span = _active_span(y)
 
         # Verificar se há pelo menos 2 períodos com vendas
-        if temp_df["y"].sum() == 0 or len(temp_df) < 2:
+        if span.stop - span.start < 2:
             continue
 
-        # Capacidade máxima
-        temp_df["cap"] = temp_df["y"].max() * 1.2
-        temp_df["floor"] = 0
+        temp_df = _series_frame(ds[span], y[span])
+        key = _model_key(("all", product_name, frequency), prophet_kwargs)
+        watermark = _watermark(temp_df)
+        keys[product_name] = (key, watermark)
+
+        if changed_only:
+            if model_cache.is_current(key, watermark):
+                continue
+            cached = None
+        else:
+            cached = model_cache.get(key, watermark)
+        tasks.append((
+            product_name,
+            ds[span],
+            y[span],
+            model_to_json(cached) if cached is not None else None,
+            _warm_start(key) if cached is None else None,
+        ))
+
+    # Séries mais longas primeiro, para que nenhum chunk pesado fique para o fim
+    tasks.sort(key=lambda task: len(task[1]), reverse=True)
+    return tasks, keys
+
+
+def _store_fitted_models(fitted, keys):
+    from prophet.serialize import model_from_json
+
+    for product_name, model_json in fitted:
+        key, watermark = keys[product_name]
+        model_cache.put(key, watermark, model_from_json(model_json))
+
+
+def _fast_forecast_all(names, ds, Y, periods, prophet_freq, frequency):
+    # Mesmo critério do Prophet: ignora produtos sem vendas no período
+    sold = Y.sum(axis=1) > 0
+    if not sold.any() or Y.shape[1] < 2:
+        return {}
+    labels = [name for name, keep in zip(names, sold) if keep]
+    return _fast_records(labels, ds, Y[sold], periods, prophet_freq, frequency)
+
 
-        # Modelo Prophet
-        model = Prophet(
-            growth="logistic",
-            weekly_seasonality=(frequency == "week"),
-            yearly_seasonality=True,
+async def _run_chunks(
+    tasks, periods, prophet_freq, prophet_kwargs, progress=None, kind="all",
+    chunk_size=FORECAST_CHUNK_SIZE,
+):
+    """
+    Runs _forecast_chunk over tasks on the process pool, chunk_size tasks per
+    chunk, until all finish or FORECAST_ALL_TIMEOUT passes.
+    @return: (outcomes of the finished tasks, names of the tasks still pending at the deadline).
+    """
+
+    pool = _get_process_pool()
+    loop = asyncio.get_running_loop()
+    chunks = {}
+    for start in range(0, len(tasks), chunk_size):
+        chunk = tasks[start:start + chunk_size]
+        future = loop.run_in_executor(
+            pool, _forecast_chunk, chunk, periods, prophet_freq, prophet_kwargs,
+            FORECAST_PRODUCT_TIMEOUT,
         )
-        model.fit(temp_df)
+        chunks[future] = [task[0] for task in chunk]
 
-        # Dataframe futuro
-        future = model.make_future_dataframe(periods=periods, freq=prophet_freq)
-        if future['ds'].dt.tz is not None:
-            future['ds'] = future['ds'].dt.tz_localize(None)
-        future["cap"] = temp_df["cap"].max()
-        future["floor"] = 0
+    if progress is not None:
+        progress(0, len(tasks))
+
+    done, pending = set(), set(chunks)
+    deadline = loop.time() + FORECAST_ALL_TIMEOUT
+    while pending and loop.time() < deadline:
+        finished, pending = await asyncio.wait(
+            pending, timeout=deadline - loop.time(), return_when=asyncio.FIRST_COMPLETED
+        )
+        done |= finished
+        if progress is not None:
+            progress(sum(len(chunks[future]) for future in done), len(tasks))
+
+    timed_out = []
+    for future in pending:
+        # Chunks ainda na fila são descartados; os que já rodam terminam sozinhos
+        future.cancel()
+        timed_out.extend(chunks[future])
+
+    outcomes = []
+    for future in done:
+        try:
+            outcomes.extend(future.result())
+        except BrokenProcessPool as e:
+            _discard_process_pool(pool)
+            outcomes.extend({"name": name, "error": str(e)} for name in chunks[future])
+        except Exception as e:
+            outcomes.extend({"name": name, "error": str(e)} for name in chunks[future])
+
+    for outcome in outcomes:
+        if "fit_seconds" in outcome:
+            metrics.FORECAST_FIT.observe(outcome["fit_seconds"], kind=kind)
+        if "predict_seconds" in outcome:
+            metrics.FORECAST_PREDICT.observe(outcome["predict_seconds"], kind=kind)
+    return outcomes, timed_out
+
+
+@router.get("/forecast/all")
+async def forecast_all(
+    response: Response,
+    periods: int = 8,
+    frequency: str = "month",
+    engine: str = "prophet",
+    details: bool = False,
+):
+    """
+    Forecasts every product, spreading the fits over FORECAST_WORKERS processes
+    in chunks of FORECAST_CHUNK_SIZE products. Products whose fit exceeds
+    FORECAST_PRODUCT_TIMEOUT, or that were still running after FORECAST_ALL_TIMEOUT,
+    are left out and the forecasts finished so far are returned.
+    With engine=fast, all products are forecast together by fast_forecast instead.
+    @return: {product_name: records}. The X-Forecast-Complete (true/false),
+    X-Forecast-Timed-Out and X-Forecast-Failed (counts) headers flag a partial
+    answer; with details=true the body is {"forecasts", "complete",
+    "timed_out", "errors"} instead, naming the products left out.
+    """
+
+    result = await _forecast_all(periods, frequency, engine)
+    response.headers["X-Forecast-Complete"] = "true" if result["complete"] else "false"
+    response.headers["X-Forecast-Timed-Out"] = str(len(result["timed_out"]))
+    response.headers["X-Forecast-Failed"] = str(len(result["errors"]))
+    return result if details else result["forecasts"]
+
+
+async def _forecast_all(periods, frequency, engine="prophet", progress=None):
+    """
+    Implementation of forecast_all.
+    @param progress: Optional callback receiving (products done, products total)
+    each time a chunk finishes.
+    """
+
+    frequency = frequency.lower()
+    grain, prophet_freq = _frequency_settings(frequency)
+    _check_engine(engine)
+
+    import series_loader
+
+    # Matriz produto x período, já contínua, direto do banco
+    names, starts, Y = await db.run(series_loader.load_product_matrix, grain)
+
+    if not names:
+        raise HTTPException(status_code=404, detail="No sales data found")
+    _check_history(Y)
+
+    ds = series_loader.period_ends(starts, grain)
+    if engine == "fast":
+        forecasts = await asyncio.to_thread(
+            _fast_forecast_all, names, ds, Y, periods, prophet_freq, frequency
+        )
+        if progress is not None:
+            progress(len(forecasts), len(forecasts))
+        return {"forecasts": forecasts, "complete": True, "timed_out": [], "errors": {}}
+
+    prophet_kwargs = _all_products_kwargs(frequency)
+    tasks, keys = await asyncio.to_thread(
+        _build_forecast_tasks, names, ds, Y, frequency, prophet_kwargs
+    )
 
-        # Previsão
-        forecast = model.predict(future)
-        forecast["yhat"] = forecast["yhat"].clip(lower=0).round(0)
-        forecast["yhat_lower"] = forecast["yhat_lower"].clip(lower=0).round(0)
-        forecast["yhat_upper"] = forecast["yhat_upper"].clip(lower=0).round(0)
+    outcomes, timed_out = await _run_chunks(
+        tasks, periods, prophet_freq, prophet_kwargs, progress
+    )
+
+    forecasts = {}
+    errors = {}
+    fitted = []
+    for outcome in outcomes:
+        if outcome["error"] == "timeout":
+            timed_out.append(outcome["name"])
+        elif outcome["error"] is not None:
+            errors[outcome["name"]] = outcome["error"]
+        else:
+            # Adicionar ao dict usando o nome do produto como chave
+            forecasts[outcome["name"]] = outcome["records"]
+            if outcome["model"] is not None:
+                fitted.append((outcome["name"], outcome["model"]))
+
+    if fitted:
+        await asyncio.to_thread(_store_fitted_models, fitted, keys)
+    if timed_out or errors:
+        logger.warning(
+            "Forecast for all products incomplete: %d timed out, %d failed, %d succeeded",
+            len(timed_out),
+            len(errors),
+            len(forecasts),
+        )
+
+    return {
+        "forecasts": dict(sorted(forecasts.items())),
+        "complete": not timed_out and not errors,
+        "timed_out": sorted(timed_out),
+        "errors": errors,
+    }
+
+
+async def _refresh_models(frequency, progress=None):
+    """
+    Incremental refit of forecast_all's per-product models: only products
+    whose sales changed since their model was fitted are refit, each one
+    warm-started from its previous parameters. Nothing is forecast.
+    @return: Counts of refitted, warm-started and unchanged products, the last
+    period now covered, and the products that timed out or failed.
+    """
+
+    frequency = frequency.lower()
+    grain, prophet_freq = _frequency_settings(frequency)
+
+    import series_loader
+
+    names, starts, Y = await db.run(series_loader.load_product_matrix, grain)
+    if not names:
+        raise HTTPException(status_code=404, detail="No sales data found")
+
+    ds = series_loader.period_ends(starts, grain)
+    prophet_kwargs = _all_products_kwargs(frequency)
+    tasks, keys = await asyncio.to_thread(
+        _build_forecast_tasks, names, ds, Y, frequency, prophet_kwargs, True
+    )
 
-        # Apenas períodos futuros
-        temp_result = forecast[["ds", "yhat", "yhat_lower", "yhat_upper"]].tail(periods)
-        temp_result["ds"] = temp_result["ds"].dt.strftime("%Y-%m-%d")
+    outcomes, timed_out = await _run_chunks(
+        tasks, None, prophet_freq, prophet_kwargs, progress, kind="refresh"
+    )
 
-        # Adicionar ao dict usando o nome do produto como chave
-        results[product_name] = temp_result.to_dict(orient="records")
+    errors = {}
+    fitted = []
+    for outcome in outcomes:
+        if outcome["error"] == "timeout":
+            timed_out.append(outcome["name"])
+        elif outcome["error"] is not None:
+            errors[outcome["name"]] = outcome["error"]
+        else:
+            fitted.append((outcome["name"], outcome["model"]))
 
-    return results
+    if fitted:
+        await asyncio.to_thread(_store_fitted_models, fitted, keys)
+    logger.info(
+        "Refreshed %d of %d %s product models (%d unchanged)",
+        len(fitted),
+        len(keys),
+        frequency,
+        len(keys) - len(tasks),
+    )
+
+    return {
+        "refitted": len(fitted),
+        "warm_started": sum(1 for task in tasks if task[4] is not None),
+        "unchanged": len(keys) - len(tasks),
+        "last_period": str(ds[-1]),
+        "timed_out": sorted(timed_out),
+        "errors": errors,
+    }
 
 
 @router.get("/forecast/total/{periods}")
-def forecast_total(periods: int = 8, frequency: str = "month"):
+def forecast_total(periods: int = 8, frequency: str = "month", engine: str = "prophet"):
     frequency = frequency.lower()
     frequency = "week"
     periods = 40
-    if frequency == "week":
-        sql_trunc = 'week'
-        prophet_freq = 'W'
-        resample_rule = 'W'
-    elif frequency == "month":
-        sql_trunc = 'month'
-        prophet_freq = 'M'
-        resample_rule = 'M'
+    grain, prophet_freq = _frequency_settings(
+        frequency, detail="Frequência inválida. Use 'week' (semana) ou 'month' (mês)."
+    )
+    _check_engine(engine)
+
+    import series_loader
+
+    # Total por período (rotulado pelo início do período), com 0 nos períodos sem venda
+    ds, y = db.run_sync(series_loader.load_total_series, grain)
+
+    if len(y) == 0:
+        raise HTTPException(status_code=404, detail="No sales data found for total forecast")
+
+    if engine == "fast":
+        return _fast_single(ds, y, periods, prophet_freq, frequency)
+    df = _series_frame(ds, y)
+
+    model = _fit(
+        ("total", None, frequency),
+        df,
+        weekly_seasonality=True,
+        yearly_seasonality=True,
+    )
+    with metrics.FORECAST_PREDICT.time(kind="total"):
+        forecast = _predict(model, df, periods, prophet_freq, logistic=False)
+
+    # Retornar apenas os períodos futuros
+    return _future_records(forecast, periods)
+
+
+def _load_hierarchy(cur, grain, level, history):
+    """
+    Loads the aggregate series of a hierarchy level and each product's share of them.
+    @return: (group labels, period starts, (groups, periods) array, product names,
+    (groups, products) shares).
+    """
+
+    import hierarchy
+    import numpy as np
+    import series_loader
+
+    if level == "country":
+        countries, starts, G, names, volumes = series_loader.load_country_matrix(cur, grain, history)
+        return countries, starts, G, names, hierarchy.normalize_shares(volumes)
+
+    names, starts, Y = series_loader.load_product_matrix(cur, grain)
+    if level == "total":
+        return ["total"], starts, Y.sum(axis=0, keepdims=True), names, hierarchy.group_shares(
+            Y, np.zeros(len(names), dtype=int), 1, history
+        )
+
+    cur.execute("SELECT product_name, MIN(category) FROM product GROUP BY product_name")
+    categories = dict(cur.fetchall())
+    labels, index = hierarchy.group_index(
+        [categories.get(name) or "uncategorized" for name in names]
+    )
+    return (
+        labels,
+        starts,
+        hierarchy.group_series(Y, index, len(labels)),
+        names,
+        hierarchy.group_shares(Y, index, len(labels), history),
+    )
+
+
+def _level_tasks(series, ds, S, frequency, prophet_kwargs):
+    """
+    Prepares one _forecast_chunk task per aggregate series with sales, named by
+    its row in S, with its cached model or warm start like _build_forecast_tasks.
+    @param series: (level, label) of each row of S, keying the model cache.
+    @return: (tasks, {row: (cache key, watermark)}).
+    """
+
+    from prophet.serialize import model_to_json
+
+    tasks = []
+    keys = {}
+    for row, ((level, label), y) in enumerate(zip(series, S)):
+        # Grupos sem vendas ficam com previsão zero
+        if not y.any():
+            continue
+        df = _series_frame(ds, y)
+        key = _model_key(("hierarchical", level, label, frequency), prophet_kwargs)
+        watermark = _watermark(df)
+        keys[row] = (key, watermark)
+        cached = model_cache.get(key, watermark)
+        tasks.append((
+            row,
+            ds,
+            y,
+            model_to_json(cached) if cached is not None else None,
+            _warm_start(key) if cached is None else None,
+        ))
+    return tasks, keys
+
+
+async def _forecast_levels(series, ds, S, periods, prophet_freq, frequency, engine):
+    """
+    Forecasts each aggregate series (one row of S) once, the Prophet fits in
+    parallel on the process pool.
+    @param series: (level, label) of each row of S.
+    @return: (series, periods) arrays yhat, yhat_lower and yhat_upper.
+    @raises HTTPException: 504 if a fit did not finish in time, 500 if one failed.
+    """
+
+    import fast_forecast
+    import numpy as np
+
+    if engine == "fast":
+        forecast = await asyncio.to_thread(
+            fast_forecast.forecast_matrix, S, periods, _SEASON_LENGTH[frequency]
+        )
+        return forecast["yhat"], forecast["yhat_lower"], forecast["yhat_upper"]
+
+    prophet_kwargs = {"weekly_seasonality": True, "yearly_seasonality": True}
+    tasks, keys = await asyncio.to_thread(_level_tasks, series, ds, S, frequency, prophet_kwargs)
+
+    # Poucas séries e longas: uma por chunk, para usar todos os workers
+    outcomes, timed_out = await _run_chunks(
+        tasks, periods, prophet_freq, prophet_kwargs, kind="hierarchical", chunk_size=1
+    )
+
+    arrays = np.zeros((3, len(series), periods))
+    errors = {}
+    fitted = []
+    for outcome in outcomes:
+        row = outcome["name"]
+        if outcome["error"] == "timeout":
+            timed_out.append(row)
+        elif outcome["error"] is not None:
+            errors[row] = outcome["error"]
+        else:
+            for j, column in enumerate(("yhat", "yhat_lower", "yhat_upper")):
+                arrays[j, row] = [record[column] for record in outcome["records"]]
+            if outcome["model"] is not None:
+                fitted.append((row, outcome["model"]))
+
+    if fitted:
+        await asyncio.to_thread(_store_fitted_models, fitted, keys)
+    if timed_out:
+        raise HTTPException(
+            status_code=504,
+            detail="Forecast timed out for: " + ", ".join(series[row][1] for row in sorted(timed_out)),
+        )
+    if errors:
+        logger.error("Hierarchical forecast failed: %s", errors)
+        raise HTTPException(
+            status_code=500,
+            detail="Forecast failed for: " + ", ".join(series[row][1] for row in sorted(errors)),
+        )
+    return arrays[0], arrays[1], arrays[2]
+
+
+def _hierarchical_records(labels, future, G, names, shares, levels, history, reconcile):
+    """
+    Splits the forecasts of _forecast_levels into per-group and per-product records.
+    @param levels: yhat, yhat_lower and yhat_upper arrays with one row per group,
+    plus a last row with the total when reconcile is set.
+    @param reconcile: Split the total forecast among the groups in proportion to
+    their own forecasts, so they add up to it.
+    """
+
+    import hierarchy
+    import numpy as np
+
+    if reconcile:
+        # Participação histórica de cada grupo no total, para períodos sem previsão
+        fallback = hierarchy.group_shares(G, np.zeros(len(labels), dtype=int), 1, history)[0]
+        proportions = hierarchy.forecast_proportions(levels[0][:-1], fallback)
+        totals = [F[-1] for F in levels]
+        groups = [np.round(proportions * total, 2) for total in totals]
     else:
+        totals = [F[0] for F in levels]
+        groups = list(levels)
+    products = [np.round(hierarchy.disaggregate(shares, F), 2) for F in groups]
+
+    # Só produtos com participação em algum grupo recebem previsão
+    sold = shares.sum(axis=0) > 0
+    return {
+        "total": _array_records(["total"], future, *(np.atleast_2d(F) for F in totals))["total"],
+        "groups": _array_records(labels, future, *groups),
+        "forecasts": _array_records(
+            [name for name, keep in zip(names, sold) if keep],
+            future,
+            *(F[sold] for F in products),
+        ),
+    }
+
+
+@router.get("/forecast/hierarchical")
+async def forecast_hierarchical(
+    periods: int = 8,
+    frequency: str = "week",
+    level: str = "total",
+    history: int = 13,
+    engine: str = "prophet",
+):
+    """
+    Top-down forecast: fits one model per aggregate series of the level (each
+    product category or each country) and one for their total, then splits the
+    total among the groups in proportion to their forecasts and each group among
+    its products by their share of it over the last `history` periods. The
+    groups add up to the total and the products of a group to the group.
+    @param level: 'total', 'category' or 'country'.
+    @param history: Periods used to compute each product's share.
+    """
+
+    frequency = frequency.lower()
+    grain, prophet_freq = _frequency_settings(frequency)
+    _check_engine(engine)
+    if level not in ("total", "category", "country"):
         raise HTTPException(
-            status_code=400,
-            detail="Frequência inválida. Use 'week' (semana) ou 'month' (mês)."
+            status_code=400, detail="Nível inválido. Use 'total', 'category' ou 'country'."
         )
+    if history < 1 or periods < 1:
+        raise HTTPException(status_code=400, detail="periods e history devem ser >= 1")
+
+    import numpy as np
+    import series_loader
+
+    labels, starts, G, names, shares = await db.run(_load_hierarchy, grain, level, history)
+    if G.shape[1] < 2:
+        raise HTTPException(status_code=404, detail="Not enough sales data to forecast")
+
+    ds = series_loader.period_ends(starts, grain)
+    series = [(level, label) for label in labels]
+    S = G
+    reconcile = level != "total"
+    if reconcile:
+        # Mesma chave de cache do nível 'total'
+        series.append(("total", "total"))
+        S = np.vstack([G, G.sum(axis=0)])
+
+    levels = await _forecast_levels(series, ds, S, periods, prophet_freq, frequency, engine)
+    result = await asyncio.to_thread(
+        _hierarchical_records, labels, _future_dates(ds, periods, prophet_freq), G, names,
+        shares, levels, history, reconcile,
+    )
+    return {"level": level, "engine": engine, "history": history, **result}
+
 
-    # Conexão e consulta
-    conn = psycopg2.connect(**db_config)
-    query = f"""
-        SELECT DATE_TRUNC('{sql_trunc}', transaction_date) AS period_start,
-               SUM(quantity) AS total_sold
-        FROM sales_transaction
-        GROUP BY period_start
-        ORDER BY period_start;
+def _check_history(Y):
+    """
+    @raises HTTPException: 422 if the sales history spans fewer than the 2 periods
+    a forecast needs.
     """
-    df = pd.read_sql(query, conn)
-    conn.close()
 
-    if df.empty:
-        raise HTTPException(status_code=404, detail="No sales data found for total forecast")
+    if Y.shape[1] < 2:
+        raise HTTPException(
+            status_code=422,
+            detail="Not enough sales history to forecast: at least 2 periods are needed",
+        )
 
-    # Preparar dados
-    df = df.rename(columns={"period_start": "ds", "total_sold": "y"})
-    df["ds"] = pd.to_datetime(df["ds"], utc=True)
-    if df["ds"].dt.tz is not None:
-        df["ds"] = df["ds"].dt.tz_localize(None)
 
-    # Datas contínuas
-    # df = df.set_index("ds").resample(resample_rule).sum().reset_index()
-    # df["y"] = df["y"].fillna(0)
+def _forecast_arrays(names, ds, Y, periods, prophet_freq, frequency, engine_result=None):
+    """
+    Future yhat/yhat_lower/yhat_upper as (series, periods) arrays, from the fast
+    engine, or from forecast_all's records when engine_result is given.
+    @return: (names kept, yhat, yhat_lower, yhat_upper).
+    """
 
-    # Adicionar capacidade máxima para crescimento logístico
-    # df["cap"] = df["y"].max() * 1.2  # 20% acima do máximo histórico
-    # # Opcional: floor
-    # df["floor"] = 0
+    import fast_forecast
+    import numpy as np
 
-    # Modelo Prophet
-    model = Prophet(
-        # growth="logistic",
-        weekly_seasonality=True,
-        yearly_seasonality=True,
+    if engine_result is None:
+        sold = Y.sum(axis=1) > 0
+        forecast = fast_forecast.forecast_matrix(Y[sold], periods, _SEASON_LENGTH[frequency])
+        kept = [name for name, keep in zip(names, sold) if keep]
+        return kept, forecast["yhat"], forecast["yhat_lower"], forecast["yhat_upper"]
+
+    kept = sorted(engine_result)
+    arrays = [
+        np.array([[r[column] for r in engine_result[name]] for name in kept]).reshape(len(kept), periods)
+        for column in ("yhat", "yhat_lower", "yhat_upper")
+    ]
+    return (kept, *arrays)
+
+
+def _replenishment_page(
+    stock_rows, forecast, failures, lead_time, review_period, service_level, page, page_size
+):
+    """
+    Joins stock with forecasts by product name, plans every stocked product and
+    returns one page. Products without a forecast are planned with zero demand.
+    @param failures: {product name: 'failed' or 'timed_out'} for the forecasts that did not finish.
+    @return: (total, page items, {status: product names} for the products without a forecast).
+    """
+
+    import numpy as np
+    import replenishment
+
+    forecast_names, yhat, yhat_lower, yhat_upper = forecast
+    horizon = lead_time + review_period
+    names = sorted(row[0] for row in stock_rows)
+    stock = {row[0]: row for row in stock_rows}
+    row_of = {name: i for i, name in enumerate(names)}
+    on_hand = np.array([stock[name][1] for name in names], dtype=float)
+
+    arrays = [np.zeros((len(names), horizon)) for _ in range(3)]
+    status = {name: failures.get(name, "no_history") for name in names}
+    for j, name in enumerate(forecast_names):
+        i = row_of.get(name)
+        if i is None:
+            continue
+        for array, source in zip(arrays, (yhat, yhat_lower, yhat_upper)):
+            array[i] = source[j, :horizon]
+        status[name] = "ok"
+
+    result = replenishment.plan(
+        on_hand, *arrays, lead_time, review_period, service_level,
     )
-    model.fit(df)
 
-    # Dataframe futuro
-    future = model.make_future_dataframe(periods=periods, freq=prophet_freq)
-    if future['ds'].dt.tz is not None:
-        future['ds'] = future['ds'].dt.tz_localize(None)
-    # Adicionar cap/floor no futuro
-    # future["cap"] = df["cap"].max()
-    # future["floor"] = 0
+    skipped = {}
+    for name in names:
+        if status[name] != "ok":
+            skipped.setdefault(status[name], []).append(name)
 
-    # Previsão
-    forecast = model.predict(future)
+    total = len(names)
+    start = (page - 1) * page_size
+    items = []
+    for i in result["order"][start:start + page_size]:
+        cover = result["periods_of_cover"][i]
+        items.append({
+            "product_name": names[i],
+            "product_nos": stock[names[i]][2],
+            "on_hand": int(result["on_hand"][i]),
+            "forecast_demand": round(float(result["forecast_demand"][i]), 2),
+            "safety_stock": round(float(result["safety_stock"][i]), 2),
+            "reorder_point": round(float(result["reorder_point"][i]), 2),
+            "order_up_to": round(float(result["order_up_to"][i]), 2),
+            "order_quantity": int(result["order_quantity"][i]),
+            "needs_reorder": bool(result["needs_reorder"][i]),
+            "periods_of_cover": round(float(cover), 2) if np.isfinite(cover) else None,
+            "forecast_status": status[names[i]],
+        })
+    return total, items, skipped
 
-    # Garantir valores positivos e arredondar
-    forecast["yhat"] = forecast["yhat"].clip(lower=0).round(0)
-    forecast["yhat_lower"] = forecast["yhat_lower"].clip(lower=0).round(0)
-    forecast["yhat_upper"] = forecast["yhat_upper"].clip(lower=0).round(0)
 
-    # Retornar apenas os períodos futuros
-    result = forecast[["ds", "yhat", "yhat_lower", "yhat_upper"]].tail(periods)
-    result["ds"] = result["ds"].dt.strftime("%Y-%m-%d")
+@router.get("/replenishment")
+async def get_replenishment(
+    frequency: str = "week",
+    lead_time: int = 2,
+    review_period: int = 1,
+    service_level: float = 0.95,
+    engine: str = "fast",
+    page: int = 1,
+    page_size: int = 50,
+):
+    """
+    Reorder point, safety stock and suggested order quantity for every product,
+    from its stock and the forecast demand over lead_time + review_period periods.
+    Products that run out soonest relative to the lead time come first.
+    Products without a forecast (no sales history, or a Prophet fit that failed
+    or timed out) are planned with zero demand, flagged in forecast_status and
+    listed in skipped.
+    @param lead_time: Periods (of the given frequency) until an order arrives.
+    @param review_period: Periods between two orders.
+    @param service_level: Target probability of not running out, between 0.5 and 1.
+    @param engine: 'fast' (default) or 'prophet' (slow: fits every product).
+    """
 
-    return result.to_dict(orient="records")
+    frequency = frequency.lower()
+    grain, prophet_freq = _frequency_settings(frequency)
+    _check_engine(engine)
+    if lead_time < 1 or review_period < 1 or not 0.5 <= service_level < 1:
+        raise HTTPException(
+            status_code=400,
+            detail="lead_time e review_period devem ser >= 1 e service_level entre 0.5 e 1",
+        )
+    if page < 1 or page_size < 1 or page_size > 500:
+        raise HTTPException(status_code=400, detail="Invalid page or page_size")
+
+    import series_loader
+
+    horizon = lead_time + review_period
+    stock_rows = await db.fetch_all(
+        """
+        SELECT product_name, SUM(quantity)::BIGINT, array_agg(product_no ORDER BY product_no)
+        FROM product
+        GROUP BY product_name
+        """,
+        name="replenishment_stock",
+    )
+
+    failures = {}
+    if engine == "fast":
+        names, starts, Y = await db.run(series_loader.load_product_matrix, grain)
+        if not names:
+            raise HTTPException(status_code=404, detail="No sales data found")
+        _check_history(Y)
+        ds = series_loader.period_ends(starts, grain)
+        forecast = await asyncio.to_thread(
+            _forecast_arrays, names, ds, Y, horizon, prophet_freq, frequency
+        )
+    else:
+        result = await _forecast_all(horizon, frequency, engine)
+        failures = {name: "failed" for name in result["errors"]}
+        failures.update((name, "timed_out") for name in result["timed_out"])
+        forecast = await asyncio.to_thread(
+            _forecast_arrays, None, None, None, horizon, prophet_freq, frequency,
+            result["forecasts"],
+        )
+
+    total, items, skipped = await asyncio.to_thread(
+        _replenishment_page, stock_rows, forecast, failures, lead_time, review_period,
+        service_level, page, page_size,
+    )
+
+    total_pages = (total + page_size - 1) // page_size if total else 0
+    return {
+        "frequency": frequency,
+        "lead_time": lead_time,
+        "review_period": review_period,
+        "service_level": service_level,
+        "engine": engine,
+        "skipped": skipped,
+        "items": items,
+        "pagination": {
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "total_pages": total_pages,
+            "has_next": page < total_pages,
+            "has_prev": page > 1,
+        },
+    }
+
+
+async def _run_forecast_job(job):
+    params = job.params
+    job.progress(0, 1)
+    if params["kind"] == "refresh":
+        return await _refresh_models(params["frequency"], job.progress)
+    if params["kind"] == "all":
+        return await _forecast_all(
+            params["periods"], params["frequency"], params["engine"], job.progress
+        )
+
+    if params["kind"] == "product":
+        result = await job_manager.run_blocking(
+            forecast_product,
+            params["product_no"],
+            params["periods"],
+            params["frequency"],
+            params["engine"],
+        )
+    else:
+        result = await job_manager.run_blocking(
+            forecast_total, params["periods"], params["frequency"], params["engine"]
+        )
+    job.progress(1, 1)
+    return result
+
+
+@router.post("/jobs", status_code=202)
+async def submit_forecast_job(request: ForecastJobCreate):
+    """
+    Queues a forecast to run in the background and returns immediately.
+    kind=refresh refits only the per-product models whose sales changed,
+    warm-starting each from its previous fit (meant for periodic refreshes).
+    Poll GET /ai/jobs/{id} for its status, progress and result.
+    @raises HTTPException: 429 if too many jobs are already queued or running.
+    """
+
+    params = request.dict()
+    params["frequency"] = params["frequency"].lower()
+    _frequency_settings(params["frequency"])
+    _check_engine(request.engine)
+    if request.kind == "product" and not request.product_no:
+        raise HTTPException(status_code=400, detail="product_no is required for product forecasts")
+
+    try:
+        job = job_manager.submit(request.kind, params, _run_forecast_job)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "10"})
+
+    return job.to_dict(include_result=False)
+
+
+@router.get("/jobs")
+def forecast_jobs_stats():
+    """Reports how many forecast jobs exist in each status."""
+
+    return job_manager.stats()
+
+
+@router.get("/jobs/{job_id}")
+def get_forecast_job(job_id: str):
+    """
+    Returns a forecast job's status and progress, plus its result once it has
+    succeeded. Import jobs are at GET /import/jobs/{id}.
+    """
+
+    job = job_manager.get(job_id)
+    if job is None or job.kind == "import":
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@router.get("/cache")
+def forecast_cache_stats():
+    """Reports forecast model cache usage (memory hits, disk hits and refits)."""
+
+    return model_cache.stats()
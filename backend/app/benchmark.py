@@ -0,0 +1,270 @@
+"""
+Forecast benchmark and backtesting harness.
+
+Builds a sales dataset (synthetic, or replayed from the database rollups),
+then runs rolling-origin backtests of each forecast engine and frequency:
+for every origin, each engine is trained on the periods before it and scored
+on the next `horizon` periods. The Prophet engine goes through the same
+helpers as the API (ai._fit_new / ai._predict with forecast_all's settings),
+the fast engine through fast_forecast.forecast_matrix.
+
+Reported per engine and frequency, as JSON: fit and predict latency per
+series, throughput, peak traced memory (measured in a separate untimed run)
+and MAE, sMAPE and MASE (scaled by the in-sample one-step naive error). When
+Prophet runs, every engine is scored on the same first `--prophet-series`
+series ("subset": "compared"), and the other engines are also scored on all
+series ("subset": "all").
+
+Usage: python benchmark.py [--source synthetic|db] [--series N] [--periods T]
+           [--frequencies week,month] [--engines fast,prophet] [--horizon H]
+           [--origins K] [--prophet-series N] [--output FILE]
+"""
+
+import argparse
+import json
+import logging
+import resource
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import ai
+import fast_forecast
+
+_SEASON_LENGTH = {"week": 52, "month": 12}
+_PANDAS_FREQ = {"week": "W", "month": "ME"}
+
+
+def synthetic_dataset(series, periods, frequency, intermittent=0.3, seed=0):
+    """
+    Random demand: a mix of smooth seasonal series with trend and
+    intermittent series (mostly zeros with occasional orders).
+    @param intermittent: Fraction of intermittent series.
+    @return: (period labels as datetime64, (series, periods) array).
+    """
+
+    rng = np.random.default_rng(seed)
+    m = _SEASON_LENGTH[frequency]
+    t = np.arange(periods)
+
+    level = rng.uniform(5, 200, (series, 1))
+    trend = rng.normal(0, 0.002, (series, 1)) * level * t
+    phase = rng.uniform(0, 2 * np.pi, (series, 1))
+    season = rng.uniform(0, 0.4, (series, 1)) * level * np.sin(2 * np.pi * t / m + phase)
+    noise = rng.normal(0, 0.1, (series, periods)) * level
+    Y = np.clip(level + trend + season + noise, 0, None).round()
+
+    sparse = rng.random(series) < intermittent
+    orders = rng.random((series, periods)) < rng.uniform(0.05, 0.3, (series, 1))
+    sizes = rng.poisson(rng.uniform(1, 20, (series, 1)), (series, periods))
+    Y[sparse] = (orders * sizes)[sparse]
+
+    import pandas as pd
+
+    ds = pd.date_range("2018-01-01", periods=periods, freq=_PANDAS_FREQ[frequency])
+    return ds.to_numpy().astype("datetime64[D]"), Y
+
+
+def database_dataset(frequency, limit=None):
+    """Replays per-product sales from sales_rollup_product."""
+
+    import db
+    import series_loader
+
+    db.open_pool()
+    try:
+        names, starts, Y = db.run_sync(series_loader.load_product_matrix, frequency)
+    finally:
+        db.close_pool()
+
+    Y = Y[Y.sum(axis=1) > 0]
+    if limit is not None:
+        Y = Y[:limit]
+    return series_loader.period_ends(starts, frequency), Y
+
+
+def _metrics(actual, predicted, train):
+    """
+    MAE, sMAPE (%) and MASE over a (series, horizon) block.
+    Periods where both actual and predicted are 0 count as a perfect sMAPE;
+    series with a constant history have no MASE scale and are left out of it.
+    """
+
+    error = np.abs(actual - predicted)
+    denominator = np.abs(actual) + np.abs(predicted)
+    smape = np.where(denominator > 0, 2 * error / np.where(denominator > 0, denominator, 1), 0)
+
+    scale = np.abs(np.diff(train, axis=1)).mean(axis=1)
+    mase = error.mean(axis=1)[scale > 0] / scale[scale > 0]
+
+    return {
+        "mae": float(error.mean()),
+        "smape": float(100 * smape.mean()),
+        "mase": float(mase.mean()) if len(mase) else None,
+    }
+
+
+def _run_fast(ds, train, horizon, frequency):
+    started = time.perf_counter()
+    forecast = fast_forecast.forecast_matrix(train, horizon, _SEASON_LENGTH[frequency])
+    elapsed = time.perf_counter() - started
+    return forecast["yhat"], elapsed, None
+
+
+def _run_prophet(ds, train, horizon, frequency):
+    prophet_kwargs = ai._all_products_kwargs(frequency)
+    predicted = np.zeros((train.shape[0], horizon))
+    fit_seconds = predict_seconds = 0.0
+
+    for i, y in enumerate(train):
+        df = ai._series_frame(ds, y)
+        df["cap"] = max(df["y"].max() * 1.2, 1)
+        df["floor"] = 0
+
+        started = time.perf_counter()
+        model = ai._fit_new(prophet_kwargs, df)
+        fit_seconds += time.perf_counter() - started
+
+        started = time.perf_counter()
+        forecast = ai._predict(model, df, horizon, _PANDAS_FREQ[frequency], logistic=True)
+        predict_seconds += time.perf_counter() - started
+        predicted[i] = forecast["yhat"].to_numpy()[-horizon:]
+
+    return predicted, fit_seconds, predict_seconds
+
+
+_ENGINES = {"fast": _run_fast, "prophet": _run_prophet}
+
+
+def backtest(engine, ds, Y, frequency, horizon, origins):
+    """
+    Rolling-origin backtest: the last `origins` origins, `horizon` periods apart.
+    Peak memory comes from an extra, untimed run on the longest history, so
+    tracemalloc's overhead stays out of the timings.
+    @return: Dict with timings, throughput, peak memory and error metrics.
+    """
+
+    periods = Y.shape[1]
+    cutoffs = [periods - horizon * (i + 1) for i in range(origins)]
+    cutoffs = sorted(c for c in cutoffs if c >= 2)
+    if not cutoffs:
+        raise ValueError(f"{periods} periods are too few for horizon {horizon}")
+
+    run = _ENGINES[engine]
+    actual, predicted, history = [], [], []
+    fit_seconds = predict_seconds = 0.0
+
+    started = time.perf_counter()
+    for cutoff in cutoffs:
+        yhat, fit, predict = run(ds[:cutoff], Y[:, :cutoff], horizon, frequency)
+        fit_seconds += fit
+        predict_seconds += predict or 0.0
+        actual.append(Y[:, cutoff:cutoff + horizon])
+        predicted.append(yhat[:, :actual[-1].shape[1]])
+        history.append(Y[:, :cutoff])
+    total_seconds = time.perf_counter() - started
+
+    tracemalloc.start()
+    try:
+        run(ds[:cutoffs[-1]], Y[:, :cutoffs[-1]], horizon, frequency)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    fits = len(cutoffs) * Y.shape[0]
+    scores = [_metrics(a, p, h) for a, p, h in zip(actual, predicted, history)]
+    mase = [s["mase"] for s in scores if s["mase"] is not None]
+    return {
+        "engine": engine,
+        "frequency": frequency,
+        "series": Y.shape[0],
+        "periods": periods,
+        "origins": cutoffs,
+        "horizon": horizon,
+        # No motor rápido ajuste e previsão são uma única operação, medida como ajuste
+        "fit_ms_per_series": 1000 * fit_seconds / fits,
+        "predict_ms_per_series": 1000 * predict_seconds / fits if engine != "fast" else None,
+        "total_seconds": total_seconds,
+        "series_per_second": fits / total_seconds if total_seconds else None,
+        "peak_traced_mb": peak / 2**20,
+        "mae": float(np.mean([s["mae"] for s in scores])),
+        "smape": float(np.mean([s["smape"] for s in scores])),
+        "mase": float(np.mean(mase)) if mase else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark and backtest the forecast engines.")
+    parser.add_argument("--source", choices=("synthetic", "db"), default="synthetic")
+    parser.add_argument("--series", type=int, default=1000, help="synthetic series (db: max series)")
+    parser.add_argument("--periods", type=int, default=104, help="synthetic periods per series")
+    parser.add_argument("--intermittent", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--frequencies", default="week,month")
+    parser.add_argument("--engines", default="fast,prophet")
+    parser.add_argument("--horizon", type=int, default=8)
+    parser.add_argument("--origins", type=int, default=3)
+    parser.add_argument(
+        "--prophet-series", type=int, default=20,
+        help="series backtested with Prophet (it takes ~0.1s+ per fit)",
+    )
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    engines = args.engines.split(",")
+    frequencies = args.frequencies.split(",")
+    for name in engines:
+        if name not in _ENGINES:
+            parser.error(f"unknown engine {name}")
+    for frequency in frequencies:
+        if frequency not in _SEASON_LENGTH:
+            parser.error(f"unknown frequency {frequency}")
+
+    if "prophet" in engines:
+        # Importa Prophet/Stan fora das medições e silencia o log de cada ajuste
+        import prophet  # noqa: F401
+
+        logging.getLogger("cmdstanpy").disabled = True
+        logging.getLogger("prophet").setLevel(logging.WARNING)
+
+    results = []
+    for frequency in frequencies:
+        if args.source == "synthetic":
+            ds, Y = synthetic_dataset(
+                args.series, args.periods, frequency, args.intermittent, args.seed
+            )
+        else:
+            ds, Y = database_dataset(frequency, args.series)
+
+        # Métricas só são comparáveis na mesma amostra de séries
+        compared = Y[:args.prophet_series] if "prophet" in engines else Y
+        for engine in engines:
+            results.append({
+                "subset": "compared",
+                **backtest(engine, ds, compared, frequency, args.horizon, args.origins),
+            })
+        if len(compared) < len(Y):
+            for engine in engines:
+                if engine != "prophet":
+                    results.append({
+                        "subset": "all",
+                        **backtest(engine, ds, Y, frequency, args.horizon, args.origins),
+                    })
+
+    report = {
+        "source": args.source,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,5 +9,90 @@ db_config = {
     "password": os.environ.get("POSTGRESQL_PASSWORD"),
 }
 
+# Pool de conexões compartilhado (tempos em segundos)
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+DB_POOL_MAX_LIFETIME = float(os.environ.get("DB_POOL_MAX_LIFETIME", 1800))
+DB_POOL_MAX_IDLE = float(os.environ.get("DB_POOL_MAX_IDLE", 300))
+DB_CONNECT_TIMEOUT = int(os.environ.get("DB_CONNECT_TIMEOUT", 5))
+
+# Validade (segundos) do cache de contagem exata de GET /products/
+PRODUCT_COUNT_CACHE_TTL = float(os.environ.get("PRODUCT_COUNT_CACHE_TTL", 30))
+
+# Linhas por lote no export em streaming de /products/transactions/
+TRANSACTIONS_STREAM_BATCH_SIZE = int(os.environ.get("TRANSACTIONS_STREAM_BATCH_SIZE", 5000))
+
+# Máximo de linhas aceitas por POST /products/transactions/bulk
+BULK_TRANSACTIONS_MAX_ROWS = int(os.environ.get("BULK_TRANSACTIONS_MAX_ROWS", 50000))
+
+# Meses futuros com partição de sales_transaction criada antecipadamente e a
+# cada quantos segundos o servidor em execução cria as que faltam
+SALES_PARTITION_MONTHS_AHEAD = int(os.environ.get("SALES_PARTITION_MONTHS_AHEAD", 3))
+SALES_PARTITION_CHECK_INTERVAL = float(os.environ.get("SALES_PARTITION_CHECK_INTERVAL", 86400))
+
+# Cache de modelos de previsão: quantidade em memória e diretório persistente. O
+# padrão comporta um modelo por produto do catálogo (~3,7 mil) em /ai/forecast/all,
+# sem releituras do disco; cada modelo ocupa uns 50 KB
+FORECAST_CACHE_SIZE = int(os.environ.get("FORECAST_CACHE_SIZE", 4096))
+FORECAST_CACHE_DIR = os.environ.get("FORECAST_CACHE_DIR", "../forecast_cache")
+
+# Workers do uvicorn (a mesma variável que ele lê como padrão de --workers). Cada
+# um tem seu pool de previsão, então por padrão os núcleos são divididos entre eles
+WEB_CONCURRENCY = max(1, int(os.environ.get("WEB_CONCURRENCY", 1)))
+
+# Previsão de todos os produtos: processos (por worker do uvicorn), produtos por
+# chunk e limites (segundos) por ajuste de produto e para a requisição inteira
+FORECAST_WORKERS = int(
+    os.environ.get("FORECAST_WORKERS", max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY))
+)
+FORECAST_CHUNK_SIZE = int(os.environ.get("FORECAST_CHUNK_SIZE", 4))
+FORECAST_PRODUCT_TIMEOUT = float(os.environ.get("FORECAST_PRODUCT_TIMEOUT", 30))
+FORECAST_ALL_TIMEOUT = float(os.environ.get("FORECAST_ALL_TIMEOUT", 300))
+
+# Jobs de previsão em segundo plano: execuções simultâneas, máximo na fila
+# (incluindo os em execução) e por quantos segundos o resultado fica disponível
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", 20))
+JOB_RESULT_TTL = float(os.environ.get("JOB_RESULT_TTL", 3600))
+
+# Importação de CSVs: diretório dos arquivos, registros por chunk, workers de
+# COPY em paralelo e se o startup importa sales_transaction.csv em segundo plano
+IMPORT_DIR = os.environ.get("IMPORT_DIR", "../database")
+IMPORT_CHUNK_ROWS = int(os.environ.get("IMPORT_CHUNK_ROWS", 50000))
+IMPORT_WORKERS = int(os.environ.get("IMPORT_WORKERS", 4))
+IMPORT_ON_STARTUP = os.environ.get("IMPORT_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+# Startup: quanto esperar (segundos) o PostgreSQL aceitar conexões e o worker
+# líder terminar as migrações, e o intervalo máximo entre novas tentativas do
+# setup que falhou (dobra a cada falha, começando em 1s)
+STARTUP_DB_WAIT = float(os.environ.get("STARTUP_DB_WAIT", 30))
+STARTUP_LOCK_TIMEOUT = float(os.environ.get("STARTUP_LOCK_TIMEOUT", 120))
+STARTUP_RETRY_MAX = float(os.environ.get("STARTUP_RETRY_MAX", 60))
+
+# Perfil de consultas: duração (ms) a partir da qual a consulta é logada, fração
+# das lentas com o plano capturado por EXPLAIN em segundo plano, se os
+# parâmetros (e os literais dos planos) aparecem no log e em /db/queries e
+# formatos acompanhados
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 200))
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.environ.get("SLOW_QUERY_EXPLAIN_SAMPLE", 0))
+SLOW_QUERY_LOG_PARAMS = os.environ.get("SLOW_QUERY_LOG_PARAMS", "false").lower() in ("1", "true", "yes")
+QUERY_STATS_MAX_SHAPES = int(os.environ.get("QUERY_STATS_MAX_SHAPES", 500))
+
+# Token (Authorization: Bearer) exigido por /db/queries; vazio desativa o endpoint
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# Logs: nível padrão, níveis por logger ("cmdstanpy=WARNING,prophet=INFO"),
+# formato (text ou json), arquivo opcional além do stdout, se cada registro
+# inclui arquivo/linha/função (só com LOG_CALLER o logging percorre a pilha a
+# cada chamada; sem ele, o registro traz apenas o módulo) e a fração dos
+# registros DEBUG mantidos
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "cmdstanpy=WARNING")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()
+LOG_FILE = os.environ.get("LOG_FILE", "")
+LOG_CALLER = os.environ.get("LOG_CALLER", "false").lower() in ("1", "true", "yes")
+LOG_DEBUG_SAMPLE = float(os.environ.get("LOG_DEBUG_SAMPLE", 1))
+
 # Para simular a aplicação coerentemente no período do dataset
-CURRENT_DATE = date(2019, 7, 27)
\ No newline at end of file
+CURRENT_DATE = date(2019, 7, 27)
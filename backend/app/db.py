@@ -0,0 +1,378 @@
+"""
+Shared PostgreSQL connection pool used by the storage and ai routers, plus
+helpers that run queries on a dedicated executor so async handlers never block
+the event loop.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
+import metrics
+import psycopg2
+import querylog
+from psycopg2 import extensions
+from log import get_logger
+
+from constants import (
+    DB_CONNECT_TIMEOUT,
+    DB_POOL_MAX_IDLE,
+    DB_POOL_MAX_LIFETIME,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_TIMEOUT,
+    db_config,
+)
+
+logger = get_logger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became available within the pool timeout."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+
+    Up to max_size connections are open at once; callers beyond that wait for
+    one to be returned (at most timeout seconds). Connections older than
+    max_lifetime, or idle for longer than max_idle while the pool holds more
+    than min_size, are closed and replaced on the next checkout.
+    """
+
+    def __init__(self, min_size, max_size, timeout, max_lifetime, max_idle, **connect_kwargs):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self._connect_kwargs = connect_kwargs
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = deque()  # (conn, returned_at), most recently used on the right
+        self._born = {}  # id(conn) -> creation time
+        self._closed = False
+
+        self._in_use = 0
+        self._checkouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._recycled = 0
+
+    def open(self):
+        """Eagerly opens min_size connections."""
+
+        for _ in range(self.min_size):
+            conn = self._connect()
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._connect_kwargs)
+        with self._lock:
+            self._born[id(conn)] = time.monotonic()
+            self._created += 1
+        return conn
+
+    def _discard(self, conn):
+        """Closes a connection and forgets about it. Caller must hold the lock."""
+
+        self._born.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_stale(self, conn, returned_at, now):
+        if conn.closed:
+            return True
+        if self.max_lifetime and now - self._born.get(id(conn), now) > self.max_lifetime:
+            return True
+        return bool(
+            self.max_idle
+            and now - returned_at > self.max_idle
+            and len(self._born) > self.min_size
+        )
+
+    def getconn(self):
+        """
+        Checks out a connection, waiting for a free slot if necessary.
+        @raises PoolTimeout: If no connection is released within the pool timeout.
+        """
+
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(
+                f"No database connection available after {self.timeout}s "
+                f"(pool size {self.max_size})"
+            )
+        waited = time.monotonic() - started
+
+        conn = None
+        try:
+            with self._lock:
+                now = time.monotonic()
+                while self._idle:
+                    candidate, returned_at = self._idle.pop()
+                    if self._is_stale(candidate, returned_at, now):
+                        self._discard(candidate)
+                        self._recycled += 1
+                        continue
+                    conn = candidate
+                    break
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        metrics.DB_POOL_WAIT.observe(waited)
+        return conn
+
+    def putconn(self, conn):
+        """Returns a connection to the pool, rolling back any open transaction."""
+
+        discard = conn.closed or self._closed
+        if not discard:
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+
+        with self._lock:
+            self._in_use -= 1
+            if discard:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Context manager that checks out a connection and always returns it."""
+
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def close(self):
+        """Closes every idle connection; busy ones are closed when returned."""
+
+        with self._lock:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+
+    def stats(self):
+        """Returns a snapshot of pool usage and checkout wait times."""
+
+        with self._lock:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "open": len(self._born),
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "wait_seconds_total": round(self._wait_total, 6),
+                "wait_seconds_avg": (
+                    round(self._wait_total / self._checkouts, 6) if self._checkouts else 0.0
+                ),
+                "wait_seconds_max": round(self._wait_max, 6),
+                "timeouts": self._timeouts,
+                "connections_created": self._created,
+                "connections_recycled": self._recycled,
+            }
+
+
+_pool = None
+_executor = None
+
+
+def open_pool():
+    """Creates the application-wide pool and its executor. Called once at startup."""
+
+    global _pool, _executor
+    if _pool is not None:
+        return _pool
+
+    pool = ConnectionPool(
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        timeout=DB_POOL_TIMEOUT,
+        max_lifetime=DB_POOL_MAX_LIFETIME,
+        max_idle=DB_POOL_MAX_IDLE,
+        connect_timeout=DB_CONNECT_TIMEOUT,
+        cursor_factory=querylog.TimingCursor,
+        **db_config,
+    )
+    pool.open()
+    _pool = pool
+    # One thread per connection: blocking queries never wait on the event
+    # loop, and threads never pile up waiting for a pool slot.
+    _executor = ThreadPoolExecutor(
+        max_workers=DB_POOL_MAX_SIZE, thread_name_prefix="db"
+    )
+    logger.info("Database pool opened (min=%d, max=%d)", DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE)
+    return _pool
+
+
+def close_pool():
+    """Closes the application-wide pool. Called once at shutdown."""
+
+    global _pool, _executor
+    if _pool is None:
+        return
+    _executor.shutdown(wait=True)
+    _executor = None
+    _pool.close()
+    _pool = None
+    logger.info("Database pool closed")
+
+
+def get_pool():
+    if _pool is None:
+        raise RuntimeError("Database pool has not been opened")
+    return _pool
+
+
+@contextmanager
+def connection():
+    """Borrows a connection from the shared pool for the duration of the block."""
+
+    with get_pool().connection() as conn:
+        yield conn
+
+
+def pool_stats():
+    """Returns the shared pool statistics, or None if it is not open."""
+
+    return _pool.stats() if _pool is not None else None
+
+
+def _query_name(fn):
+    """Default metrics name of a database operation: its function's qualified name."""
+
+    return getattr(fn, "__qualname__", repr(fn)).replace(".<locals>", "")
+
+
+def _observe(name, started, cur):
+    metrics.DB_QUERY_DURATION.observe(time.perf_counter() - started, query=name)
+    if cur.rowcount > 0:
+        metrics.DB_QUERY_ROWS.inc(cur.rowcount, query=name)
+
+
+def _run_in_transaction(fn, *args, name=None):
+    with connection() as conn:
+        started = time.perf_counter()
+        with conn.cursor() as cur:
+            result = fn(cur, *args)
+            conn.commit()
+            _observe(name or _query_name(fn), started, cur)
+        return result
+
+
+def _run_autocommit(fn, *args, name=None):
+    with connection() as conn:
+        conn.autocommit = True
+        started = time.perf_counter()
+        try:
+            with conn.cursor() as cur:
+                result = fn(cur, *args)
+                _observe(name or _query_name(fn), started, cur)
+                return result
+        finally:
+            conn.autocommit = False
+
+
+def run_sync(fn, *args, name=None):
+    """Blocking counterpart of run(): runs fn(cursor, *args) in one transaction on this thread."""
+
+    return _run_in_transaction(fn, *args, name=name)
+
+
+async def run(fn, *args, name=None):
+    """
+    Runs fn(cursor, *args) on the database executor inside one transaction.
+    The transaction is committed if fn returns and rolled back if it raises.
+    @param fn: Blocking function receiving a cursor as its first argument.
+    @param name: Name of the operation in the query metrics (default: fn's name).
+    """
+
+    if _executor is None:
+        raise RuntimeError("Database pool has not been opened")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor, partial(_run_in_transaction, fn, *args, name=name)
+    )
+
+
+async def fetch_all(query, params=None, name="fetch_all"):
+    """
+    Executes a query without blocking the event loop and returns all rows.
+    @param name: Name of the query in the query metrics.
+    """
+
+    def _fetch(cur):
+        cur.execute(query, params)
+        return cur.fetchall()
+
+    return await run(_fetch, name=name)
+
+
+async def fetch_one(query, params=None, autocommit=False, name="fetch_one"):
+    """
+    Executes a query without blocking the event loop and returns the first row.
+    @param autocommit: Run the statement in its own implicit transaction, saving
+    the BEGIN/COMMIT round-trips and releasing row locks as soon as it finishes.
+    @param name: Name of the query in the query metrics.
+    """
+
+    def _fetch(cur):
+        cur.execute(query, params)
+        return cur.fetchone()
+
+    if not autocommit:
+        return await run(_fetch, name=name)
+    if _executor is None:
+        raise RuntimeError("Database pool has not been opened")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(_run_autocommit, _fetch, name=name))
+
+
+async def execute(query, params=None, name="execute"):
+    """
+    Executes and commits a statement, returning the affected row count.
+    @param name: Name of the statement in the query metrics.
+    """
+
+    def _execute(cur):
+        cur.execute(query, params)
+        return cur.rowcount
+
+    return await run(_execute, name=name)
@@ -0,0 +1,235 @@
+"""
+Vectorized forecasting engine for large catalogs.
+
+Every model here runs on a products x periods matrix at once: the time
+recursion is a Python loop over periods, but each step updates all series and
+all candidate parameter sets together as NumPy arrays. For each series the
+engine keeps, per model family, the parameters with the lowest in-sample
+one-step mean squared error, then picks the family with the lowest error
+(squared rather than absolute error, which would favour forecasting zero for
+intermittent series):
+
+- ses: simple exponential smoothing (level only)
+- holt_winters: additive trend and seasonality (plain Holt when the history
+  is shorter than two seasons)
+- croston: Croston's method for intermittent demand
+- tsb: Teunter-Syntetos-Babai, Croston with a decaying demand probability
+
+Intervals are yhat +/- Z_80 * sigma, sigma being the standard deviation of the
+chosen model's one-step residuals; 80% matches Prophet's default interval width.
+"""
+
+import numpy as np
+
+Z_80 = 1.2816
+
+MODELS = ("ses", "holt_winters", "croston", "tsb")
+
+# Grades de parâmetros avaliadas para cada série
+SES_ALPHAS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 0.9)
+HW_ALPHAS = (0.1, 0.3, 0.5)
+HW_BETAS = (0.01, 0.1)
+HW_GAMMAS = (0.05, 0.2, 0.4)
+CROSTON_ALPHAS = (0.05, 0.1, 0.2, 0.3)
+TSB_ALPHAS = (0.05, 0.1, 0.2, 0.3)
+TSB_BETAS = (0.05, 0.1, 0.2, 0.3)
+
+# Séries processadas por bloco, limitando a memória dos estados (estação x combinações x séries)
+BLOCK_SIZE = 2048
+
+
+def _grid(*axes):
+    """Cartesian product of parameter axes, one (combinations, 1) column per axis."""
+
+    mesh = np.meshgrid(*[np.asarray(axis, dtype=float) for axis in axes], indexing="ij")
+    return [m.reshape(-1, 1) for m in mesh]
+
+
+class _Scores:
+    """Accumulates squared one-step errors of (combinations, series) candidates over the evaluation window."""
+
+    def __init__(self, shape, start):
+        self.start = start
+        self.sq_error = np.zeros(shape)
+        self.count = 0
+
+    def add(self, t, error):
+        if t >= self.start:
+            self.sq_error += error * error
+            self.count += 1
+
+    def best(self):
+        """
+        @return: (index of the best combination per series, its MSE).
+        """
+
+        mse = self.sq_error / max(self.count, 1)
+        best = np.argmin(mse, axis=0)
+        return best, mse[best, np.arange(mse.shape[1])]
+
+
+def _pick(state, best):
+    """Selects each series' state for its best combination."""
+
+    return state[best, np.arange(state.shape[1])]
+
+
+def _ses(Y, periods, start):
+    (alpha,) = _grid(SES_ALPHAS)
+    level = np.broadcast_to(Y[:, 0], (len(alpha), Y.shape[0])).copy()
+    scores = _Scores(level.shape, start)
+
+    for t in range(1, Y.shape[1]):
+        error = Y[:, t] - level
+        scores.add(t, error)
+        level += alpha * error
+
+    best, mse = scores.best()
+    path = np.repeat(_pick(level, best)[:, None], periods, axis=1)
+    return path, mse
+
+
+def _holt_winters(Y, periods, season_length, start):
+    alpha, beta, gamma = _grid(HW_ALPHAS, HW_BETAS, HW_GAMMAS)
+    n_series, n_periods = Y.shape
+    shape = (len(alpha), n_series)
+
+    if season_length is not None:
+        m = season_length
+        first = Y[:, :m].mean(axis=1)
+        level = np.broadcast_to(first, shape).copy()
+        trend = np.broadcast_to((Y[:, m:2 * m].mean(axis=1) - first) / m, shape).copy()
+        season = np.broadcast_to((Y[:, :m] - first[:, None]).T[:, None, :], (m,) + shape).copy()
+        begin = m
+    else:
+        # Sem histórico para duas estações: Holt com tendência, sem sazonalidade
+        m = 1
+        level = np.broadcast_to(Y[:, 0], shape).copy()
+        trend = np.broadcast_to(Y[:, 1] - Y[:, 0], shape).copy()
+        season = np.zeros((1,) + shape)
+        gamma = np.zeros_like(gamma)
+        begin = 1
+
+    scores = _Scores(shape, start)
+    for t in range(begin, n_periods):
+        y = Y[:, t]
+        s = season[t % m]
+        error = y - (level + trend + s)
+        scores.add(t, error)
+
+        new_level = alpha * (y - s) + (1 - alpha) * (level + trend)
+        trend = beta * (new_level - level) + (1 - beta) * trend
+        season[t % m] = gamma * (y - new_level) + (1 - gamma) * s
+        level = new_level
+
+    best, mse = scores.best()
+    level, trend = _pick(level, best), _pick(trend, best)
+    season = season[:, best, np.arange(n_series)].T
+    steps = np.arange(1, periods + 1)
+    path = level[:, None] + trend[:, None] * steps + season[:, (n_periods + steps - 1) % m]
+    return path, mse
+
+
+def _demand_start(Y):
+    """Initial demand size and interval from each series' non-zero periods."""
+
+    nonzero = Y > 0
+    hits = nonzero.sum(axis=1)
+    size = np.where(hits > 0, np.where(nonzero, Y, 0).sum(axis=1) / np.maximum(hits, 1), 1.0)
+    interval = Y.shape[1] / np.maximum(hits, 1)
+    return size, interval, hits / Y.shape[1]
+
+
+def _croston(Y, periods, start):
+    (alpha,) = _grid(CROSTON_ALPHAS)
+    shape = (len(alpha), Y.shape[0])
+    size, interval, _ = _demand_start(Y)
+    size = np.broadcast_to(size, shape).copy()
+    interval = np.broadcast_to(interval, shape).copy()
+    since_last = np.ones(shape)
+    scores = _Scores(shape, start)
+
+    for t in range(Y.shape[1]):
+        y = Y[:, t]
+        scores.add(t, y - size / interval)
+
+        demand = y > 0
+        size = np.where(demand, size + alpha * (y - size), size)
+        interval = np.where(demand, interval + alpha * (since_last - interval), interval)
+        since_last = np.where(demand, 1, since_last + 1)
+
+    best, mse = scores.best()
+    rate = _pick(size, best) / _pick(interval, best)
+    return np.repeat(rate[:, None], periods, axis=1), mse
+
+
+def _tsb(Y, periods, start):
+    alpha, beta = _grid(TSB_ALPHAS, TSB_BETAS)
+    shape = (len(alpha), Y.shape[0])
+    size, _, probability = _demand_start(Y)
+    size = np.broadcast_to(size, shape).copy()
+    probability = np.broadcast_to(probability, shape).copy()
+    scores = _Scores(shape, start)
+
+    for t in range(Y.shape[1]):
+        y = Y[:, t]
+        scores.add(t, y - probability * size)
+
+        demand = y > 0
+        probability = probability + beta * (demand - probability)
+        size = np.where(demand, size + alpha * (y - size), size)
+
+    best, mse = scores.best()
+    rate = _pick(probability, best) * _pick(size, best)
+    return np.repeat(rate[:, None], periods, axis=1), mse
+
+
+def _forecast_block(Y, periods, season_length):
+    n_periods = Y.shape[1]
+    if season_length is not None and n_periods < 2 * season_length:
+        season_length = None
+    # Todas as famílias são comparadas na mesma janela de avaliação
+    start = season_length if season_length is not None else 1
+
+    candidates = [
+        _ses(Y, periods, start),
+        _holt_winters(Y, periods, season_length, start),
+        _croston(Y, periods, start),
+        _tsb(Y, periods, start),
+    ]
+    paths = np.stack([c[0] for c in candidates])
+    mse = np.stack([c[1] for c in candidates])
+
+    best = np.argmin(mse, axis=0)
+    columns = np.arange(Y.shape[0])
+    return paths[best, columns], np.sqrt(mse[best, columns]), best
+
+
+def forecast_matrix(Y, periods, season_length=None):
+    """
+    Forecasts every row of Y.
+    @param Y: (series, periods) array of demand, gap-filled with zeros. Needs at least 2 periods.
+    @param periods: Number of future periods to forecast.
+    @param season_length: Periods per season (52 for weeks, 12 for months), or None.
+    @return: Dict of (series, periods) arrays yhat, yhat_lower and yhat_upper,
+    non-negative and rounded, plus the chosen model name per series.
+    """
+
+    Y = np.asarray(Y, dtype=float)
+    if Y.ndim != 2 or Y.shape[1] < 2:
+        raise ValueError("Y must be a (series, periods) matrix with at least 2 periods")
+
+    yhat = np.empty((Y.shape[0], periods))
+    sigma = np.empty(Y.shape[0])
+    chosen = np.empty(Y.shape[0], dtype=int)
+    for first in range(0, Y.shape[0], BLOCK_SIZE):
+        block = slice(first, first + BLOCK_SIZE)
+        yhat[block], sigma[block], chosen[block] = _forecast_block(Y[block], periods, season_length)
+
+    half_width = Z_80 * sigma[:, None]
+    return {
+        "yhat": np.round(np.clip(yhat, 0, None)),
+        "yhat_lower": np.round(np.clip(yhat - half_width, 0, None)),
+        "yhat_upper": np.round(np.clip(yhat + half_width, 0, None)),
+        "model": np.asarray(MODELS)[chosen],
+    }
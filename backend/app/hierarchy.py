@@ -0,0 +1,85 @@
+"""
+Top-down hierarchical forecasting.
+
+A handful of aggregate series (one per category or country) is forecast along
+with their total. The total forecast is then split among the groups in
+proportion to the groups' own forecasts (or to their historical shares in
+periods where they forecast nothing), so the groups add up to the total; and
+each product's forecast is its historical share of its group times that
+group's forecast, so the products of a group add up to the group. Shares are
+proportions of historical averages over the last `history` periods.
+
+Shares live in a (groups, products) matrix: a product belongs to one category
+but may sell in many countries, and disaggregation is a single matrix product
+either way.
+"""
+
+import numpy as np
+
+
+def group_index(keys):
+    """
+    Maps each product's group key to a group number.
+    @return: (sorted group labels, (products,) array of group numbers).
+    """
+
+    labels, index = np.unique(np.asarray(keys, dtype=object).astype(str), return_inverse=True)
+    return labels.tolist(), index
+
+
+def group_series(Y, index, groups):
+    """Sums the (products, periods) matrix Y into (groups, periods) by group number."""
+
+    totals = np.zeros((groups, Y.shape[1]))
+    np.add.at(totals, index, Y)
+    return totals
+
+
+def group_shares(Y, index, groups, history):
+    """
+    Each product's share of its group over the last `history` periods, as a
+    (groups, products) matrix. Groups without sales in that window get no shares.
+    """
+
+    # Devoluções podem deixar o saldo negativo: esses produtos ficam sem participação
+    window = np.clip(Y[:, -history:].sum(axis=1), 0, None)
+    group_totals = np.bincount(index, weights=window, minlength=groups)
+    shares = np.zeros((groups, Y.shape[0]))
+    columns = np.arange(Y.shape[0])
+    shares[index, columns] = np.divide(
+        window, group_totals[index], out=np.zeros_like(window), where=group_totals[index] > 0
+    )
+    return shares
+
+
+def normalize_shares(volumes):
+    """Turns a (groups, products) matrix of sales volumes into per-group shares."""
+
+    volumes = np.clip(volumes, 0, None)
+    totals = volumes.sum(axis=1, keepdims=True)
+    return np.divide(volumes, totals, out=np.zeros_like(volumes), where=totals > 0)
+
+
+def disaggregate(shares, forecast):
+    """
+    Splits (groups, periods) forecasts into (products, periods) forecasts.
+    @param shares: (groups, products) matrix whose rows sum to 1 (or 0).
+    """
+
+    return shares.T @ forecast
+
+
+def forecast_proportions(forecast, fallback):
+    """
+    Each group's proportion of the groups' summed forecast, per period.
+    @param forecast: (groups, periods) forecasts of the groups.
+    @param fallback: (groups,) shares used in periods where no group forecasts sales.
+    @return: (groups, periods) proportions; times a total forecast, they split it
+    among the groups.
+    """
+
+    forecast = np.clip(forecast, 0, None)
+    totals = forecast.sum(axis=0)
+    proportions = np.divide(forecast, totals, out=np.zeros_like(forecast), where=totals > 0)
+    proportions[:, totals <= 0] = np.asarray(fallback, dtype=float)[:, None]
+    return proportions
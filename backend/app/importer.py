@@ -0,0 +1,600 @@
+"""
+Resumable bulk import of sales CSVs (the layout of sales_transaction.csv).
+
+The file is read in chunks of IMPORT_CHUNK_ROWS records. Each chunk is
+COPYed into the unlogged import_staging table by one of IMPORT_WORKERS
+threads, each on its own connection, and committed together with its
+import_chunk checkpoint. Once the whole file is staged, missing products are
+created from it and the chunks are applied to sales_transaction one
+transaction per chunk, each commit also marking its chunk as applied.
+
+Running the import again for the same, unchanged file resumes it: staged
+chunks are not copied again (unless a crash emptied the unlogged table) and
+applied chunks are not applied again. Only one import runs at a time.
+
+Usage: python importer.py [FILE] [--chunk-rows N] [--workers N] [--restart]
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import db
+import partitions
+from fastapi import APIRouter, HTTPException
+from jobs import JobQueueFull, job_manager
+from log import get_logger
+from pydantic import BaseModel
+
+from constants import IMPORT_CHUNK_ROWS, IMPORT_DIR, IMPORT_WORKERS
+
+logger = get_logger(__name__)
+
+router = APIRouter(prefix="/import", tags=["import"])
+
+DEFAULT_FILE = "sales_transaction.csv"
+
+# Chave do advisory lock que garante uma importação por vez
+_LOCK_KEY = 0x53544F52
+
+_COPY_SQL = """
+COPY import_staging (import_id, chunk_no, transaction_no, transaction_date, product_no,
+                     product_name, price, quantity, customer_no, country)
+FROM STDIN WITH (FORMAT csv, NULL 'NA')
+"""
+
+
+class ImportInProgress(Exception):
+    """Raised when an import starts while another one holds the import lock."""
+
+
+class ImportCreate(BaseModel):
+    """Expected format for starting an import of a CSV file in IMPORT_DIR."""
+
+    file: str = DEFAULT_FILE
+    chunk_rows: int = IMPORT_CHUNK_ROWS
+    workers: int = IMPORT_WORKERS
+    restart: bool = False
+
+
+def _records(f):
+    """
+    Yields the CSV records of f as raw text, one per record. A record spans
+    several lines when a quoted field contains line breaks.
+    """
+
+    pending = []
+    quotes = 0
+    for line in f:
+        if not line.endswith("\n"):
+            line += "\n"
+        if not pending and line.count('"') % 2 == 0:
+            if line.strip():
+                yield line
+            continue
+        pending.append(line)
+        quotes += line.count('"')
+        if quotes % 2 == 0:
+            yield "".join(pending)
+            pending, quotes = [], 0
+    if pending:
+        yield "".join(pending)
+
+
+def _chunks(path, chunk_rows):
+    """Yields (chunk number, list of raw records) for the file, skipping its header."""
+
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        records = _records(f)
+        next(records, None)
+        chunk = []
+        chunk_no = 0
+        for record in records:
+            chunk.append(record)
+            if len(chunk) == chunk_rows:
+                yield chunk_no, chunk
+                chunk, chunk_no = [], chunk_no + 1
+        if chunk:
+            yield chunk_no, chunk
+
+
+def _start_run(cur, path, chunk_rows, restart):
+    """
+    Resumes the last unfinished import of this exact file, or registers a new one.
+    @return: (import_id, {chunk_no: rows} of staged chunks, set of applied chunks).
+    """
+
+    stat = os.stat(path)
+    source = os.path.abspath(path)
+    cur.execute(
+        """
+        SELECT import_id
+        FROM import_run
+        WHERE source = %s AND source_size = %s AND source_mtime = %s
+          AND chunk_rows = %s AND status <> 'completed'
+        ORDER BY import_id DESC
+        LIMIT 1
+        """,
+        (source, stat.st_size, stat.st_mtime, chunk_rows),
+    )
+    row = cur.fetchone()
+
+    if row is not None and not restart:
+        import_id = row[0]
+        cur.execute(
+            "UPDATE import_run SET status = 'running', error = NULL WHERE import_id = %s",
+            (import_id,),
+        )
+        cur.execute(
+            "SELECT chunk_no, rows, applied_at IS NOT NULL FROM import_chunk WHERE import_id = %s",
+            (import_id,),
+        )
+        chunks = cur.fetchall()
+
+        # Tabelas UNLOGGED são esvaziadas após um crash: chunks pendentes cujo
+        # staging sumiu são copiados de novo
+        cur.execute(
+            "SELECT chunk_no, COUNT(*) FROM import_staging WHERE import_id = %s GROUP BY chunk_no",
+            (import_id,),
+        )
+        present = dict(cur.fetchall())
+        applied = {chunk_no for chunk_no, _, done in chunks if done}
+        staged = {
+            chunk_no: rows
+            for chunk_no, rows, done in chunks
+            if done or present.get(chunk_no) == rows
+        }
+        return import_id, staged, applied
+
+    if row is not None:
+        cur.execute("DELETE FROM import_staging WHERE import_id = %s", (row[0],))
+        cur.execute(
+            "UPDATE import_run SET status = 'failed', error = 'restarted' WHERE import_id = %s",
+            (row[0],),
+        )
+    cur.execute(
+        """
+        INSERT INTO import_run (source, source_size, source_mtime, chunk_rows)
+        VALUES (%s, %s, %s, %s)
+        RETURNING import_id
+        """,
+        (source, stat.st_size, stat.st_mtime, chunk_rows),
+    )
+    return cur.fetchone()[0], {}, set()
+
+
+def _stage_chunk(cur, import_id, chunk_no, records):
+    """COPYs one chunk into import_staging and records its checkpoint."""
+
+    prefix = f"{import_id},{chunk_no},"
+    buffer = io.StringIO("".join(prefix + record for record in records))
+
+    cur.execute(
+        "DELETE FROM import_staging WHERE import_id = %s AND chunk_no = %s",
+        (import_id, chunk_no),
+    )
+    cur.copy_expert(_COPY_SQL, buffer)
+    cur.execute(
+        """
+        INSERT INTO import_chunk (import_id, chunk_no, rows)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (import_id, chunk_no) DO UPDATE
+        SET rows = EXCLUDED.rows, staged_at = now()
+        """,
+        (import_id, chunk_no, len(records)),
+    )
+    cur.execute(
+        """
+        UPDATE import_run
+        SET rows_read = (SELECT SUM(rows) FROM import_chunk WHERE import_id = %s)
+        WHERE import_id = %s
+        """,
+        (import_id, import_id),
+    )
+    return len(records)
+
+
+def _prepare_targets(cur, import_id):
+    """Creates the products and the monthly partitions the staged sales need."""
+
+    cur.execute(
+        """
+        INSERT INTO product (product_no, product_name, price, quantity)
+        SELECT
+            product_no,
+            product_name,
+            COALESCE(price, 0),
+            COALESCE(SUM(quantity), 0)
+        FROM import_staging
+        WHERE import_id = %s AND product_no IS NOT NULL AND product_name IS NOT NULL
+        GROUP BY product_no, product_name, price
+        ON CONFLICT (product_no) DO NOTHING
+        """,
+        (import_id,),
+    )
+    products = cur.rowcount
+
+    # Partições mensais para todo o período do arquivo
+    partitions.lock(cur)
+    cur.execute(
+        """
+        SELECT ensure_sales_transaction_partitions(
+            MIN(TO_DATE(transaction_date, 'MM/DD/YYYY')),
+            MAX(TO_DATE(transaction_date, 'MM/DD/YYYY'))
+        )
+        FROM import_staging
+        WHERE import_id = %s AND transaction_date IS NOT NULL
+        HAVING COUNT(*) > 0
+        """,
+        (import_id,),
+    )
+    return products
+
+
+def _apply_chunk(cur, import_id, chunk_no):
+    """Inserts one staged chunk into sales_transaction and marks it as applied."""
+
+    # Uma venda por (transaction_no, product_no), a primeira do arquivo, e só
+    # se a chave ainda não existe em sale_key (migração 0010)
+    cur.execute(
+        """
+        WITH staged AS (
+            SELECT DISTINCT ON (transaction_no, product_no)
+                transaction_no,
+                TO_DATE(transaction_date, 'MM/DD/YYYY') AS transaction_date,
+                customer_no,
+                country,
+                product_no,
+                COALESCE(quantity, 0) AS quantity,
+                COALESCE(price, 0) AS price_at_sale
+            FROM import_staging
+            WHERE import_id = %s AND chunk_no = %s
+              AND transaction_no IS NOT NULL AND product_no IS NOT NULL
+              AND transaction_date IS NOT NULL
+            ORDER BY transaction_no, product_no, ctid
+        ), claimed AS (
+            INSERT INTO sale_key (transaction_no, product_no)
+            SELECT transaction_no, product_no FROM staged
+            ON CONFLICT DO NOTHING
+            RETURNING transaction_no, product_no
+        )
+        INSERT INTO sales_transaction (transaction_no, transaction_date, customer_no, country, product_no, quantity, price_at_sale)
+        SELECT s.transaction_no, s.transaction_date, s.customer_no, s.country,
+               s.product_no, s.quantity, s.price_at_sale
+        FROM staged s
+        JOIN claimed c USING (transaction_no, product_no)
+        """,
+        (import_id, chunk_no),
+    )
+    inserted = cur.rowcount
+    cur.execute(
+        "DELETE FROM import_staging WHERE import_id = %s AND chunk_no = %s",
+        (import_id, chunk_no),
+    )
+    cur.execute(
+        """
+        UPDATE import_chunk SET applied_at = now(), inserted = %s
+        WHERE import_id = %s AND chunk_no = %s
+        RETURNING rows
+        """,
+        (inserted, import_id, chunk_no),
+    )
+    rows = cur.fetchone()[0]
+    cur.execute(
+        "UPDATE import_run SET rows_applied = rows_applied + %s WHERE import_id = %s",
+        (rows, import_id),
+    )
+    return rows, inserted
+
+
+def _finish_run(cur, import_id, status, error=None):
+    cur.execute(
+        "UPDATE import_run SET status = %s, error = %s, finished_at = now() WHERE import_id = %s",
+        (status, error, import_id),
+    )
+
+
+def _stage_file(path, import_id, staged, chunk_rows, workers, progress):
+    """
+    Stages every chunk not staged yet, `workers` chunks at a time.
+    @return: ({chunk_no: rows} of all chunks, rows copied by this call).
+    """
+
+    chunks = dict(staged)
+    copied = 0
+    started = time.monotonic()
+    pending = {}
+
+    def _collect(done):
+        nonlocal copied
+        for future in done:
+            chunk_no = pending.pop(future)
+            chunks[chunk_no] = future.result()
+            copied += chunks[chunk_no]
+            elapsed = time.monotonic() - started
+            logger.info(
+                "Import %s: staged chunk %s (%d rows, %.0f rows/s)",
+                import_id,
+                chunk_no,
+                copied,
+                copied / elapsed,
+            )
+            if progress is not None:
+                progress(len(chunks), None)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="import") as executor:
+        for chunk_no, records in _chunks(path, chunk_rows):
+            if chunk_no in staged:
+                continue
+            # Limita os chunks lidos e ainda não copiados, e a memória que ocupam
+            if len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                _collect(done)
+            future = executor.submit(db.run_sync, _stage_chunk, import_id, chunk_no, records)
+            pending[future] = chunk_no
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            _collect(done)
+
+    return chunks, copied
+
+
+def run_import(
+    path,
+    chunk_rows=IMPORT_CHUNK_ROWS,
+    workers=IMPORT_WORKERS,
+    restart=False,
+    progress=None,
+):
+    """
+    Imports a sales CSV, resuming an unfinished import of the same file.
+    Blocking; needs the database pool to be open.
+    @param restart: Discard the unfinished import of this file and start over.
+    @param progress: Optional callback progress(done, total) counting staged
+    and applied chunks (total is None until the whole file has been read).
+    @return: Summary with the import id, row counts and throughput.
+    @raises ImportInProgress: If another import is running.
+    """
+
+    if chunk_rows < 1 or workers < 1:
+        raise ValueError("chunk_rows and workers must be >= 1")
+    # Cada worker usa uma conexão do pool; o lock e a aplicação dos chunks, mais duas
+    workers = min(workers, max(1, db.get_pool().max_size - 2))
+
+    with db.connection() as lock_conn:
+        lock_conn.autocommit = True
+        try:
+            with lock_conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (_LOCK_KEY,))
+                if not cur.fetchone()[0]:
+                    raise ImportInProgress("Another import is already running")
+            try:
+                return _run_locked(path, chunk_rows, workers, restart, progress)
+            finally:
+                with lock_conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (_LOCK_KEY,))
+        finally:
+            lock_conn.autocommit = False
+
+
+def _run_locked(path, chunk_rows, workers, restart, progress):
+    started = time.monotonic()
+    import_id, staged, applied = db.run_sync(_start_run, path, chunk_rows, restart)
+    resumed = bool(staged)
+    if resumed:
+        logger.info(
+            "Import %s of %s: resuming, %d chunks already staged", import_id, path, len(staged)
+        )
+    else:
+        logger.info("Import %s of %s: starting", import_id, path)
+
+    try:
+        chunks, copied = _stage_file(path, import_id, staged, chunk_rows, workers, progress)
+        total = 2 * len(chunks)
+        products = db.run_sync(_prepare_targets, import_id)
+
+        rows_applied = inserted = 0
+        apply_started = time.monotonic()
+        for chunk_no in sorted(chunks):
+            if chunk_no in applied:
+                continue
+            rows, chunk_inserted = db.run_sync(_apply_chunk, import_id, chunk_no)
+            rows_applied += rows
+            inserted += chunk_inserted
+            applied.add(chunk_no)
+            elapsed = time.monotonic() - apply_started
+            logger.info(
+                "Import %s: applied chunk %s (%d rows, %.0f rows/s)",
+                import_id,
+                chunk_no,
+                rows_applied,
+                rows_applied / elapsed,
+            )
+            if progress is not None:
+                progress(len(chunks) + len(applied), total)
+
+        db.run_sync(_finish_run, import_id, "completed")
+    except Exception as e:
+        logger.error("Import %s failed: %s", import_id, e)
+        db.run_sync(_finish_run, import_id, "failed", str(e))
+        raise
+
+    elapsed = time.monotonic() - started
+    rows = sum(chunks.values())
+    logger.info(
+        "Import %s complete: %d rows, %d new sales, %d new products in %.1fs",
+        import_id,
+        rows,
+        inserted,
+        products,
+        elapsed,
+    )
+    return {
+        "import_id": import_id,
+        "resumed": resumed,
+        "chunks": len(chunks),
+        "rows": rows,
+        "rows_copied": copied,
+        "rows_applied": rows_applied,
+        "sales_inserted": inserted,
+        "products_inserted": products,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(rows_applied / elapsed, 1) if elapsed else None,
+    }
+
+
+def resolve_file(name):
+    """
+    Path of a file inside IMPORT_DIR.
+    @raises HTTPException: If the name leaves IMPORT_DIR or the file does not exist.
+    """
+
+    base = os.path.abspath(IMPORT_DIR)
+    path = os.path.abspath(os.path.join(base, name))
+    if os.path.dirname(path) != base:
+        raise HTTPException(
+            status_code=400, detail="file must be a file name inside the import directory"
+        )
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"File not found: {name}")
+    return path
+
+
+def needs_import(cur, path):
+    """
+    Whether startup should import path: the catalog is empty or an import of
+    this file was interrupted.
+    """
+
+    cur.execute("SELECT EXISTS (SELECT 1 FROM product)")
+    if not cur.fetchone()[0]:
+        return True
+    cur.execute(
+        "SELECT EXISTS (SELECT 1 FROM import_run WHERE source = %s AND status <> 'completed')",
+        (os.path.abspath(path),),
+    )
+    return cur.fetchone()[0]
+
+
+def submit_import(path, chunk_rows=IMPORT_CHUNK_ROWS, workers=IMPORT_WORKERS, restart=False):
+    """
+    Queues an import as a background job. Must be called from the event loop.
+    @raises JobQueueFull: If the job queue is full.
+    """
+
+    async def _run(job):
+        return await job_manager.run_blocking(
+            run_import, path, chunk_rows, workers, restart, job.progress
+        )
+
+    params = {
+        "file": os.path.basename(path),
+        "chunk_rows": chunk_rows,
+        "workers": workers,
+        "restart": restart,
+    }
+    return job_manager.submit("import", params, _run)
+
+
+@router.post("", status_code=202)
+async def start_import(request: ImportCreate):
+    """
+    Imports a sales CSV from the import directory in the background, resuming
+    an interrupted import of the same file unless restart is set.
+    Poll GET /import/jobs/{id} for progress and GET /import/runs for checkpoints.
+    """
+
+    if request.chunk_rows < 1 or request.workers < 1:
+        raise HTTPException(status_code=400, detail="chunk_rows and workers must be >= 1")
+    path = resolve_file(request.file)
+
+    try:
+        job = submit_import(path, request.chunk_rows, request.workers, request.restart)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "10"})
+    return job.to_dict(include_result=False)
+
+
+@router.get("/jobs/{job_id}")
+def get_import_job(job_id: str):
+    """Returns an import job's status and progress, plus its result once it has finished."""
+
+    job = job_manager.get(job_id)
+    if job is None or job.kind != "import":
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@router.get("/runs")
+async def list_imports(limit: int = 20):
+    """Lists the latest imports with their progress in chunks and rows."""
+
+    rows = await db.fetch_all(
+        """
+        SELECT r.import_id, r.source, r.status, r.error, r.chunk_rows, r.rows_read,
+               r.rows_applied, COUNT(c.chunk_no), COUNT(c.applied_at),
+               r.started_at, r.finished_at
+        FROM import_run r
+        LEFT JOIN import_chunk c ON c.import_id = r.import_id
+        GROUP BY r.import_id
+        ORDER BY r.import_id DESC
+        LIMIT %s
+        """,
+        (limit,),
+        name="list_imports",
+    )
+    return [
+        {
+            "import_id": row[0],
+            "file": os.path.basename(row[1]),
+            "status": row[2],
+            "error": row[3],
+            "chunk_rows": row[4],
+            "rows_read": row[5],
+            "rows_applied": row[6],
+            "chunks_staged": row[7],
+            "chunks_applied": row[8],
+            "started_at": row[9],
+            "finished_at": row[10],
+        }
+        for row in rows
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import a sales CSV into the database.")
+    parser.add_argument("file", nargs="?", default=os.path.join(IMPORT_DIR, DEFAULT_FILE))
+    parser.add_argument("--chunk-rows", type=int, default=IMPORT_CHUNK_ROWS)
+    parser.add_argument("--workers", type=int, default=IMPORT_WORKERS)
+    parser.add_argument(
+        "--restart", action="store_true", help="discard an unfinished import of the file"
+    )
+    args = parser.parse_args(argv)
+
+    import migrations
+
+    db.open_pool()
+    try:
+        with db.connection() as conn:
+            migrations.run_migrations(conn)
+        summary = run_import(args.file, args.chunk_rows, args.workers, args.restart)
+    except ImportInProgress as e:
+        logger.error("%s", e)
+        return 1
+    finally:
+        db.close_pool()
+
+    logger.info(
+        "Imported %d rows at %s rows/s (import %s)",
+        summary["rows"],
+        summary["rows_per_second"],
+        summary["import_id"],
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
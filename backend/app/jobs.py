@@ -0,0 +1,185 @@
+"""
+Background jobs for long-running forecasts.
+
+A job is submitted, gets an id and runs on the event loop as an asyncio task,
+so no HTTP request stays open while it works. Blocking work inside a job goes
+to the job executor, a thread pool separate from the one serving the regular
+endpoints. At most JOB_WORKERS jobs run at once and at most JOB_QUEUE_SIZE
+may be queued or running; beyond that, submissions are refused. Finished jobs
+are kept for JOB_RESULT_TTL seconds so their results can be polled.
+"""
+
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from log import get_logger
+
+from constants import JOB_QUEUE_SIZE, JOB_RESULT_TTL, JOB_WORKERS
+
+logger = get_logger(__name__)
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the queue is at its depth limit."""
+
+
+class Job:
+    """State of one submitted job, updated by the task running it."""
+
+    def __init__(self, kind, params):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = "queued"
+        self.done = 0
+        self.total = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.task = None
+
+    def progress(self, done, total):
+        """Progress callback handed to the job function."""
+
+        self.done = done
+        self.total = total
+
+    def to_dict(self, include_result=True):
+        data = {
+            "id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "status": self.status,
+            "progress": {"done": self.done, "total": self.total},
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if include_result:
+            data["result"] = self.result
+        return data
+
+
+class JobManager:
+    """Bounded registry and runner of background jobs."""
+
+    def __init__(self, workers, queue_size, result_ttl):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.result_ttl = result_ttl
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._slots = None
+        self._executor = None
+
+    def _active(self):
+        """Caller must hold the lock."""
+
+        return sum(1 for job in self._jobs.values() if job.status in ("queued", "running"))
+
+    def _prune(self, now):
+        """Caller must hold the lock."""
+
+        expired = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.result_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def submit(self, kind, params, fn):
+        """
+        Queues fn to run in the background. Must be called from the event loop.
+        @param fn: Coroutine function called as fn(job) that returns the job result;
+        it may report progress through job.progress(done, total).
+        @return: The queued Job.
+        @raises JobQueueFull: If JOB_QUEUE_SIZE jobs are already queued or running.
+        """
+
+        job = Job(kind, params)
+        with self._lock:
+            self._prune(time.time())
+            if self._active() >= self.queue_size:
+                raise JobQueueFull(f"{self.queue_size} jobs already queued or running")
+            if self._slots is None:
+                self._slots = asyncio.Semaphore(self.workers)
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="job"
+                )
+            self._jobs[job.id] = job
+
+        job.task = asyncio.get_running_loop().create_task(self._run(job, fn))
+        logger.info("Job %s (%s) queued", job.id, kind)
+        return job
+
+    async def _run(self, job, fn):
+        async with self._slots:
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                job.result = await fn(job)
+                job.status = "succeeded"
+            except asyncio.CancelledError:
+                job.status = "cancelled"
+                raise
+            except Exception as e:
+                job.status = "failed"
+                job.error = getattr(e, "detail", None) or str(e) or type(e).__name__
+                logger.error("Job %s (%s) failed: %s", job.id, job.kind, job.error)
+            finally:
+                job.finished_at = time.time()
+                job.task = None
+
+        logger.info(
+            "Job %s (%s) %s in %.2fs",
+            job.id,
+            job.kind,
+            job.status,
+            job.finished_at - job.started_at,
+        )
+
+    async def run_blocking(self, fn, *args):
+        """Runs a blocking function on the job executor and awaits its result."""
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def get(self, job_id):
+        """Returns the job with this id, or None if unknown or expired."""
+
+        with self._lock:
+            self._prune(time.time())
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            statuses = {}
+            for job in self._jobs.values():
+                statuses[job.status] = statuses.get(job.status, 0) + 1
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "active": self._active(),
+                "jobs": statuses,
+            }
+
+    def shutdown(self):
+        """Cancels unfinished jobs and stops the executor. Called once at shutdown."""
+
+        with self._lock:
+            tasks = [job.task for job in self._jobs.values() if job.task is not None]
+            executor, self._executor = self._executor, None
+        for task in tasks:
+            task.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+job_manager = JobManager(JOB_WORKERS, JOB_QUEUE_SIZE, JOB_RESULT_TTL)
@@ -1,11 +1,207 @@
 """
 Logging configuration for our backend
+
+Callers only build a LogRecord and put it on a queue; a QueueListener thread
+formats it and writes it to stdout (and LOG_FILE, if set), so neither message
+formatting nor I/O happen on the request path. Pass arguments instead of
+formatting the message yourself (logger.info("Job %s done", job_id)): they are
+merged into the message only for records that pass the level and sampling
+filters, and the listener does the rest of the formatting. After stop()
+(at exit), records are written directly by the caller.
+
+Modules log through get_logger(__name__), so every record names its module
+without the stack walk that file/line/function need; that walk only happens
+with LOG_CALLER set.
+
+Settings (see constants.py): LOG_LEVEL and per-logger LOG_LEVELS, LOG_FORMAT
+text or json, LOG_CALLER to include file, line and function, and
+LOG_DEBUG_SAMPLE to keep only a fraction of the DEBUG records.
 """
 
+import atexit
+import copy
+import json
 import logging
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="[%(levelname)s - %(filename)s:%(lineno)d:%(funcName)s()] %(message)s",
+from constants import (
+    LOG_CALLER,
+    LOG_DEBUG_SAMPLE,
+    LOG_FILE,
+    LOG_FORMAT,
+    LOG_LEVEL,
+    LOG_LEVELS,
 )
+
+TEXT_FORMAT = "[%(levelname)s - %(name)s] %(message)s"
+CALLER_FORMAT = "[%(levelname)s - %(filename)s:%(lineno)d:%(funcName)s()] %(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log collectors."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+        }
+        if LOG_CALLER:
+            entry["file"] = record.filename
+            entry["line"] = record.lineno
+            entry["function"] = record.funcName
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DebugSampler(logging.Filter):
+    """Keeps a `rate` fraction of the DEBUG records and every record above DEBUG."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class LevelFilter(logging.Filter):
+    """
+    Enforces the LOG_LEVELS minimums on records reaching the root handler, for
+    libraries that reset their logger's level when imported (cmdstanpy sets
+    DEBUG on first import, after this module has run).
+    """
+
+    def __init__(self, levels):
+        super().__init__()
+        # Mais específico primeiro: "a.b" antes de "a"
+        self.levels = sorted(
+            ((name, logging.getLevelName(level)) for name, level in levels.items()),
+            key=lambda item: -len(item[0]),
+        )
+
+    def filter(self, record):
+        for name, level in self.levels:
+            if record.name == name or record.name.startswith(name + "."):
+                return record.levelno >= level
+        return True
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    Queues a copy of the record with its arguments merged into the message, so
+    later changes to mutable arguments do not show up in the log. Unlike the
+    default prepare(), the format string (timestamp, JSON, traceback) is left to
+    the listener; the queue is in-process, so the record needs no pickling.
+    """
+
+    def prepare(self, record):
+        # Só chega aqui depois dos filtros de nível e amostragem
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+
+def _formatter():
+    if LOG_FORMAT == "json":
+        return JsonFormatter()
+    return logging.Formatter(CALLER_FORMAT if LOG_CALLER else TEXT_FORMAT)
+
+
+def _handlers():
+    formatter = _formatter()
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if LOG_FILE:
+        handlers.append(logging.FileHandler(LOG_FILE, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+def _parse_levels(spec):
+    """
+    Parses "name=LEVEL,name=LEVEL" into a dict.
+    @raises ValueError: If an entry has no '='.
+    """
+
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, sep, level = item.partition("=")
+        if not sep:
+            raise ValueError(f"Invalid LOG_LEVELS entry: {item!r}")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def _configure():
+    if not LOG_CALLER:
+        # Sem isso o logging percorre a pilha em toda chamada para achar
+        # arquivo/linha/função, que os formatos sem LOG_CALLER não mostram
+        logging._srcfile = None
+
+    levels = _parse_levels(LOG_LEVELS)
+    handler = _DeferredQueueHandler(queue.SimpleQueue())
+    if levels:
+        handler.addFilter(LevelFilter(levels))
+    if LOG_DEBUG_SAMPLE < 1:
+        handler.addFilter(DebugSampler(LOG_DEBUG_SAMPLE))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    listener = QueueListener(handler.queue, *_handlers(), respect_handler_level=True)
+    listener.start()
+    return handler, listener
+
+
+_queue_handler, _listener = _configure()
+_listener_lock = threading.Lock()
+
+
+def stop():
+    """
+    Flushes the queued records and stops the listener thread; records logged
+    afterwards go straight to the listener's handlers. Safe to call more than once.
+    """
+
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            return
+        for handler in _listener.handlers:
+            for log_filter in _queue_handler.filters:
+                handler.addFilter(log_filter)
+        # Troca a lista inteira: nenhum registro fica sem handler nem sai duas vezes
+        logging.getLogger().handlers = list(_listener.handlers)
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop)
+
 logger = logging.getLogger(__name__)
+
+
+def get_logger(name):
+    """
+    Logger of a backend module, named after it (get_logger(__name__)). It is a
+    child of this module's logger, so a LOG_LEVELS entry for "log" covers the
+    whole backend.
+    """
+
+    return logger.getChild(name)
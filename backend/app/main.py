@@ -1,13 +1,25 @@
-import os
+import hmac
+from typing import Optional
 
 import ai
-import psycopg2
+import db
+import importer
+import jobs
+import log
+import metrics
+import querylog
+import startup
 import storage
 import uvicorn
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 
-from log import logger
+from log import get_logger
+
+from constants import ADMIN_TOKEN
+
+logger = get_logger(__name__)
 
 app = FastAPI(
     title="Stooorage Backend",
@@ -27,142 +39,32 @@ app.add_middleware(
     allow_headers=["*"],  # Permite todos os headers
 )
 
+app.add_middleware(metrics.MetricsMiddleware)
+
 app.include_router(storage.router)
 app.include_router(ai.router)
+app.include_router(importer.router)
 
 
 @app.on_event("startup")
-def config():
-    """
-    Sets up PostgreSQL
-    """
-    sql_file_path = "../database/schema.sql"
-    csv_path = "../database/sales_transaction.csv"
-
-    logger.info("Attempting to connect to PostgreSQL...")
-    for _ in range(10):
-        try:
-            conn = psycopg2.connect(**storage.db_config)
-            conn.close()
-            logger.info("PostgreSQL is available.")
-            break
-        except psycopg2.OperationalError as e:
-            logger.warning(
-                f"PostgreSQL not available yet ({e}), retrying in 1 seconds..."
-            )
-            import time
-
-            time.sleep(1)
-    try:
-        with psycopg2.connect(**storage.db_config) as conn:
-            with conn.cursor() as cur:
-                logger.info("Connected to PostgreSQL successfully.")
-                logger.info("Setting up the database schema...")
-
-                sql_file_path = "../database/schema.sql"
-                logger.info(f"Executing SQL file: {sql_file_path}")
-
-                with open(sql_file_path, "r") as sql_file:
-                    sql_content = sql_file.read()
-
-                cur.execute(sql_content)
-                conn.commit()
-                logger.info("Database schema has been set up successfully.")
-                cur.execute("SELECT COUNT(*) FROM product;")
-                existing = cur.fetchone()[0]
-                if existing > 0:
-                    logger.info(
-                        f"Skipping population (product table already has {existing} rows)."
-                    )
-                    return
-
-                # 3. Populate (Python version of populate.sql)
-                if not os.path.isfile(csv_path):
-                    logger.warning(f"CSV not found, skipping population: {csv_path}")
-                    return
-
-                logger.info("Populating database with sample data...")
-
-                # staging table
-                cur.execute("DROP TABLE IF EXISTS staging_sales;")
-                cur.execute(
-                    """
-                    CREATE TABLE staging_sales (
-                        transaction_no   VARCHAR(10),
-                        transaction_date TEXT,
-                        product_no       VARCHAR(10),
-                        product_name     TEXT,
-                        price            NUMERIC(10,2),
-                        quantity         INT,
-                        customer_no      INT,
-                        country          TEXT
-                    );
-                    """
-                )
-
-                copy_sql = """
-                COPY staging_sales(transaction_no, transaction_date, product_no, product_name, price, quantity, customer_no, country)
-                FROM STDIN WITH (FORMAT csv, HEADER true, DELIMITER ',', NULL 'NA')
-                """
-                with open(csv_path, "r", encoding="utf-8") as f:
-                    cur.copy_expert(copy_sql, f)
-
-                # Aggregate into product
-                cur.execute(
-                    """
-                    INSERT INTO product (product_no, product_name, price, quantity)
-                    SELECT
-                        product_no,
-                        product_name,
-                        COALESCE(price, 0),
-                        COALESCE(SUM(quantity), 0)
-                    FROM staging_sales
-                    WHERE product_no IS NOT NULL AND product_name IS NOT NULL
-                    GROUP BY product_no, product_name, price
-                    ON CONFLICT (product_no) DO NOTHING;
-                    """
-                )
-
-                # Insert sales transactions
-                cur.execute(
-                    """
-                    INSERT INTO sales_transaction (transaction_no, transaction_date, customer_no, country, product_no, quantity, price_at_sale)
-                    SELECT
-                        transaction_no,
-                        TO_DATE(transaction_date, 'MM/DD/YYYY'),
-                        customer_no,
-                        country,
-                        product_no,
-                        COALESCE(quantity, 0),
-                        COALESCE(price, 0)
-                    FROM staging_sales
-                    WHERE transaction_no IS NOT NULL AND product_no IS NOT NULL
-                    ON CONFLICT (transaction_no, product_no) DO NOTHING;
-                    """
-                )
-
-                # Cleanup staging
-                cur.execute("DROP TABLE staging_sales;")
-
-                # Counts
-                cur.execute("SELECT COUNT(*) FROM product;")
-                pcount = cur.fetchone()[0]
-                cur.execute("SELECT COUNT(*) FROM sales_transaction;")
-                scount = cur.fetchone()[0]
-
-                conn.commit()
-                logger.info(
-                    f"Population complete: product={pcount}, sales_transaction={scount}"
-                )
-
-    except FileNotFoundError:
-        logger.error(f"SQL file not found: {sql_file_path}")
-    except psycopg2.Error as e:
-        logger.error(f"Database error: {e}")
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}")
+async def config():
+    """
+    Sets up PostgreSQL (on one worker at a time) in the background and, if the
+    database is empty, starts importing the sample data
+    """
+    startup.start()
 
-    logger.info("Database setup completed")
+
+@app.on_event("shutdown")
+def shutdown():
+    """
+    Releases the shared database pool and the forecast workers, then flushes the logs
+    """
+    startup.stop()
+    jobs.job_manager.shutdown()
+    ai.shutdown_process_pool()
+    db.close_pool()
+    log.stop()
 
 
 @app.get("/")
@@ -173,5 +75,98 @@ def root():
     return {"message": "hello World!"}
 
 
+@app.get("/health/live")
+def liveness():
+    """
+    Liveness probe: the process is up and serving requests
+    """
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+async def readiness():
+    """
+    Readiness probe: startup finished the database setup and PostgreSQL answers
+    (503 with status "starting" while the setup runs, "retrying" after it failed
+    and until a new attempt succeeds)
+    """
+    if not startup.state["ready"]:
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "status": "retrying" if startup.state["error"] else "starting",
+                "error": startup.state["error"],
+            },
+        )
+    try:
+        await db.fetch_one("SELECT 1", autocommit=True, name="health_ready")
+    except Exception as e:
+        logger.warning("Readiness check failed: %s", e)
+        raise HTTPException(
+            status_code=503, detail={"status": "unavailable", "error": str(e).strip()}
+        ) from e
+    return {
+        "status": "ready",
+        "leader": startup.state["leader"],
+        "import_job": startup.state["import_job"],
+    }
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """
+    Request, query, connection pool and forecast metrics in the Prometheus text format
+    """
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def require_admin(authorization: Optional[str] = Header(None)):
+    """
+    Guards diagnostic endpoints that expose query data: they need ADMIN_TOKEN
+    as a bearer token, and are disabled while it is not configured
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Disabled: ADMIN_TOKEN is not configured")
+    if authorization is None or not hmac.compare_digest(
+        authorization.encode(), f"Bearer {ADMIN_TOKEN}".encode()
+    ):
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid or missing admin token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+@app.get("/db/queries", dependencies=[Depends(require_admin)])
+def slowest_queries(limit: int = 20, order: str = "total"):
+    """
+    Query shapes with the highest total, max or mean execution time, with the
+    parameters (redacted unless SLOW_QUERY_LOG_PARAMS is set) and EXPLAIN plan
+    of their last slow call. Requires the admin token
+    """
+    if order not in ("total", "max", "mean") or limit < 1:
+        raise HTTPException(status_code=400, detail="order must be total, max or mean")
+    return querylog.stats.top(limit, order)
+
+
+@app.delete("/db/queries", status_code=204, dependencies=[Depends(require_admin)])
+def reset_query_stats():
+    """
+    Clears the query statistics. Requires the admin token
+    """
+    querylog.stats.reset()
+
+
+@app.get("/db/pool")
+def database_pool():
+    """
+    Reports connection pool usage and how long requests waited for a connection
+    """
+    stats = db.pool_stats()
+    if stats is None:
+        raise HTTPException(status_code=503, detail="Database pool is not open")
+    return stats
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
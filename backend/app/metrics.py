@@ -0,0 +1,227 @@
+"""
+In-process metrics exposed at /metrics in the Prometheus text format.
+
+Counters, gauges and histograms are plain Python objects guarded by a lock;
+recording a value is a dict lookup, a bisect over the bucket bounds and a few
+additions, cheap enough to leave on for every request and query. Each worker
+process keeps its own values, so with several workers every scrape reads the
+worker that answered it (as prometheus_client does outside multiprocess mode).
+
+Metrics:
+- http_requests_in_flight, http_request_duration_seconds{method,route,status}
+- db_query_duration_seconds{query}, db_query_rows_total{query}
+- db_pool_wait_seconds
+- forecast_fit_seconds{kind}, forecast_predict_seconds{kind}
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Limites padrão dos buckets (segundos), os mesmos do cliente oficial
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Ajustes e previsões do Prophet levam de décimos de segundo a minutos
+FORECAST_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_registry = []
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        if not self.label_names:
+            self._values[()] = self._initial()
+        _registry.append(self)
+
+    def _initial(self):
+        return 0
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labels)
+
+    def _initial(self):
+        # Contagem por bucket (o último é +Inf) e soma das observações
+        return [[0] * (len(self.buckets) + 1), 0.0]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = self._initial()
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the duration of the with block."""
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(
+                (key, (list(counts), total)) for key, (counts, total) in self._values.items()
+            )
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = ("le", _format_value(bound) if bound == float("inf") else repr(bound))
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}"
+                )
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being served.")
+HTTP_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time to serve an HTTP request, until its last body chunk is sent.",
+    ("method", "route", "status"),
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Time spent running a named database operation, excluding the pool wait.",
+    ("query",),
+)
+DB_QUERY_ROWS = Counter(
+    "db_query_rows_total",
+    "Rows returned or affected by the last statement of a named database operation.",
+    ("query",),
+)
+DB_POOL_WAIT = Histogram(
+    "db_pool_wait_seconds", "Time spent waiting for a pooled database connection."
+)
+FORECAST_FIT = Histogram(
+    "forecast_fit_seconds", "Prophet model fit time.", ("kind",), FORECAST_BUCKETS
+)
+FORECAST_PREDICT = Histogram(
+    "forecast_predict_seconds", "Prophet predict time.", ("kind",), FORECAST_BUCKETS
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the in-flight gauge and the request duration
+    histogram. Requests are labeled by route template (/products/{id}, not the
+    actual path), so the number of series stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            HTTP_DURATION.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status,
+            )
@@ -0,0 +1,161 @@
+"""
+Versioned schema migrations.
+
+Migrations are the NNNN_description.sql files in database/migrations, applied
+in version order and recorded in schema_migrations so each runs exactly once.
+A file whose first line is "-- migrate:no-transaction" runs outside a
+transaction, one statement at a time, which CREATE INDEX CONCURRENTLY
+requires; such files must contain only plain ;-terminated statements.
+"""
+
+import hashlib
+import os
+import re
+from dataclasses import dataclass
+
+from psycopg2 import extensions
+from log import get_logger
+
+logger = get_logger(__name__)
+
+MIGRATIONS_DIR = "../database/migrations"
+NO_TRANSACTION_MARKER = "-- migrate:no-transaction"
+
+_FILENAME_PATTERN = re.compile(r"^(\d+)_([\w-]+)\.sql$")
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    sql: str
+    checksum: str
+    transactional: bool
+
+
+def discover(path=MIGRATIONS_DIR):
+    """Returns the migrations found in path, ordered by version."""
+
+    migrations = []
+    for filename in os.listdir(path):
+        match = _FILENAME_PATTERN.match(filename)
+        if not match:
+            continue
+        with open(os.path.join(path, filename), "r", encoding="utf-8") as f:
+            sql = f.read()
+        migrations.append(
+            Migration(
+                version=int(match.group(1)),
+                name=match.group(2),
+                sql=sql,
+                checksum=hashlib.sha256(sql.encode()).hexdigest(),
+                transactional=not sql.lstrip().startswith(NO_TRANSACTION_MARKER),
+            )
+        )
+
+    migrations.sort(key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Duplicate migration versions in {path}")
+    return migrations
+
+
+def _statements(sql):
+    """Splits a no-transaction migration into individual statements."""
+
+    lines = [line for line in sql.splitlines() if not line.strip().startswith("--")]
+    return [s.strip() for s in "\n".join(lines).split(";") if s.strip()]
+
+
+def _ensure_table(conn):
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version    INT PRIMARY KEY,
+                name       TEXT NOT NULL,
+                checksum   TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            """
+        )
+    conn.commit()
+
+
+def applied_versions(conn):
+    """Returns {version: checksum} for every migration already applied."""
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT version, checksum FROM schema_migrations")
+        rows = cur.fetchall()
+    conn.commit()
+    return dict(rows)
+
+
+def _record(cur, migration):
+    cur.execute(
+        "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+        (migration.version, migration.name, migration.checksum),
+    )
+
+
+def _apply(conn, migration):
+    if migration.transactional:
+        with conn.cursor() as cur:
+            cur.execute(migration.sql)
+            _record(cur, migration)
+        conn.commit()
+        return
+
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for statement in _statements(migration.sql):
+                cur.execute(statement)
+            _record(cur, migration)
+    finally:
+        conn.autocommit = False
+
+
+def run_migrations(conn, path=MIGRATIONS_DIR):
+    """
+    Applies every pending migration in order.
+    @param conn: Connection with no open transaction.
+    @return: List of versions applied by this call.
+    """
+
+    if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+        conn.commit()
+
+    _ensure_table(conn)
+    done = applied_versions(conn)
+    applied_now = []
+
+    for migration in discover(path):
+        if migration.version in done:
+            if done[migration.version] != migration.checksum:
+                logger.warning(
+                    "Migration %s_%s changed after being applied", migration.version, migration.name
+                )
+            continue
+
+        logger.info("Applying migration %s_%s", migration.version, migration.name)
+        try:
+            _apply(conn, migration)
+        except Exception:
+            conn.rollback()
+            if not migration.transactional:
+                logger.error(
+                    "Migration %s_%s failed outside a transaction; drop any INVALID "
+                    "index it left before retrying",
+                    migration.version,
+                    migration.name,
+                )
+            raise
+        applied_now.append(migration.version)
+
+    if applied_now:
+        logger.info("Applied migrations: %s", applied_now)
+    else:
+        logger.info("Database schema is up to date")
+    return applied_now
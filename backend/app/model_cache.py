@@ -0,0 +1,194 @@
+"""
+Cache of fitted forecast models.
+
+Models are keyed by what they forecast (scope, series and frequency) and
+stored together with a watermark describing the data they were fitted on.
+A lookup only hits when the watermark still matches, so a model is refit
+exactly when its input series changed; the outdated model stays available
+through previous() so the refit can start from its parameters. An outdated
+model read from disk by get() or is_current() is kept in memory, so the
+previous() that follows does not read it again. Recently used models stay in
+an in-memory LRU; every model is also written to disk so it survives restarts.
+Prophet is only imported when a model is actually loaded or saved.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from log import get_logger
+
+from constants import FORECAST_CACHE_DIR, FORECAST_CACHE_SIZE
+
+logger = get_logger(__name__)
+
+
+class ModelCache:
+    """Thread-safe LRU of fitted Prophet models backed by JSON files."""
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (watermark, model)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get(self, key, watermark):
+        """
+        Returns the model fitted for key on data matching watermark, or None.
+        @param key: Hashable identifying the series and model configuration.
+        @param watermark: String fingerprint of the model's input data.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == watermark:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        stored = self._read(key)
+        if stored is not None and stored.get("watermark") == watermark:
+            model = self._deserialize(key, stored)
+            if model is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._remember(key, watermark, model)
+                return model
+        elif stored is not None:
+            self._keep_previous(key, stored, entry)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def is_current(self, key, watermark):
+        """
+        Whether a model fitted on data matching watermark is stored, without
+        loading it; an outdated one is loaded and kept for previous().
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == watermark:
+                return True
+
+        stored = self._read(key)
+        if stored is None:
+            return False
+        if stored.get("watermark") == watermark:
+            return True
+        self._keep_previous(key, stored, entry)
+        return False
+
+    def previous(self, key):
+        """
+        Returns (watermark, model) for the last model stored under key,
+        whatever data it was fitted on, or None if there is none.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry
+
+        stored = self._read(key)
+        if stored is None:
+            return None
+        model = self._deserialize(key, stored)
+        return (stored.get("watermark"), model) if model is not None else None
+
+    def put(self, key, watermark, model):
+        """Stores a freshly fitted model in memory and on disk."""
+
+        with self._lock:
+            self._remember(key, watermark, model)
+        self._save(key, watermark, model)
+
+    def _keep_previous(self, key, stored, entry):
+        """
+        Keeps an outdated model read from disk in memory, where previous() finds
+        it, unless the memory entry already holds it.
+        """
+
+        if entry is not None and entry[0] == stored.get("watermark"):
+            return
+        model = self._deserialize(key, stored)
+        if model is not None:
+            with self._lock:
+                self._remember(key, stored.get("watermark"), model)
+
+    def _remember(self, key, watermark, model):
+        """Caller must hold the lock."""
+
+        self._entries[key] = (watermark, model)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _read(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Discarding unreadable cached model %s: %s", path, e)
+            return None
+
+    def _deserialize(self, key, stored):
+        from prophet.serialize import model_from_json
+
+        try:
+            return model_from_json(stored["model"])
+        except Exception as e:
+            logger.warning("Discarding incompatible cached model %s: %s", self._path(key), e)
+            return None
+
+    def _save(self, key, watermark, model):
+        from prophet.serialize import model_to_json
+
+        path = self._path(key)
+        tmp_path = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Nome único no mesmo diretório: dois workers (ou threads) salvando a
+            # mesma chave não escrevem no mesmo arquivo, e o os.replace é atômico
+            with tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", dir=self.directory, suffix=".tmp", delete=False
+            ) as f:
+                tmp_path = f.name
+                json.dump(
+                    {"key": repr(key), "watermark": watermark, "model": model_to_json(model)},
+                    f,
+                )
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Could not persist model to %s: %s", path, e)
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+
+model_cache = ModelCache(FORECAST_CACHE_DIR, FORECAST_CACHE_SIZE)
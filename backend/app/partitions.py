@@ -0,0 +1,145 @@
+"""
+Maintenance of the monthly sales_transaction partitions.
+
+Partitions are created by the ensure_sales_transaction_partitions() SQL
+function (migrations 0005 and 0009). Detached months become plain tables named
+sales_transaction_YYYY_MM that can be dumped or dropped without touching
+the live table; their sales are taken out of the rollups when detached.
+
+Usage: python partitions.py list | ensure | detach YYYY-MM
+"""
+
+import sys
+from datetime import date
+
+from log import get_logger
+
+from constants import CURRENT_DATE, SALES_PARTITION_MONTHS_AHEAD
+
+logger = get_logger(__name__)
+
+# Chave do advisory lock que serializa a criação de partições entre workers
+_LOCK_KEY = 0x53545054
+
+
+def lock(cur):
+    """
+    Serializes partition creation until the end of cur's transaction, so two
+    workers (or the importer and the periodic check) never create the same
+    month at once.
+    """
+
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (_LOCK_KEY,))
+
+
+def ensure_future_partitions(conn, months_ahead=SALES_PARTITION_MONTHS_AHEAD, today=None):
+    """
+    Creates the partitions for the current month and the next months_ahead
+    months, so inserts never land in the default partition. Runs at startup
+    and then every SALES_PARTITION_CHECK_INTERVAL seconds (see startup.py).
+    @param today: Current date; defaults to the app's simulated CURRENT_DATE,
+    not the database clock.
+    @return: Number of partitions created.
+    """
+
+    today = today or CURRENT_DATE
+    with conn.cursor() as cur:
+        lock(cur)
+        cur.execute(
+            """
+            SELECT ensure_sales_transaction_partitions(
+                %s, (%s::DATE + make_interval(months => %s))::DATE
+            )
+            """,
+            (today, today, months_ahead),
+        )
+        created = cur.fetchone()[0]
+    conn.commit()
+
+    if created:
+        logger.info("Created %d sales_transaction partition(s)", created)
+    return created
+
+
+def ensure_partitions_for_range(conn, first_day, last_day):
+    """Creates the monthly partitions covering [first_day, last_day]."""
+
+    with conn.cursor() as cur:
+        lock(cur)
+        cur.execute(
+            "SELECT ensure_sales_transaction_partitions(%s, %s)", (first_day, last_day)
+        )
+        created = cur.fetchone()[0]
+    conn.commit()
+    return created
+
+
+def list_partitions(conn):
+    """Returns (partition name, bounds expression, estimated rows) per attached partition."""
+
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT c.relname,
+                   pg_get_expr(c.relpartbound, c.oid),
+                   c.reltuples::BIGINT
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'sales_transaction'::regclass
+            ORDER BY c.relname
+            """
+        )
+        rows = cur.fetchall()
+    conn.commit()
+    return rows
+
+
+def detach_partition(conn, month: date):
+    """
+    Detaches one month from sales_transaction, leaving it as a standalone
+    table for archiving. No rows move; the month's totals are subtracted from
+    the sales rollups in the same transaction, so the dashboard and forecasts
+    stop counting it exactly when it leaves the table.
+    @param month: Any day of the month to detach.
+    @return: Name of the detached table.
+    """
+
+    name = f"sales_transaction_{month:%Y_%m}"
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass(%s)", (name,))
+        if cur.fetchone()[0] is None:
+            raise ValueError(f"Partition {name} does not exist")
+        cur.execute(f'ALTER TABLE sales_transaction DETACH PARTITION "{name}"')
+        # Arquivada, a tabela não deve mais mexer nos rollups se for truncada
+        cur.execute(f'DROP TRIGGER IF EXISTS sales_rollup_truncate ON "{name}"')
+        cur.execute("SELECT sales_rollup_subtract_table(%s::regclass)", (name,))
+    conn.commit()
+
+    logger.info("Detached partition %s", name)
+    return name
+
+
+if __name__ == "__main__":
+    import db
+
+    if (
+        len(sys.argv) < 2
+        or sys.argv[1] not in ("list", "ensure", "detach")
+        or (sys.argv[1] == "detach" and len(sys.argv) < 3)
+    ):
+        print(__doc__)
+        sys.exit(1)
+
+    db.open_pool()
+    try:
+        with db.connection() as conn:
+            if sys.argv[1] == "list":
+                for name, bounds, rows in list_partitions(conn):
+                    print(f"{name}\t{bounds}\t~{rows} rows")
+            elif sys.argv[1] == "ensure":
+                print(ensure_future_partitions(conn))
+            else:
+                month = date.fromisoformat(f"{sys.argv[2]}-01")
+                print(detach_partition(conn, month))
+    finally:
+        db.close_pool()
@@ -0,0 +1,279 @@
+"""
+Query profiling for every statement run through the shared pool.
+
+Pool connections use TimingCursor, which times each execute() and COPY and keeps
+per-shape statistics (count, total and max time, rows). A shape is the
+statement with whitespace collapsed and literals replaced by ?, so calls that
+differ only in their parameters add up together.
+
+Statements slower than SLOW_QUERY_MS are logged, with their parameters only if
+SLOW_QUERY_LOG_PARAMS is set (they may hold customer data). A
+SLOW_QUERY_EXPLAIN_SAMPLE fraction of the slow statements is handed to a
+background thread with a connection of its own, so the request that ran it does
+not wait. Plain SELECTs get EXPLAIN (ANALYZE, BUFFERS), with actual timings and
+buffer counts, run inside a READ ONLY transaction that is rolled back, so a
+SELECT that tries to write fails instead; those and every other statement
+(INSERT, UPDATE...) get plain EXPLAIN, which plans without executing. The plan
+is logged and kept with the shape's statistics. /db/queries lists the slowest
+shapes.
+"""
+
+import queue
+import random
+import re
+import threading
+import time
+from functools import lru_cache
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2 import Error as DatabaseError
+from log import get_logger
+
+from constants import (
+    DB_CONNECT_TIMEOUT,
+    QUERY_STATS_MAX_SHAPES,
+    SLOW_QUERY_EXPLAIN_SAMPLE,
+    SLOW_QUERY_LOG_PARAMS,
+    SLOW_QUERY_MS,
+    db_config,
+)
+
+logger = get_logger(__name__)
+
+_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s")
+_SPACE = re.compile(r"\s+")
+
+# Tamanho máximo dos parâmetros no log de consultas lentas
+_PARAMS_LOG_LIMIT = 500
+_REDACTED = "<redacted>"
+
+# Comandos que o EXPLAIN aceita; utilitários (BEGIN, COPY, SET...) ficam de fora
+_EXPLAINABLE = ("SELECT ", "WITH ", "INSERT ", "UPDATE ", "DELETE ")
+# Consultas lentas esperando EXPLAIN; além disso são descartadas
+_EXPLAIN_QUEUE_SIZE = 100
+# Limite de cada EXPLAIN na conexão de captura
+_EXPLAIN_TIMEOUT_MS = 5000
+
+
+@lru_cache(maxsize=1024)
+def shape(statement):
+    """Normalized form of a statement: no comments, literals and parameters as ?, single spaces."""
+
+    text = _COMMENT.sub(" ", statement)
+    text = _STRING.sub("?", text)
+    text = _PLACEHOLDER.sub("?", text)
+    text = _NUMBER.sub("?", text)
+    return _SPACE.sub(" ", text).strip()
+
+
+def _explainable(normalized):
+    return normalized.upper().startswith(_EXPLAINABLE)
+
+
+class QueryStats:
+    """Per-shape execution statistics, bounded to max_shapes distinct shapes."""
+
+    def __init__(self, max_shapes):
+        self.max_shapes = max_shapes
+        self._lock = threading.Lock()
+        self._shapes = {}
+        self._dropped = 0
+
+    def record(self, normalized, seconds, rows, slow):
+        with self._lock:
+            entry = self._shapes.get(normalized)
+            if entry is None:
+                if len(self._shapes) >= self.max_shapes:
+                    self._dropped += 1
+                    return
+                entry = self._shapes[normalized] = {
+                    "calls": 0,
+                    "slow_calls": 0,
+                    "total_seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "rows": 0,
+                    "last_slow_params": None,
+                    "last_plan": None,
+                }
+            entry["calls"] += 1
+            entry["total_seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            entry["rows"] += max(rows, 0)
+            if slow:
+                entry["slow_calls"] += 1
+
+    def annotate(self, normalized, params=None, plan=None):
+        """Attaches the parameters or plan of a slow call to its shape."""
+
+        with self._lock:
+            entry = self._shapes.get(normalized)
+            if entry is None:
+                return
+            if params is not None:
+                entry["last_slow_params"] = params
+            if plan is not None:
+                entry["last_plan"] = plan
+
+    def top(self, limit, order="total"):
+        """
+        The `limit` shapes with the highest total, max or mean time.
+        @param order: 'total', 'max' or 'mean'.
+        """
+
+        with self._lock:
+            items = [(query, dict(entry)) for query, entry in self._shapes.items()]
+            dropped = self._dropped
+
+        for _, entry in items:
+            entry["mean_seconds"] = entry["total_seconds"] / entry["calls"]
+        key = {"total": "total_seconds", "max": "max_seconds", "mean": "mean_seconds"}[order]
+        items.sort(key=lambda item: item[1][key], reverse=True)
+        return {
+            "threshold_ms": SLOW_QUERY_MS,
+            "shapes": len(self._shapes),
+            "dropped_shapes": dropped,
+            "queries": [{"query": query, **entry} for query, entry in items[:limit]],
+        }
+
+    def reset(self):
+        with self._lock:
+            self._shapes.clear()
+            self._dropped = 0
+
+
+stats = QueryStats(QUERY_STATS_MAX_SHAPES)
+
+
+def _analyze(cur, statement):
+    """
+    EXPLAIN (ANALYZE, BUFFERS) of a SELECT in a READ ONLY transaction that is
+    always rolled back.
+    @return: The plan, or None if the statement could not run read-only or in time.
+    """
+
+    cur.execute("BEGIN READ ONLY")
+    try:
+        cur.execute(b"EXPLAIN (ANALYZE, BUFFERS) " + statement)
+        return "\n".join(row[0] for row in cur.fetchall())
+    except psycopg2.OperationalError:
+        raise
+    except DatabaseError as e:
+        logger.debug("EXPLAIN ANALYZE not possible, using EXPLAIN: %s", e)
+        return None
+    finally:
+        cur.execute("ROLLBACK")
+        # Locks de sessão (pg_advisory_lock) não saem com o ROLLBACK
+        cur.execute("SELECT pg_advisory_unlock_all()")
+
+
+def _explain(conn, normalized, statement):
+    """
+    Returns the plan of statement (bytes, parameters already bound): executed
+    read-only for plain SELECTs, planned only otherwise.
+    """
+
+    with conn.cursor() as cur:
+        plan = None
+        if normalized.upper().startswith("SELECT "):
+            plan = _analyze(cur, statement)
+        if plan is None:
+            cur.execute(b"EXPLAIN " + statement)
+            plan = "\n".join(row[0] for row in cur.fetchall())
+    # O plano traz os valores literais da consulta
+    return plan if SLOW_QUERY_LOG_PARAMS else _STRING.sub("?", plan)
+
+
+def _connect():
+    conn = psycopg2.connect(**db_config, connect_timeout=DB_CONNECT_TIMEOUT)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("SET statement_timeout = %s", (_EXPLAIN_TIMEOUT_MS,))
+    return conn
+
+
+def _explain_worker():
+    """Runs the queued EXPLAINs on a dedicated connection, reconnecting when it breaks."""
+
+    conn = None
+    while True:
+        normalized, statement = _explain_queue.get()
+        try:
+            if conn is None or conn.closed:
+                conn = _connect()
+            plan = _explain(conn, normalized, statement)
+        except DatabaseError as e:
+            logger.warning("EXPLAIN of slow query failed: %s", e)
+            if isinstance(e, psycopg2.OperationalError) and conn is not None:
+                conn.close()
+            continue
+        stats.annotate(normalized, plan=plan)
+        logger.warning("Plan of slow query %s:\n%s", normalized, plan)
+
+
+_explain_queue = queue.Queue(maxsize=_EXPLAIN_QUEUE_SIZE)
+_explain_thread = None
+_explain_thread_lock = threading.Lock()
+
+
+def _schedule_explain(normalized, statement):
+    global _explain_thread
+    with _explain_thread_lock:
+        if _explain_thread is None:
+            _explain_thread = threading.Thread(
+                target=_explain_worker, name="query-explain", daemon=True
+            )
+            _explain_thread.start()
+    try:
+        _explain_queue.put_nowait((normalized, statement))
+    except queue.Full:
+        pass
+
+
+class TimingCursor(extensions.cursor):
+    """Cursor that times execute() and copy_expert() and reports them to the query statistics."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self._profile(query, vars, time.perf_counter() - started)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            self._profile(sql, None, time.perf_counter() - started)
+
+    def _profile(self, query, vars, seconds):
+        if isinstance(query, bytes):
+            query = query.decode()
+        text = query if isinstance(query, str) else query.as_string(self)
+        normalized = shape(text)
+        slow = seconds * 1000 >= SLOW_QUERY_MS
+        stats.record(normalized, seconds, self.rowcount, slow)
+        if not slow:
+            return
+
+        params = None
+        if vars is not None:
+            params = repr(vars)[:_PARAMS_LOG_LIMIT] if SLOW_QUERY_LOG_PARAMS else _REDACTED
+        stats.annotate(normalized, params=params)
+        logger.warning("Slow query (%.1f ms): %s params=%s", seconds * 1000, normalized, params)
+
+        if (
+            SLOW_QUERY_EXPLAIN_SAMPLE > 0
+            and _explainable(normalized)
+            and random.random() < SLOW_QUERY_EXPLAIN_SAMPLE
+        ):
+            try:
+                # Parâmetros ligados no cliente, como o psycopg2 já faz
+                statement = self.mogrify(text, vars)
+            except (DatabaseError, TypeError, ValueError):
+                return
+            _schedule_explain(normalized, statement)
@@ -0,0 +1,69 @@
+"""
+Reorder point, safety stock and order quantity for a whole catalog.
+
+Every quantity is computed for all products at once from (products, periods)
+forecast arrays. Per-period demand uncertainty is recovered from the
+forecast's 80% interval as sigma = (yhat_upper - yhat_lower) / (2 * 1.2816),
+and periods are treated as independent, so the uncertainty over n periods is
+the square root of the summed variances.
+
+With L the lead time and R the review period (both in forecast periods) and
+z the normal quantile of the service level:
+
+- safety_stock = z * sigma(L + R)
+- reorder_point = demand(L) + z * sigma(L)
+- order_up_to = demand(L + R) + safety_stock
+- order_quantity = order_up_to - on_hand, rounded up, never negative
+"""
+
+from statistics import NormalDist
+
+import numpy as np
+
+# Quantil normal do intervalo de 80% das previsões
+_Z_INTERVAL = 1.2816
+
+
+def plan(on_hand, yhat, yhat_lower, yhat_upper, lead_time, review_period, service_level):
+    """
+    @param on_hand: (products,) units in stock.
+    @param yhat: (products, periods) forecast demand, with periods >= lead_time + review_period.
+    @param service_level: Target probability of not running out during a cycle, in (0, 1).
+    @return: Dict of (products,) arrays, plus "order": product indices from most
+    to least urgent (fewest periods of cover beyond the lead time first).
+    """
+
+    horizon = lead_time + review_period
+    on_hand = np.asarray(on_hand, dtype=float)
+    yhat = np.asarray(yhat, dtype=float)[:, :horizon]
+    sigma = (np.asarray(yhat_upper, dtype=float) - np.asarray(yhat_lower, dtype=float))[:, :horizon]
+    variance = np.square(np.clip(sigma, 0, None) / (2 * _Z_INTERVAL))
+
+    z = NormalDist().inv_cdf(service_level)
+    lead_demand = yhat[:, :lead_time].sum(axis=1)
+    cycle_demand = yhat.sum(axis=1)
+    safety_stock = z * np.sqrt(variance.sum(axis=1))
+    reorder_point = lead_demand + z * np.sqrt(variance[:, :lead_time].sum(axis=1))
+    order_up_to = cycle_demand + safety_stock
+    order_quantity = np.ceil(np.clip(order_up_to - on_hand, 0, None))
+
+    # Períodos de cobertura: quantos períodos previstos o estoque atual atende
+    covered = np.cumsum(yhat, axis=1) <= on_hand[:, None]
+    cover = covered.sum(axis=1).astype(float)
+    rate = cycle_demand / horizon
+    beyond = covered.all(axis=1)
+    cover[beyond] = np.divide(
+        on_hand[beyond], rate[beyond], out=np.full(beyond.sum(), np.inf), where=rate[beyond] > 0
+    )
+
+    return {
+        "on_hand": on_hand,
+        "forecast_demand": cycle_demand,
+        "safety_stock": safety_stock,
+        "reorder_point": reorder_point,
+        "order_up_to": order_up_to,
+        "order_quantity": order_quantity,
+        "needs_reorder": on_hand <= reorder_point,
+        "periods_of_cover": cover,
+        "order": np.lexsort((-order_quantity, cover - lead_time)),
+    }
@@ -0,0 +1,197 @@
+"""
+Columnar loading of sales series for forecasting.
+
+Series come out of PostgreSQL already dense: every series gets one value per
+period between the first and last period, with 0 where nothing was sold
+(generate_series does the gap-filling). The values are streamed with
+COPY ... TO STDOUT as one number per line and parsed by NumPy in a single
+call, so no per-row Python objects are built.
+"""
+
+import io
+
+import numpy as np
+
+_STEP = {"week": "1 week", "month": "1 month"}
+
+
+def _copy_values(cur, query, params):
+    """Runs COPY (query) TO STDOUT for a single numeric column and parses it into a float array."""
+
+    buffer = io.StringIO()
+    cur.copy_expert(f"COPY ({cur.mogrify(query, params).decode()}) TO STDOUT", buffer)
+    data = buffer.getvalue()
+    if not data:
+        return np.empty(0)
+    return np.fromstring(data, dtype=float, sep="\n")
+
+
+def _period_starts(first, count, grain):
+    """The first day of each of the count periods starting at first."""
+
+    if grain == "month":
+        return np.arange(count) + np.datetime64(first, "M")
+    return np.datetime64(first, "D") + 7 * np.arange(count)
+
+
+def period_ends(starts, grain):
+    """
+    Last day of each period, the label pandas' 'W'/'M' resampling gives it,
+    as numpy datetime64[D].
+    """
+
+    if grain == "month":
+        return (starts.astype("datetime64[M]") + 1).astype("datetime64[D]") - 1
+    return starts.astype("datetime64[D]") + 6
+
+
+def load_product_matrix(cur, grain, product_no=None):
+    """
+    Loads per-product sales from sales_rollup_product as a dense matrix.
+    Products sharing a name are summed, as they are shown under one name.
+    Must run inside a transaction, which it should commit afterwards.
+    @param grain: 'week' or 'month'.
+    @param product_no: Load only this product instead of the whole catalog.
+    @return: (product names, period starts as datetime64, (products, periods) array).
+    """
+
+    cur.execute(
+        f"""
+        CREATE TEMP TABLE forecast_series ON COMMIT DROP AS
+        SELECT p.product_name AS name, r.period_start, SUM(r.quantity) AS quantity
+        FROM sales_rollup_product r
+        JOIN product p ON p.product_no = r.product_no
+        WHERE r.grain = %s {"AND r.product_no = %s" if product_no is not None else ""}
+        GROUP BY p.product_name, r.period_start
+        """,
+        (grain, product_no) if product_no is not None else (grain,),
+    )
+    cur.execute(
+        """
+        SELECT MIN(period_start),
+               MAX(period_start),
+               ARRAY(SELECT DISTINCT name FROM forecast_series ORDER BY name)
+        FROM forecast_series
+        """
+    )
+    first, last, names = cur.fetchone()
+    if first is None:
+        return [], np.empty(0, dtype="datetime64[D]"), np.empty((0, 0))
+
+    values = _copy_values(
+        cur,
+        """
+        SELECT COALESCE(s.quantity, 0)
+        FROM (SELECT DISTINCT name FROM forecast_series) n
+        CROSS JOIN generate_series(%s::DATE, %s::DATE, %s::INTERVAL) AS g(period_start)
+        LEFT JOIN forecast_series s
+               ON s.name = n.name AND s.period_start = g.period_start
+        ORDER BY n.name, g.period_start
+        """,
+        (first, last, _STEP[grain]),
+    )
+    periods = len(values) // len(names)
+    return names, _period_starts(first, periods, grain), values.reshape(len(names), periods)
+
+
+def load_total_series(cur, grain):
+    """
+    Loads total sales per period from sales_rollup_total, gap-filled with 0.
+    @return: (period starts as datetime64, values array).
+    """
+
+    cur.execute(
+        "SELECT MIN(period_start), MAX(period_start) FROM sales_rollup_total WHERE grain = %s",
+        (grain,),
+    )
+    first, last = cur.fetchone()
+    if first is None:
+        return np.empty(0, dtype="datetime64[D]"), np.empty(0)
+
+    values = _copy_values(
+        cur,
+        """
+        SELECT COALESCE(SUM(t.quantity), 0)
+        FROM generate_series(%s::DATE, %s::DATE, %s::INTERVAL) AS g(period_start)
+        LEFT JOIN sales_rollup_total t
+               ON t.grain = %s AND t.period_start = g.period_start
+        GROUP BY g.period_start
+        ORDER BY g.period_start
+        """,
+        (first, last, _STEP[grain], grain),
+    )
+    return _period_starts(first, len(values), grain), values
+
+
+def load_country_matrix(cur, grain, history):
+    """
+    Loads per-country sales from sales_transaction as a dense matrix, plus how
+    much of each product every country bought over the last `history` periods.
+    Must run inside a transaction, which it should commit afterwards.
+    @return: (countries, period starts as datetime64, (countries, periods) array,
+    product names, (countries, products) array of recent volumes).
+    """
+
+    cur.execute(
+        """
+        CREATE TEMP TABLE forecast_country_series ON COMMIT DROP AS
+        SELECT COALESCE(s.country, 'Unknown') AS country,
+               p.product_name AS name,
+               date_trunc(%s, s.transaction_date)::DATE AS period_start,
+               SUM(s.quantity) AS quantity
+        FROM sales_transaction s
+        JOIN product p ON p.product_no = s.product_no
+        GROUP BY 1, 2, 3
+        """,
+        (grain,),
+    )
+    cur.execute(
+        """
+        SELECT MIN(period_start),
+               MAX(period_start),
+               ARRAY(SELECT DISTINCT country FROM forecast_country_series ORDER BY country),
+               ARRAY(SELECT DISTINCT name FROM forecast_country_series ORDER BY name)
+        FROM forecast_country_series
+        """
+    )
+    first, last, countries, names = cur.fetchone()
+    if first is None:
+        return [], np.empty(0, dtype="datetime64[D]"), np.empty((0, 0)), [], np.empty((0, 0))
+
+    values = _copy_values(
+        cur,
+        """
+        SELECT COALESCE(SUM(s.quantity), 0)
+        FROM (SELECT DISTINCT country FROM forecast_country_series) c
+        CROSS JOIN generate_series(%s::DATE, %s::DATE, %s::INTERVAL) AS g(period_start)
+        LEFT JOIN forecast_country_series s
+               ON s.country = c.country AND s.period_start = g.period_start
+        GROUP BY c.country, g.period_start
+        ORDER BY c.country, g.period_start
+        """,
+        (first, last, _STEP[grain]),
+    )
+    periods = len(values) // len(countries)
+
+    cur.execute(
+        """
+        SELECT country, name, SUM(quantity)
+        FROM forecast_country_series
+        WHERE period_start > %s::DATE - %s * %s::INTERVAL
+        GROUP BY country, name
+        """,
+        (last, history, _STEP[grain]),
+    )
+    country_index = {country: i for i, country in enumerate(countries)}
+    name_index = {name: i for i, name in enumerate(names)}
+    volumes = np.zeros((len(countries), len(names)))
+    for country, name, quantity in cur.fetchall():
+        volumes[country_index[country], name_index[name]] = quantity
+
+    return (
+        countries,
+        _period_starts(first, periods, grain),
+        values.reshape(len(countries), periods),
+        names,
+        volumes,
+    )
@@ -0,0 +1,243 @@
+"""
+Startup coordination between API workers.
+
+With several uvicorn/gunicorn workers every one of them runs the startup hook.
+The database setup (migrations, future partitions and checking whether the
+sample data must be imported) runs under a PostgreSQL advisory lock: the first
+worker to take it is the leader and does the work; the others wait for the
+leader to release it, check that the schema is up to date and skip seeding. If
+the leader died half-way, the next worker to get the lock finishes the
+migrations.
+
+The setup runs in a background task, on a thread, so the server answers
+/health/live and /health/ready (503 until the setup is done) meanwhile. A
+failed setup (database down, a migration error) is retried with exponential
+backoff, up to STARTUP_RETRY_MAX seconds apart, until it succeeds or the
+server stops. The readiness state kept here backs /health/ready. Once ready, every worker checks
+the future sales partitions every SALES_PARTITION_CHECK_INTERVAL seconds, so a
+long-running server keeps SALES_PARTITION_MONTHS_AHEAD months ahead.
+"""
+
+import asyncio
+import os
+import time
+
+import db
+import importer
+import migrations
+import partitions
+import psycopg2
+from log import get_logger
+
+from constants import (
+    IMPORT_DIR,
+    IMPORT_ON_STARTUP,
+    SALES_PARTITION_CHECK_INTERVAL,
+    STARTUP_DB_WAIT,
+    STARTUP_LOCK_TIMEOUT,
+    STARTUP_RETRY_MAX,
+    db_config,
+)
+
+logger = get_logger(__name__)
+
+# Chave do advisory lock disputado pelos workers no startup
+_LOCK_KEY = 0x53544F53
+
+state = {"ready": False, "leader": None, "import_job": None, "error": None}
+
+_tasks = []
+
+
+def wait_for_database(timeout=STARTUP_DB_WAIT):
+    """
+    Waits until PostgreSQL accepts connections, retrying with exponential backoff.
+    @return: True if it became available within timeout seconds.
+    """
+
+    deadline = time.monotonic() + timeout
+    delay = 0.1
+    while True:
+        try:
+            psycopg2.connect(**db_config, connect_timeout=2).close()
+            return True
+        except psycopg2.OperationalError as e:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.error("PostgreSQL not available after %ss: %s", timeout, e)
+                return False
+            logger.warning("PostgreSQL not available yet (%s), retrying in %.1fs...", e, delay)
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 2.0)
+
+
+def _pending_import(conn):
+    """
+    The sample CSV to import, if the catalog is empty or an import was interrupted.
+    @return: Path of the CSV, or None if there is nothing to import.
+    """
+
+    if not IMPORT_ON_STARTUP:
+        return None
+    csv_path = os.path.join(IMPORT_DIR, importer.DEFAULT_FILE)
+    if not os.path.isfile(csv_path):
+        logger.warning("CSV not found, skipping population: %s", csv_path)
+        return None
+    with conn.cursor() as cur:
+        pending = importer.needs_import(cur, csv_path)
+    conn.commit()
+    if not pending:
+        logger.info("Skipping population (database already populated).")
+        return None
+    return csv_path
+
+
+def _setup_schema(conn):
+    migrations.run_migrations(conn)
+    partitions.ensure_future_partitions(conn)
+
+
+def _try_lock(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (_LOCK_KEY,))
+        acquired = cur.fetchone()[0]
+    conn.commit()
+    return acquired
+
+
+def _wait_for_leader(conn, timeout=STARTUP_LOCK_TIMEOUT):
+    """
+    Takes the startup lock once the leader releases it.
+    Polls instead of blocking in pg_advisory_lock: a statement waiting on the
+    lock keeps a snapshot open, and the leader's CREATE INDEX CONCURRENTLY
+    migrations wait for every open snapshot, which would deadlock.
+    @raises TimeoutError: If the leader holds the lock for more than timeout seconds.
+    """
+
+    deadline = time.monotonic() + timeout
+    while not _try_lock(conn):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Database setup by another worker took more than {timeout}s")
+        time.sleep(0.5)
+
+
+def setup_database(conn):
+    """
+    Runs the database setup on exactly one worker at a time.
+    The leader migrates and checks the seed; followers wait for it and only verify the schema.
+    @return: (leader, CSV to import or None).
+    """
+
+    leader = _try_lock(conn)
+    if not leader:
+        logger.info("Another worker is setting up the database, waiting for it...")
+        _wait_for_leader(conn)
+
+    csv_path = None
+    try:
+        if leader:
+            logger.info("Setting up the database schema...")
+        _setup_schema(conn)
+        if leader:
+            csv_path = _pending_import(conn)
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (_LOCK_KEY,))
+        conn.commit()
+    return leader, csv_path
+
+
+def run():
+    """
+    Blocking setup: waits for PostgreSQL, opens the pool and sets up the database.
+    @return: (success, CSV to import or None).
+    """
+
+    logger.info("Attempting to connect to PostgreSQL...")
+    if not wait_for_database():
+        state["error"] = "database unavailable"
+        return False, None
+
+    try:
+        db.open_pool()
+        with db.connection() as conn:
+            logger.info("Connected to PostgreSQL successfully.")
+            state["leader"], csv_path = setup_database(conn)
+    except FileNotFoundError as e:
+        logger.error("Migration files not found: %s", e)
+        state["error"] = str(e)
+    except psycopg2.Error as e:
+        logger.error("Database error: %s", e)
+        state["error"] = str(e).strip()
+    except Exception as e:
+        logger.error("Unexpected error: %s", e)
+        state["error"] = str(e)
+    else:
+        logger.info("Database setup completed")
+        return True, csv_path
+    return False, None
+
+
+async def _start():
+    """Runs the setup until it succeeds (or stop() cancels it), then queues the import."""
+
+    delay = 1.0
+    while True:
+        ok, csv_path = await asyncio.to_thread(run)
+        if ok:
+            break
+        # /health/ready segue 503 com o erro enquanto isso
+        logger.warning("Database setup failed, retrying in %.0fs", delay)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, STARTUP_RETRY_MAX)
+    if csv_path is not None:
+        # Importa em segundo plano: a API atende enquanto os dados carregam
+        try:
+            job = importer.submit_import(csv_path)
+        except Exception as e:
+            logger.error("Could not queue the sample import: %s", e)
+            state["error"] = str(e)
+            return
+        logger.info("Populating database in the background (job %s)...", job.id)
+        state["import_job"] = job.id
+    state["error"] = None
+    state["ready"] = True
+    _tasks.append(asyncio.get_running_loop().create_task(_maintain_partitions()))
+
+
+def _ensure_partitions():
+    with db.connection() as conn:
+        partitions.ensure_future_partitions(conn)
+
+
+async def _maintain_partitions():
+    """Creates the upcoming monthly partitions periodically while the server runs."""
+
+    while True:
+        await asyncio.sleep(SALES_PARTITION_CHECK_INTERVAL)
+        try:
+            await asyncio.to_thread(_ensure_partitions)
+        except Exception as e:
+            # Tenta de novo no próximo intervalo
+            logger.error("Could not create sales_transaction partitions: %s", e)
+
+
+def start():
+    """
+    Startup hook body: starts the setup as a background task and returns at once,
+    so the server accepts requests while it runs. Must be called from the event loop.
+    """
+
+    _tasks.append(asyncio.get_running_loop().create_task(_start()))
+
+
+def stop():
+    """
+    Cancels the setup if still in progress (the blocking part on its thread runs
+    to the end) and the periodic partition check.
+    """
+
+    for task in _tasks:
+        if not task.done():
+            task.cancel()
+    _tasks.clear()
@@ -2,15 +2,30 @@
 Code pertaining to product storage and sales transactions.
 """
 
+import base64
+import csv
+import io
+import json
 import os
-from typing import Optional
+import time
+from datetime import date
+from typing import Literal, Optional
 
+import db
 import psycopg2
-from fastapi import APIRouter, HTTPException
-from log import logger
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from log import get_logger
+from pydantic import BaseModel, ValidationError
 
-from constants import db_config, CURRENT_DATE
+from constants import (
+    BULK_TRANSACTIONS_MAX_ROWS,
+    CURRENT_DATE,
+    PRODUCT_COUNT_CACHE_TTL,
+    TRANSACTIONS_STREAM_BATCH_SIZE,
+)
+
+logger = get_logger(__name__)
 
 router = APIRouter(prefix="/products", tags=["products"])
 
@@ -22,6 +37,16 @@ class ProductCreate(BaseModel):
     product_name: str
     price: float
     quantity: int
+    category: Optional[str] = None
+
+
+class StockThreshold(BaseModel):
+    """Critical/low stock limits for every product, a category or one product."""
+
+    scope: Literal["default", "category", "product"]
+    key: str = ""
+    critical: int
+    low: int
 
 
 class TransactionCreate(BaseModel):
@@ -44,36 +69,36 @@ async def create_product(product: ProductCreate):
     """
 
     try:
-        with psycopg2.connect(**db_config) as conn:
-            with conn.cursor() as cur:
-                insert_query = """
-                INSERT INTO product (product_no, product_name, price, quantity)
-                VALUES (%s, %s, %s, %s)
-                """
-                cur.execute(
-                    insert_query,
-                    (
-                        product.product_no,
-                        product.product_name,
-                        product.price,
-                        product.quantity,
-                    ),
-                )
-                conn.commit()
-                logger.info(f"Product {product.product_no} inserted successfully")
-
-                return {
-                    "message": "Product created successfully",
-                    "product": product.dict(),
-                }
+        insert_query = """
+        INSERT INTO product (product_no, product_name, price, quantity, category)
+        VALUES (%s, %s, %s, %s, %s)
+        """
+        await db.execute(
+            insert_query,
+            (
+                product.product_no,
+                product.product_name,
+                product.price,
+                product.quantity,
+                product.category,
+            ),
+            name="create_product",
+        )
+        _invalidate_product_counts()
+        logger.info("Product %s inserted successfully", product.product_no)
+
+        return {
+            "message": "Product created successfully",
+            "product": product.dict(),
+        }
 
     except psycopg2.IntegrityError as e:
-        logger.error(f"Product {product.product_no} already exists: {e}")
+        logger.error("Product %s already exists: %s", product.product_no, e)
         raise HTTPException(
             status_code=400, detail=f"Product {product.product_no} already exists"
         ) from e
     except Exception as e:
-        logger.error(f"Unexpected error: {e}")
+        logger.error("Unexpected error: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error") from e
 
 
@@ -81,21 +106,22 @@ async def create_product(product: ProductCreate):
 async def in_storage():
     """Returns the amount of products currently in stock (quantity > 0)."""
 
-    count = 0
     logger.debug("Fetching the count of products in stock")
 
     try:
-        with psycopg2.connect(**db_config) as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT * FROM product WHERE quantity > 0")
-                products = cur.fetchall()
-
-                for product in products:
-                    count += product[3]
-        return {"in_stock": count}
+        # Contadores mantidos por trigger: custo constante, independente do catálogo
+        row = await db.fetch_one(
+            """
+            SELECT COALESCE(SUM(units), 0)::BIGINT
+            FROM inventory_counter
+            WHERE tier <> 'out_of_stock'
+            """,
+            name="in_storage",
+        )
+        return {"in_stock": row[0]}
 
     except Exception as e:
-        logger.error(f"Error fetching products: {e}")
+        logger.error("Error fetching products: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error") from e
 
 
@@ -106,158 +132,311 @@ async def get_sales_last_months(months: int = 3):
     @param months: The last N months which we are going to analyze. Default is 3.
     """
 
-    logger.debug(f"Fetching sales and profit for the last {months} months")
+    logger.debug("Fetching sales and profit for the last %s months", months)
+
+    # Rollup diário: a janela não é alinhada ao mês, e o custo depende só
+    # do número de dias, não do histórico de vendas
+    summary_query = """
+    SELECT 
+        SUM(transactions)::BIGINT as total_transactions,
+        SUM(quantity)::BIGINT as total_quantity_sold,
+        SUM(revenue) as total_revenue
+    FROM sales_rollup_total
+    WHERE grain = 'day'
+      AND period_start < %s
+      AND period_start >= %s - INTERVAL '%s months'
+    """
+
+    monthly_query = """
+    SELECT 
+        DATE_TRUNC('month', period_start) as month_start,
+        SUM(transactions)::BIGINT as transactions,
+        SUM(quantity)::BIGINT as quantity_sold,
+        SUM(revenue) as revenue
+    FROM sales_rollup_total
+    WHERE grain = 'day'
+      AND period_start < %s
+      AND period_start >= %s - INTERVAL '%s months'
+    GROUP BY DATE_TRUNC('month', period_start)
+    ORDER BY month_start DESC
+    """
+
+    def _fetch(cur):
+        params = (CURRENT_DATE, CURRENT_DATE, months)
+        cur.execute(summary_query, params)
+        summary = cur.fetchone()
+        cur.execute(monthly_query, params)
+        return summary, cur.fetchall()
 
     try:
-        with psycopg2.connect(**db_config) as conn:
-            with conn.cursor() as cur:
-                summary_query = """
-                SELECT 
-                    COUNT(*) as total_transactions,
-                    SUM(st.quantity) as total_quantity_sold,
-                    SUM(st.price_at_sale * st.quantity) as total_revenue
-                FROM sales_transaction st
-                JOIN product p ON st.product_no = p.product_no
-                WHERE st.transaction_date < %s
-                  AND st.transaction_date >= %s - INTERVAL '%s months'
-                """
-
-                cur.execute(summary_query, (CURRENT_DATE, CURRENT_DATE, months))
-                summary_result = cur.fetchone()
-
-                monthly_query = """
-                SELECT 
-                    DATE_TRUNC('month', st.transaction_date) as month_start,
-                    COUNT(*) as transactions,
-                    SUM(st.quantity) as quantity_sold,
-                    SUM(st.price_at_sale * st.quantity) as revenue
-                FROM sales_transaction st
-                JOIN product p ON st.product_no = p.product_no
-                WHERE st.transaction_date < %s
-                  AND st.transaction_date >= %s - INTERVAL '%s months'
-                GROUP BY DATE_TRUNC('month', st.transaction_date)
-                ORDER BY month_start DESC
-                """
-
-                cur.execute(monthly_query, (CURRENT_DATE, CURRENT_DATE, months))
-                monthly_results = cur.fetchall()
-
-                return {
-                    "period": f"Last {months} months",
-                    "summary": {
-                        "total_transactions": (
-                            summary_result[0] if summary_result[0] else 0
-                        ),
-                        "total_quantity_sold": (
-                            summary_result[1] if summary_result[1] else 0
-                        ),
-                        "total_revenue": (
-                            float(summary_result[2]) if summary_result[2] else 0.0
-                        ),
-                    },
-                    "monthly_breakdown": [
-                        {
-                            "month": row[0].strftime("%Y-%m") if row[0] else None,
-                            "month_start": row[0].isoformat() if row[0] else None,
-                            "transactions": row[1],
-                            "quantity_sold": row[2],
-                            "revenue": float(row[3]) if row[3] else 0.0,
-                        }
-                        for row in monthly_results
-                    ],
+        summary_result, monthly_results = await db.run(_fetch, name="get_sales_last_months")
+
+        return {
+            "period": f"Last {months} months",
+            "summary": {
+                "total_transactions": (
+                    summary_result[0] if summary_result[0] else 0
+                ),
+                "total_quantity_sold": (
+                    summary_result[1] if summary_result[1] else 0
+                ),
+                "total_revenue": (
+                    float(summary_result[2]) if summary_result[2] else 0.0
+                ),
+            },
+            "monthly_breakdown": [
+                {
+                    "month": row[0].strftime("%Y-%m") if row[0] else None,
+                    "month_start": row[0].isoformat() if row[0] else None,
+                    "transactions": row[1],
+                    "quantity_sold": row[2],
+                    "revenue": float(row[3]) if row[3] else 0.0,
                 }
+                for row in monthly_results
+            ],
+        }
 
     except Exception as e:
-        logger.error(f"Error fetching sales and profit data: {e}")
+        logger.error("Error fetching sales and profit data: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error") from e
 
 
+def _encode_cursor(product_no: str) -> str:
+    """Encodes the last product_no of a page as an opaque pagination cursor."""
+
+    raw = json.dumps({"after": product_no}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> str:
+    """
+    Decodes a cursor produced by _encode_cursor.
+    @raises HTTPException: If the cursor is malformed.
+    """
+
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        after = json.loads(base64.urlsafe_b64decode(padded))["after"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from e
+    if not isinstance(after, str):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return after
+
+
+# Contagens exatas por combinação de filtros: (filtros) -> (expira_em, total)
+_product_count_cache = {}
+_PRODUCT_COUNT_CACHE_MAX = 1024
+
+
+def _invalidate_product_counts():
+    _product_count_cache.clear()
+
+
+def _count_products(cur, count_mode, where_clause, params):
+    """
+    Returns the number of products matching the filters, or None.
+    @param count_mode: "exact" (cached per filter for PRODUCT_COUNT_CACHE_TTL
+    seconds), "estimate" (planner statistics when unfiltered) or "none".
+    """
+
+    if count_mode == "none":
+        return None
+
+    if count_mode == "estimate" and not params:
+        cur.execute(
+            "SELECT reltuples::BIGINT FROM pg_class WHERE oid = 'product'::regclass"
+        )
+        estimate = cur.fetchone()[0]
+        # -1 enquanto a tabela nunca foi analisada
+        if estimate >= 0:
+            return estimate
+
+    key = (where_clause, tuple(params))
+    cached = _product_count_cache.get(key)
+    now = time.monotonic()
+    if cached is not None and cached[0] > now:
+        return cached[1]
+
+    cur.execute(f"SELECT COUNT(*) FROM product{where_clause}", params)
+    total = cur.fetchone()[0]
+    if len(_product_count_cache) >= _PRODUCT_COUNT_CACHE_MAX:
+        _product_count_cache.clear()
+    _product_count_cache[key] = (now + PRODUCT_COUNT_CACHE_TTL, total)
+    return total
+
+
 @router.get("/")
 async def get_products(
     product_no: Optional[str] = None,
     product_name: Optional[str] = None,
     page: int = 1,
     page_size: int = 20,
+    cursor: Optional[str] = None,
+    count: str = "exact",
 ):
     """
     Get all products from the database.
     @param product_no: Optional filter by product number.
     @param product_name: Optional filter by product name.
-    @param page: Page number for pagination (default is 1).
+    @param page: Page number for pagination (default is 1). Ignored when a cursor is given.
     @param page_size: Number of items per page (default is 20, max is 200).
+    @param cursor: Opaque next_cursor from a previous response; resumes right after it.
+    @param count: How to compute the total: "exact" (default, cached per filter),
+    "estimate" (table statistics) or "none".
     """
 
     logger.debug(
-        f"Fetching products filters: product_no={product_no}, product_name={product_name}, page={page}, page_size={page_size}"
+        "Fetching products filters: product_no=%s, product_name=%s, page=%s, page_size=%s, cursor=%s, count=%s",
+        product_no,
+        product_name,
+        page,
+        page_size,
+        cursor,
+        count,
     )
 
     if page < 1 or page_size < 1 or page_size > 200:
         raise HTTPException(status_code=400, detail="Invalid page or page_size")
+    if count not in ("exact", "estimate", "none"):
+        raise HTTPException(
+            status_code=400, detail="Invalid count. Use 'exact', 'estimate' or 'none'."
+        )
+
+    params = []
+    conditions = []
+
+    for column, value in [
+        ("product_no", product_no),
+        ("product_name", product_name),
+    ]:
+        if value is not None:
+            conditions.append(f"{column} = %s")
+            params.append(value)
+
+    where_clause = ""
+    if conditions:
+        where_clause = " WHERE " + " AND ".join(conditions)
+
+    # Keyset: continua a partir do último product_no visto, sem OFFSET
+    page_conditions = list(conditions)
+    page_params = list(params)
+    offset = 0
+    if cursor is not None:
+        page_conditions.append("product_no > %s")
+        page_params.append(_decode_cursor(cursor))
+    else:
+        offset = (page - 1) * page_size
+
+    page_where = ""
+    if page_conditions:
+        page_where = " WHERE " + " AND ".join(page_conditions)
+
+    # Uma linha extra indica se existe próxima página
+    data_query = (
+        "SELECT product_no, product_name, price, quantity, category "
+        f"FROM product{page_where} "
+        "ORDER BY product_no "
+        "LIMIT %s OFFSET %s"
+    )
+
+    def _fetch(cur):
+        total = _count_products(cur, count, where_clause, params)
+        cur.execute(data_query, page_params + [page_size + 1, offset])
+        return total, cur.fetchall()
 
     try:
-        with psycopg2.connect(**db_config) as conn:
-            with conn.cursor() as cur:
-                base_query = "FROM product"
-                params = []
-                conditions = []
-
-                for column, value in [
-                    ("product_no", product_no),
-                    ("product_name", product_name),
-                ]:
-                    if value is not None:
-                        conditions.append(f"{column} = %s")
-                        params.append(value)
-
-                where_clause = ""
-                if conditions:
-                    where_clause = " WHERE " + " AND ".join(conditions)
-
-                # Total count
-                count_query = f"SELECT COUNT(*) {base_query}{where_clause}"
-                cur.execute(count_query, params)
-                total = cur.fetchone()[0]
-
-                # Pagination
-                offset = (page - 1) * page_size
-                data_query = (
-                    f"SELECT product_no, product_name, price, quantity "
-                    f"{base_query}{where_clause} "
-                    "ORDER BY product_no "
-                    "LIMIT %s OFFSET %s"
-                )
-                cur.execute(data_query, params + [page_size, offset])
-                rows = cur.fetchall()
-
-                products = [
-                    {
-                        "product_no": r[0],
-                        "product_name": r[1],
-                        "price": float(r[2]),
-                        "quantity": r[3],
-                    }
-                    for r in rows
-                ]
-
-                total_pages = (total + page_size - 1) // page_size if total else 0
-
-                return {
-                    "products": products,
-                    "pagination": {
-                        "total": total,
-                        "page": page,
-                        "page_size": page_size,
-                        "total_pages": total_pages,
-                        "has_next": page < total_pages,
-                        "has_prev": page > 1,
-                    },
-                }
+        total, rows = await db.run(_fetch, name="get_products")
+
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+
+        products = [
+            {
+                "product_no": r[0],
+                "product_name": r[1],
+                "price": float(r[2]),
+                "quantity": r[3],
+                "category": r[4],
+            }
+            for r in rows
+        ]
+
+        total_pages = None
+        if total is not None:
+            total_pages = (total + page_size - 1) // page_size if total else 0
+
+        return {
+            "products": products,
+            "pagination": {
+                "total": total,
+                "count_mode": count,
+                "page": page if cursor is None else None,
+                "page_size": page_size,
+                "total_pages": total_pages,
+                "has_next": has_next,
+                "has_prev": page > 1 if cursor is None else True,
+                "next_cursor": _encode_cursor(rows[-1][0]) if has_next else None,
+            },
+        }
 
     except Exception as e:
-        logger.error(f"Error fetching products: {e}")
+        logger.error("Error fetching products: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error") from e
 
 
+# Um comando só: registra a chave da venda em sale_key (migração 0010), baixa o
+# estoque se a chave entrou e houver quantidade, e insere a venda. A linha do
+# produto fica travada só do UPDATE ao commit
+_SALE_SQL = """
+WITH claimed AS (
+    INSERT INTO sale_key (transaction_no, product_no)
+    SELECT %(transaction_no)s, %(product_no)s
+    WHERE EXISTS (SELECT 1 FROM product WHERE product_no = %(product_no)s)
+    ON CONFLICT DO NOTHING
+    RETURNING 1
+), sold AS (
+    UPDATE product
+    SET quantity = quantity - %(quantity)s
+    WHERE product_no = %(product_no)s AND quantity >= %(quantity)s
+      AND EXISTS (SELECT 1 FROM claimed)
+    RETURNING quantity
+), inserted AS (
+    INSERT INTO sales_transaction
+    (transaction_no, transaction_date, customer_no, country, product_no, quantity, price_at_sale)
+    SELECT %(transaction_no)s, %(transaction_date)s, %(customer_no)s, %(country)s,
+           %(product_no)s, %(quantity)s, %(price_at_sale)s
+    FROM sold
+)
+SELECT (SELECT quantity FROM product WHERE product_no = %(product_no)s),
+       EXISTS (SELECT 1 FROM claimed),
+       (SELECT quantity FROM sold)
+"""
+
+
+def _record_sale(cur, sale):
+    """
+    Decrements the stock and records the sale in a single statement.
+    @return: Remaining stock.
+    @raises HTTPException: 404 if the product does not exist, 400 if the sale
+    already exists or the stock is insufficient (the transaction is then rolled
+    back, releasing the claimed sale key).
+    """
+
+    cur.execute(_SALE_SQL, sale)
+    available, claimed, remaining = cur.fetchone()
+    if available is None:
+        raise HTTPException(status_code=404, detail=f"Product {sale['product_no']} not found")
+    if not claimed:
+        raise HTTPException(status_code=400, detail="Transaction already exists or invalid data")
+    if remaining is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Insufficient inventory. Available: {available}; requested: {sale['quantity']}",
+        )
+    return remaining
+
+
 @router.post("/transactions/create")
 async def create_transaction(transaction: TransactionCreate):
     """
@@ -266,155 +445,528 @@ async def create_transaction(transaction: TransactionCreate):
     """
 
     try:
-        with psycopg2.connect(**db_config) as conn:
-            with conn.cursor() as cur:
-                cur.execute("BEGIN")
-
-                cur.execute(
-                    "SELECT quantity FROM product WHERE product_no = %s",
-                    (transaction.product_no,),
-                )
-                result = cur.fetchone()
-
-                if not result:
-                    raise HTTPException(
-                        status_code=404,
-                        detail=f"Product {transaction.product_no} not found",
-                    )
-
-                current_quantity = result[0]
+        remaining = await db.run(_record_sale, transaction.dict(), name="create_transaction")
 
-                if current_quantity < transaction.quantity:
-                    raise HTTPException(
-                        status_code=400,
-                        detail=f"Insufficient inventory. Available: {current_quantity}; requested: {transaction.quantity}",
-                    )
+        logger.info(
+            "Transaction %s created successfully. Product %s inventory reduced by %s",
+            transaction.transaction_no,
+            transaction.product_no,
+            transaction.quantity,
+        )
 
-                insert_transaction_query = """
-                INSERT INTO sales_transaction 
-                (transaction_no, transaction_date, customer_no, country, product_no, quantity, price_at_sale)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """
-                cur.execute(
-                    insert_transaction_query,
-                    (
-                        transaction.transaction_no,
-                        transaction.transaction_date,
-                        transaction.customer_no,
-                        transaction.country,
-                        transaction.product_no,
-                        transaction.quantity,
-                        transaction.price_at_sale,
-                    ),
-                )
-
-                update_product_query = """
-                UPDATE product 
-                SET quantity = quantity - %s 
-                WHERE product_no = %s
-                """
-                cur.execute(
-                    update_product_query, (transaction.quantity, transaction.product_no)
-                )
-
-                conn.commit()
-
-                logger.info(
-                    f"Transaction {transaction.transaction_no} created successfully. Product {transaction.product_no} inventory reduced by {transaction.quantity}"
-                )
-
-                return {
-                    "message": "Transaction created successfully",
-                    "transaction": transaction.dict(),
-                    "remaining_inventory": current_quantity - transaction.quantity,
-                }
+        return {
+            "message": "Transaction created successfully",
+            "transaction": transaction.dict(),
+            "remaining_inventory": remaining,
+        }
 
     except psycopg2.IntegrityError as e:
-        logger.error(f"Transaction integrity error: {e}")
+        logger.error("Transaction integrity error: %s", e)
         raise HTTPException(
             status_code=400, detail="Transaction already exists or invalid data"
         ) from e
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Unexpected error creating transaction: {e}")
+        logger.error("Unexpected error creating transaction: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error") from e
 
 
+_TRANSACTION_COLUMNS = (
+    "transaction_no",
+    "transaction_date",
+    "customer_no",
+    "country",
+    "product_no",
+    "quantity",
+    "price_at_sale",
+)
+
+
+def _transaction_to_dict(row):
+    return {
+        "transaction_no": row[0],
+        "transaction_date": row[1].isoformat(),
+        "customer_no": row[2],
+        "country": row[3],
+        "product_no": row[4],
+        "quantity": row[5],
+        "price_at_sale": float(row[6]),
+    }
+
+
+# Última linha de um export interrompido: os cabeçalhos (status 200) já foram enviados
+_STREAM_ERROR = "Transaction export failed"
+
+
+def _stream_transactions(query, params, output_format):
+    """
+    Yields the query result as NDJSON or CSV chunks, one per batch of rows.
+    If the export fails midway, the failure is logged and the stream ends with
+    an {"error": ...} line (NDJSON) or a "# error: ..." line (CSV).
+    """
+
+    try:
+        yield from _transaction_chunks(query, params, output_format)
+    except Exception as e:
+        logger.error("Error streaming transactions: %s", e)
+        if output_format == "csv":
+            yield f"# error: {_STREAM_ERROR}\n"
+        else:
+            yield json.dumps({"error": _STREAM_ERROR}) + "\n"
+
+
+def _transaction_chunks(query, params, output_format):
+    """Rows are read through a server-side cursor so memory stays flat."""
+
+    with db.connection() as conn:
+        with conn.cursor(name="transactions_export") as cur:
+            cur.itersize = TRANSACTIONS_STREAM_BATCH_SIZE
+            cur.execute(query, params)
+
+            if output_format == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(_TRANSACTION_COLUMNS)
+                yield buffer.getvalue()
+
+            while True:
+                rows = cur.fetchmany(TRANSACTIONS_STREAM_BATCH_SIZE)
+                if not rows:
+                    break
+
+                if output_format == "csv":
+                    buffer.seek(0)
+                    buffer.truncate()
+                    writer.writerows(
+                        (r[0], r[1].isoformat(), r[2], r[3], r[4], r[5], r[6])
+                        for r in rows
+                    )
+                    yield buffer.getvalue()
+                else:
+                    yield "".join(
+                        json.dumps(_transaction_to_dict(r)) + "\n" for r in rows
+                    )
+
+
 @router.get("/transactions/")
-async def get_transactions(product_no: Optional[str] = None):
+async def get_transactions(
+    product_no: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    country: Optional[str] = None,
+    output_format: str = Query("json", alias="format"),
+):
     """
     Get all sales transactions from the database.
     @param product_no: Optional filter by product number.
+    @param date_from: Optional first transaction date (inclusive).
+    @param date_to: Optional last transaction date (inclusive).
+    @param country: Optional filter by country.
+    @param output_format: Query parameter "format": "json" (default, single document), or "ndjson"/"csv" to
+    stream the rows in batches.
     """
 
-    logger.debug(f"Fetching transactions with filter: product_no={product_no}")
+    logger.debug(
+        "Fetching transactions with filters: product_no=%s, date_from=%s, date_to=%s, country=%s, format=%s",
+        product_no,
+        date_from,
+        date_to,
+        country,
+        output_format,
+    )
+
+    if output_format not in ("json", "ndjson", "csv"):
+        raise HTTPException(
+            status_code=400, detail="Invalid format. Use 'json', 'ndjson' or 'csv'."
+        )
+
+    query = f"SELECT {', '.join(_TRANSACTION_COLUMNS)} FROM sales_transaction"
+    params = []
+    conditions = []
+
+    for condition, value in [
+        ("product_no = %s", product_no),
+        ("transaction_date >= %s", date_from),
+        ("transaction_date <= %s", date_to),
+        ("country = %s", country),
+    ]:
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+
+    if output_format != "json":
+        media_type = "text/csv" if output_format == "csv" else "application/x-ndjson"
+        return StreamingResponse(
+            _stream_transactions(query, params, output_format),
+            media_type=media_type,
+            headers={
+                "Content-Disposition": f"attachment; filename=transactions.{output_format}"
+            },
+        )
 
     try:
-        with psycopg2.connect(**db_config) as conn:
-            with conn.cursor() as cur:
-                query = "SELECT * FROM sales_transaction"
-                params = []
-                conditions = []
-
-                if product_no is not None:
-                    conditions.append("product_no = %s")
-                    params.append(product_no)
-
-                if conditions:
-                    query += " WHERE " + " AND ".join(conditions)
-                cur.execute(query, params)
-                transactions = cur.fetchall()
-
-                return {
-                    "transactions": [
-                        {
-                            "transaction_no": row[0],
-                            "transaction_date": row[1].isoformat(),
-                            "customer_no": row[2],
-                            "country": row[3],
-                            "product_no": row[4],
-                            "quantity": row[5],
-                            "price_at_sale": float(row[6]),
-                        }
-                        for row in transactions
-                    ]
-                }
+        transactions = await db.fetch_all(query, params, name="get_transactions")
+
+        return {
+            "transactions": [_transaction_to_dict(row) for row in transactions]
+        }
+
+    except Exception as e:
+        logger.error("Error fetching transactions: %s", e)
+        raise HTTPException(status_code=500, detail="Internal server error") from e
+
+
+def _parse_bulk_rows(body: bytes, content_type: str):
+    """
+    Parses a bulk upload into validated transactions.
+    @param body: Raw request body, either a JSON list (or {"transactions": [...]}) or CSV with a header row.
+    @param content_type: Request Content-Type, used to pick the parser.
+    @return: List of (raw row, TransactionCreate or None, error message or None), one per input row.
+    """
+
+    if "csv" in content_type:
+        raw_rows = list(csv.DictReader(io.StringIO(body.decode("utf-8-sig"))))
+    else:
+        try:
+            payload = json.loads(body)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail="Invalid JSON body") from e
+        raw_rows = payload.get("transactions") if isinstance(payload, dict) else payload
+        if not isinstance(raw_rows, list):
+            raise HTTPException(
+                status_code=400, detail="Expected a list of transactions"
+            )
+
+    if len(raw_rows) > BULK_TRANSACTIONS_MAX_ROWS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {len(raw_rows)} rows (max {BULK_TRANSACTIONS_MAX_ROWS})",
+        )
+
+    parsed = []
+    for raw in raw_rows:
+        try:
+            transaction = TransactionCreate(**raw)
+            date.fromisoformat(transaction.transaction_date)
+        except (ValidationError, ValueError, TypeError) as e:
+            parsed.append((raw, None, str(e).splitlines()[0]))
+            continue
+
+        if len(transaction.transaction_no) > 10 or len(transaction.product_no) > 10:
+            parsed.append(
+                (raw, None, "transaction_no and product_no are limited to 10 characters")
+            )
+            continue
+        parsed.append((raw, transaction, None))
+    return parsed
+
+
+_BULK_PROCESS_SQL = """
+-- Repetidas dentro do lote: só a primeira linha de cada venda segue
+UPDATE bulk_sales b
+SET status = 'duplicate'
+WHERE EXISTS (
+    SELECT 1 FROM bulk_sales o
+    WHERE o.transaction_no = b.transaction_no
+      AND o.product_no = b.product_no
+      AND o.row_no < b.row_no
+);
+
+-- Registra as chaves em sale_key (migração 0010), antes de travar os produtos,
+-- na mesma ordem da venda avulsa; as que já existiam são vendas duplicadas
+WITH claimed AS (
+    INSERT INTO sale_key (transaction_no, product_no)
+    SELECT transaction_no, product_no
+    FROM bulk_sales
+    WHERE status IS NULL
+    ORDER BY transaction_no, product_no
+    ON CONFLICT DO NOTHING
+    RETURNING transaction_no, product_no
+)
+UPDATE bulk_sales b
+SET status = 'duplicate'
+WHERE b.status IS NULL
+  AND NOT EXISTS (
+    SELECT 1 FROM claimed c
+    WHERE c.transaction_no = b.transaction_no AND c.product_no = b.product_no
+  );
+
+-- Trava os produtos do lote em ordem fixa para evitar deadlocks
+UPDATE bulk_sales b
+SET available = p.quantity
+FROM (
+    SELECT product_no, quantity
+    FROM product
+    WHERE product_no IN (SELECT product_no FROM bulk_sales WHERE status IS NULL)
+    ORDER BY product_no
+    FOR UPDATE
+) p
+WHERE p.product_no = b.product_no AND b.status IS NULL;
+
+UPDATE bulk_sales SET status = 'product_not_found' WHERE status IS NULL AND available IS NULL;
+
+-- Aceita linhas em ordem de chegada enquanto o acumulado couber no estoque
+UPDATE bulk_sales b
+SET status = CASE
+    WHEN r.running <= b.available THEN 'accepted'
+    ELSE 'insufficient_inventory'
+END
+FROM (
+    SELECT row_no,
+           SUM(quantity) OVER (PARTITION BY product_no ORDER BY row_no) AS running
+    FROM bulk_sales
+    WHERE status IS NULL
+) r
+WHERE b.row_no = r.row_no;
+
+INSERT INTO sales_transaction
+(transaction_no, transaction_date, customer_no, country, product_no, quantity, price_at_sale)
+SELECT transaction_no, transaction_date, customer_no, country, product_no, quantity, price_at_sale
+FROM bulk_sales
+WHERE status = 'accepted';
+
+UPDATE product p
+SET quantity = p.quantity - d.sold
+FROM (
+    SELECT product_no, SUM(quantity) AS sold
+    FROM bulk_sales
+    WHERE status = 'accepted'
+    GROUP BY product_no
+) d
+WHERE p.product_no = d.product_no;
+
+-- Libera as chaves registradas por linhas recusadas
+DELETE FROM sale_key k
+USING bulk_sales b
+WHERE b.status IN ('product_not_found', 'insufficient_inventory')
+  AND k.transaction_no = b.transaction_no
+  AND k.product_no = b.product_no;
+
+SELECT row_no, status, available FROM bulk_sales ORDER BY row_no;
+"""
+
+
+def _load_bulk_transactions(cur, transactions):
+    """
+    COPYs the batch into a temporary staging table and applies it with
+    set-based statements. Returns (row_no, status, available) per loaded row.
+    """
+
+    cur.execute(
+        """
+        CREATE TEMP TABLE bulk_sales (
+            row_no           INT PRIMARY KEY,
+            transaction_no   VARCHAR(10),
+            transaction_date DATE,
+            customer_no      INT,
+            country          TEXT,
+            product_no       VARCHAR(10),
+            quantity         INT,
+            price_at_sale    NUMERIC(10,2),
+            status           TEXT,
+            available        INT
+        ) ON COMMIT DROP
+        """
+    )
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row_no, t in transactions:
+        writer.writerow(
+            (
+                row_no,
+                t.transaction_no,
+                t.transaction_date,
+                t.customer_no,
+                t.country,
+                t.product_no,
+                t.quantity,
+                t.price_at_sale,
+            )
+        )
+    buffer.seek(0)
+    cur.copy_expert(
+        """
+        COPY bulk_sales (row_no, transaction_no, transaction_date, customer_no,
+                         country, product_no, quantity, price_at_sale)
+        FROM STDIN WITH (FORMAT csv)
+        """,
+        buffer,
+    )
+
+    cur.execute(_BULK_PROCESS_SQL)
+    return cur.fetchall()
+
+
+@router.post("/transactions/bulk")
+async def create_transactions_bulk(request: Request):
+    """
+    Registers a batch of sales transactions and updates inventory in one go.
+    Accepts a JSON list of transactions (or {"transactions": [...]}) or a CSV
+    body (Content-Type: text/csv) with the same columns as /transactions/create;
+    transaction_date must be YYYY-MM-DD. Rows of the same product are accepted
+    in order while the running total fits the available stock.
+    """
+
+    content_type = request.headers.get("content-type", "")
+    parsed = _parse_bulk_rows(await request.body(), content_type)
+    logger.debug("Bulk transaction upload with %d rows", len(parsed))
+
+    results = [
+        {
+            "row": i,
+            "transaction_no": raw.get("transaction_no") if isinstance(raw, dict) else None,
+            "product_no": raw.get("product_no") if isinstance(raw, dict) else None,
+            "status": "rejected",
+            "reason": "invalid" if error else None,
+            "detail": error,
+        }
+        for i, (raw, _, error) in enumerate(parsed)
+    ]
+    valid = [(i, t) for i, (_, t, _) in enumerate(parsed) if t is not None]
 
+    try:
+        outcome = await db.run(_load_bulk_transactions, valid) if valid else []
+
+    except psycopg2.IntegrityError as e:
+        logger.error("Bulk transaction integrity error: %s", e)
+        raise HTTPException(
+            status_code=409, detail="Batch conflicts with concurrent writes; retry it"
+        ) from e
     except Exception as e:
-        logger.error(f"Error fetching transactions: {e}")
+        logger.error("Unexpected error loading transaction batch: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error") from e
 
+    for row_no, status, available in outcome:
+        result = results[row_no]
+        if status == "accepted":
+            result["status"] = "accepted"
+        else:
+            result["reason"] = status
+            if status == "insufficient_inventory":
+                result["detail"] = f"Available at batch start: {available}"
+
+    accepted = sum(1 for r in results if r["status"] == "accepted")
+    logger.info(
+        "Bulk transaction upload: %d accepted, %d rejected", accepted, len(results) - accepted
+    )
+
+    return {
+        "accepted": accepted,
+        "rejected": len(results) - accepted,
+        "results": results,
+    }
+
 
 @router.get("/stock-alerts")
 async def get_stock_alerts():
     """
-    Returns count of products with low and critical stock
+    Returns count of products with low and critical stock, plus the number of
+    products and units in every stock tier. Critical includes out-of-stock
+    products. Limits come from /products/stock-thresholds.
     """
 
     logger.debug("Fetching stock alerts for products")
 
     try:
-        with psycopg2.connect(**db_config) as conn:
-            with conn.cursor() as cur:
-                # Critical stock (< 20)
-                cur.execute("SELECT COUNT(*) FROM product WHERE quantity < 20")
-                critical = cur.fetchone()[0]
-
-                # Low stock (>= 20 and < 50)
-                cur.execute("SELECT COUNT(*) FROM product WHERE quantity >= 20 AND quantity < 50")
-                low = cur.fetchone()[0]
-
-                total_alerts = critical + low
-
-                return {
-                    "critical": critical,
-                    "low": low,
-                    "total_alerts": total_alerts,
-                }
+        rows = await db.fetch_all(
+            """
+            SELECT tier, SUM(products)::BIGINT, SUM(units)::BIGINT
+            FROM inventory_counter
+            GROUP BY tier
+            """,
+            name="get_stock_alerts",
+        )
+
+        histogram = {
+            tier: {"products": 0, "units": 0}
+            for tier in ("out_of_stock", "critical", "low", "ok")
+        }
+        for tier, products, units in rows:
+            histogram[tier] = {"products": products, "units": units}
+
+        critical = histogram["out_of_stock"]["products"] + histogram["critical"]["products"]
+        low = histogram["low"]["products"]
+
+        return {
+            "critical": critical,
+            "low": low,
+            "total_alerts": critical + low,
+            "histogram": histogram,
+        }
+
+    except Exception as e:
+        logger.error("Error fetching stock alerts: %s", e)
+        raise HTTPException(status_code=500, detail="Internal server error") from e
+
+
+@router.get("/stock-thresholds")
+async def get_stock_thresholds():
+    """Lists the configured stock limits (default, per category and per product)."""
+
+    try:
+        rows = await db.fetch_all(
+            "SELECT scope, key, critical, low FROM stock_threshold ORDER BY scope, key",
+            name="get_stock_thresholds",
+        )
+        return {
+            "thresholds": [
+                {"scope": r[0], "key": r[1], "critical": r[2], "low": r[3]}
+                for r in rows
+            ]
+        }
 
     except Exception as e:
-        logger.error(f"Error fetching stock alerts: {e}")
+        logger.error("Error fetching stock thresholds: %s", e)
+        raise HTTPException(status_code=500, detail="Internal server error") from e
+
+
+def _save_stock_threshold(cur, threshold):
+    """Upserts the limit and moves every product to its new tier in the counters."""
+
+    cur.execute(
+        """
+        INSERT INTO stock_threshold (scope, key, critical, low)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (scope, key) DO UPDATE
+        SET critical = EXCLUDED.critical, low = EXCLUDED.low
+        """,
+        (threshold.scope, threshold.key, threshold.critical, threshold.low),
+    )
+    cur.execute("SELECT refresh_inventory_counters()")
+
+
+@router.put("/stock-thresholds")
+async def set_stock_threshold(threshold: StockThreshold):
+    """
+    Creates or replaces a stock limit and recomputes the inventory counters.
+    @param threshold: Limits for every product (scope "default"), a category or one product.
+    """
+
+    if threshold.scope == "default":
+        threshold.key = ""
+    elif not threshold.key:
+        raise HTTPException(status_code=400, detail="key is required for this scope")
+    if threshold.critical > threshold.low:
+        raise HTTPException(status_code=400, detail="critical must not exceed low")
+
+    try:
+        await db.run(_save_stock_threshold, threshold)
+        logger.info(
+            "Stock threshold for %s '%s' set to critical=%s, low=%s",
+            threshold.scope,
+            threshold.key,
+            threshold.critical,
+            threshold.low,
+        )
+        return {"message": "Stock threshold saved", "threshold": threshold.dict()}
+
+    except Exception as e:
+        logger.error("Error saving stock threshold: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error") from e
 
 
@@ -424,55 +976,54 @@ async def get_sales_growth(months: int = 2):
     Calculates the percentage growth of sales between months
     """
 
-    logger.debug(f"Calculating sales growth for the last {months} months")
+    logger.debug("Calculating sales growth for the last %s months", months)
 
     try:
-        with psycopg2.connect(**db_config) as conn:
-            with conn.cursor() as cur:
-                # Fetch sales data for the last N months
-                cur.execute(
-                    """
-                    SELECT 
-                        DATE_TRUNC('month', transaction_date) as month,
-                        SUM(price_at_sale * quantity) as total_revenue,
-                        SUM(quantity) as total_quantity
-                    FROM sales_transaction
-                    WHERE transaction_date >= CURRENT_DATE - INTERVAL '%s months'
-                    GROUP BY DATE_TRUNC('month', transaction_date)
-                    ORDER BY month DESC
-                    LIMIT %s
-                    """,
-                    (months, months),
-                )
-                results = cur.fetchall()
-
-                if len(results) < 2:
-                    return {
-                        "growth_percentage": 0,
-                        "current_month_revenue": results[0][1] if results else 0,
-                        "previous_month_revenue": 0,
-                    }
-
-                current_month = results[0]
-                previous_month = results[1]
-
-                current_revenue = float(current_month[1])
-                previous_revenue = float(previous_month[1])
-
-                # Calculate percentage growth
-                if previous_revenue > 0:
-                    growth = ((current_revenue - previous_revenue) / previous_revenue) * 100
-                else:
-                    growth = 0
-
-                return {
-                    "growth_percentage": round(growth, 1),
-                    "current_month_revenue": round(current_revenue, 2),
-                    "previous_month_revenue": round(previous_revenue, 2),
-                    "current_month": current_month[0].strftime("%Y-%m"),
-                    "previous_month": previous_month[0].strftime("%Y-%m"),
-                }
+        # Fetch sales data for the last N months
+        results = await db.fetch_all(
+            """
+            SELECT 
+                DATE_TRUNC('month', period_start) as month,
+                SUM(revenue) as total_revenue,
+                SUM(quantity)::BIGINT as total_quantity
+            FROM sales_rollup_total
+            WHERE grain = 'day'
+              AND period_start >= CURRENT_DATE - INTERVAL '%s months'
+            GROUP BY DATE_TRUNC('month', period_start)
+            ORDER BY month DESC
+            LIMIT %s
+            """,
+            (months, months),
+            name="get_sales_growth",
+        )
+
+        if len(results) < 2:
+            return {
+                "growth_percentage": 0,
+                "current_month_revenue": results[0][1] if results else 0,
+                "previous_month_revenue": 0,
+            }
+
+        current_month = results[0]
+        previous_month = results[1]
+
+        current_revenue = float(current_month[1])
+        previous_revenue = float(previous_month[1])
+
+        # Calculate percentage growth
+        if previous_revenue > 0:
+            growth = ((current_revenue - previous_revenue) / previous_revenue) * 100
+        else:
+            growth = 0
+
+        return {
+            "growth_percentage": round(growth, 1),
+            "current_month_revenue": round(current_revenue, 2),
+            "previous_month_revenue": round(previous_revenue, 2),
+            "current_month": current_month[0].strftime("%Y-%m"),
+            "previous_month": previous_month[0].strftime("%Y-%m"),
+        }
 
     except Exception as e:
-        logger.error(f"Error calculating sales growth: {e}")
+        logger.error("Error calculating sales growth: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error") from e
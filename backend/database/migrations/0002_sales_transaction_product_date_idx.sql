@@ -0,0 +1,4 @@
+-- migrate:no-transaction
+-- Filtros e agrupamentos por produto e período (forecast por produto, export por produto)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_sales_transaction_product_date
+    ON sales_transaction (product_no, transaction_date);
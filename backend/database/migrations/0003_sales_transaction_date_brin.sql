@@ -0,0 +1,5 @@
+-- migrate:no-transaction
+-- Janelas de data (vendas dos últimos meses, crescimento); BRIN é minúsculo e
+-- eficiente porque as vendas chegam em ordem aproximada de data
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_sales_transaction_date_brin
+    ON sales_transaction USING BRIN (transaction_date);
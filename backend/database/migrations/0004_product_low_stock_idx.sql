@@ -0,0 +1,5 @@
+-- migrate:no-transaction
+-- Alertas de estoque: só os produtos abaixo do limite de estoque baixo
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_product_low_stock
+    ON product (quantity)
+    WHERE quantity < 50;
@@ -0,0 +1,105 @@
+-- Particiona sales_transaction por mês de transaction_date.
+-- A chave primária de uma tabela particionada precisa conter a chave de
+-- partição, então passa a ser (transaction_no, product_no, transaction_date).
+
+-- Cria (se faltarem) as partições mensais entre dois meses. Linhas desse
+-- intervalo que tenham caído na partição default são movidas para a nova.
+CREATE OR REPLACE FUNCTION ensure_sales_transaction_partitions(from_month DATE, to_month DATE)
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    month_start DATE := date_trunc('month', from_month);
+    month_end   DATE;
+    part        TEXT;
+    created     INT := 0;
+BEGIN
+    WHILE month_start <= date_trunc('month', to_month) LOOP
+        month_end := month_start + INTERVAL '1 month';
+        part := format('sales_transaction_%s', to_char(month_start, 'YYYY_MM'));
+
+        IF to_regclass(part) IS NULL THEN
+            IF EXISTS (
+                SELECT 1 FROM sales_transaction_default
+                WHERE transaction_date >= month_start AND transaction_date < month_end
+            ) THEN
+                EXECUTE format(
+                    'CREATE TABLE %I (LIKE sales_transaction INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                    part
+                );
+                EXECUTE format(
+                    'WITH moved AS (
+                         DELETE FROM sales_transaction_default
+                         WHERE transaction_date >= %L AND transaction_date < %L
+                         RETURNING *
+                     )
+                     INSERT INTO %I SELECT * FROM moved',
+                    month_start, month_end, part
+                );
+                EXECUTE format(
+                    'ALTER TABLE sales_transaction ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                    part, month_start, month_end
+                );
+            ELSE
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF sales_transaction FOR VALUES FROM (%L) TO (%L)',
+                    part, month_start, month_end
+                );
+            END IF;
+            created := created + 1;
+        END IF;
+
+        month_start := month_end;
+    END LOOP;
+    RETURN created;
+END
+$$;
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM sales_transaction WHERE transaction_date IS NULL) THEN
+        RAISE EXCEPTION 'sales_transaction has rows without transaction_date; fix them before partitioning';
+    END IF;
+END
+$$;
+
+ALTER TABLE sales_transaction RENAME TO sales_transaction_legacy;
+ALTER TABLE sales_transaction_legacy RENAME CONSTRAINT sales_transaction_pkey TO sales_transaction_legacy_pkey;
+DROP INDEX IF EXISTS idx_sales_transaction_product_date;
+DROP INDEX IF EXISTS idx_sales_transaction_date_brin;
+
+CREATE TABLE sales_transaction (
+    transaction_no   VARCHAR(10),
+    transaction_date DATE NOT NULL,
+    customer_no      INT,
+    country          TEXT,
+    product_no       VARCHAR(10) REFERENCES product(product_no),
+    quantity         INT NOT NULL,
+    price_at_sale    NUMERIC(10,2) NOT NULL,
+    PRIMARY KEY (transaction_no, product_no, transaction_date)
+) PARTITION BY RANGE (transaction_date);
+
+-- Recebe datas sem partição; ensure_sales_transaction_partitions as realoca
+CREATE TABLE sales_transaction_default PARTITION OF sales_transaction DEFAULT;
+
+SELECT ensure_sales_transaction_partitions(
+    COALESCE((SELECT MIN(transaction_date) FROM sales_transaction_legacy), CURRENT_DATE),
+    GREATEST(
+        COALESCE((SELECT MAX(transaction_date) FROM sales_transaction_legacy), CURRENT_DATE),
+        CURRENT_DATE
+    )
+);
+
+INSERT INTO sales_transaction
+SELECT transaction_no, transaction_date, customer_no, country, product_no, quantity, price_at_sale
+FROM sales_transaction_legacy;
+
+DROP TABLE sales_transaction_legacy;
+
+-- Índices das migrações 0002/0003, agora declarados na tabela particionada
+CREATE INDEX idx_sales_transaction_product_date
+    ON sales_transaction (product_no, transaction_date);
+CREATE INDEX idx_sales_transaction_date_brin
+    ON sales_transaction USING BRIN (transaction_date);
+
+ANALYZE sales_transaction;
@@ -0,0 +1,156 @@
+-- Agregados de vendas por dia, semana e mês, por produto e no total.
+-- São mantidos por triggers de comando em sales_transaction, então tanto
+-- vendas individuais quanto cargas em lote os atualizam incrementalmente.
+
+CREATE TABLE IF NOT EXISTS sales_rollup_product (
+    grain        TEXT NOT NULL CHECK (grain IN ('day', 'week', 'month')),
+    product_no   VARCHAR(10) NOT NULL,
+    period_start DATE NOT NULL,
+    transactions BIGINT NOT NULL,
+    quantity     BIGINT NOT NULL,
+    revenue      NUMERIC(16,2) NOT NULL,
+    PRIMARY KEY (grain, product_no, period_start)
+);
+
+-- O total é dividido em 16 fatias por produto para que vendas simultâneas
+-- de produtos diferentes não disputem a mesma linha; leituras somam as fatias.
+CREATE TABLE IF NOT EXISTS sales_rollup_total (
+    grain        TEXT NOT NULL CHECK (grain IN ('day', 'week', 'month')),
+    period_start DATE NOT NULL,
+    slot         SMALLINT NOT NULL,
+    transactions BIGINT NOT NULL,
+    quantity     BIGINT NOT NULL,
+    revenue      NUMERIC(16,2) NOT NULL,
+    PRIMARY KEY (grain, period_start, slot)
+);
+
+-- Soma (p_sign = 1) ou subtrai (p_sign = -1) agregados diários nos rollups
+CREATE OR REPLACE FUNCTION sales_rollup_merge(
+    p_product_no   TEXT[],
+    p_day          DATE[],
+    p_transactions BIGINT[],
+    p_quantity     BIGINT[],
+    p_revenue      NUMERIC[],
+    p_sign         INT
+)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    WITH daily AS (
+        SELECT *
+        FROM unnest(p_product_no, p_day, p_transactions, p_quantity, p_revenue)
+            AS d(product_no, day, transactions, quantity, revenue)
+    ), per_grain AS (
+        SELECT g.grain,
+               d.product_no,
+               date_trunc(g.grain, d.day)::DATE AS period_start,
+               SUM(d.transactions) * p_sign AS transactions,
+               SUM(d.quantity) * p_sign AS quantity,
+               SUM(d.revenue) * p_sign AS revenue
+        FROM daily d
+        CROSS JOIN (VALUES ('day'), ('week'), ('month')) AS g(grain)
+        GROUP BY g.grain, d.product_no, date_trunc(g.grain, d.day)::DATE
+    ), product_rollup AS (
+        INSERT INTO sales_rollup_product AS r
+            (grain, product_no, period_start, transactions, quantity, revenue)
+        SELECT grain, product_no, period_start, transactions, quantity, revenue
+        FROM per_grain
+        ORDER BY grain, product_no, period_start
+        ON CONFLICT (grain, product_no, period_start) DO UPDATE
+        SET transactions = r.transactions + EXCLUDED.transactions,
+            quantity     = r.quantity + EXCLUDED.quantity,
+            revenue      = r.revenue + EXCLUDED.revenue
+    )
+    INSERT INTO sales_rollup_total AS r
+        (grain, period_start, slot, transactions, quantity, revenue)
+    SELECT grain, period_start, (hashtext(product_no) & 15),
+           SUM(transactions), SUM(quantity), SUM(revenue)
+    FROM per_grain
+    GROUP BY grain, period_start, (hashtext(product_no) & 15)
+    ORDER BY 1, 2, 3
+    ON CONFLICT (grain, period_start, slot) DO UPDATE
+    SET transactions = r.transactions + EXCLUDED.transactions,
+        quantity     = r.quantity + EXCLUDED.quantity,
+        revenue      = r.revenue + EXCLUDED.revenue;
+$$;
+
+CREATE OR REPLACE FUNCTION sales_rollup_after_insert()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM sales_rollup_merge(
+        array_agg(product_no::TEXT), array_agg(day), array_agg(transactions),
+        array_agg(quantity), array_agg(revenue), 1
+    )
+    FROM (
+        SELECT product_no, transaction_date AS day, COUNT(*) AS transactions,
+               SUM(quantity) AS quantity, SUM(price_at_sale * quantity) AS revenue
+        FROM new_rows
+        GROUP BY product_no, transaction_date
+    ) d;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION sales_rollup_after_delete()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM sales_rollup_merge(
+        array_agg(product_no::TEXT), array_agg(day), array_agg(transactions),
+        array_agg(quantity), array_agg(revenue), -1
+    )
+    FROM (
+        SELECT product_no, transaction_date AS day, COUNT(*) AS transactions,
+               SUM(quantity) AS quantity, SUM(price_at_sale * quantity) AS revenue
+        FROM old_rows
+        GROUP BY product_no, transaction_date
+    ) d;
+    RETURN NULL;
+END
+$$;
+
+-- Recalcula todos os rollups a partir de sales_transaction
+CREATE OR REPLACE FUNCTION rebuild_sales_rollups()
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    TRUNCATE sales_rollup_product, sales_rollup_total;
+
+    INSERT INTO sales_rollup_product
+        (grain, product_no, period_start, transactions, quantity, revenue)
+    SELECT g.grain, st.product_no, date_trunc(g.grain, st.transaction_date)::DATE,
+           COUNT(*), SUM(st.quantity), SUM(st.price_at_sale * st.quantity)
+    FROM sales_transaction st
+    CROSS JOIN (VALUES ('day'), ('week'), ('month')) AS g(grain)
+    GROUP BY g.grain, st.product_no, date_trunc(g.grain, st.transaction_date)::DATE;
+
+    INSERT INTO sales_rollup_total
+        (grain, period_start, slot, transactions, quantity, revenue)
+    SELECT grain, period_start, (hashtext(product_no) & 15),
+           SUM(transactions), SUM(quantity), SUM(revenue)
+    FROM sales_rollup_product
+    GROUP BY grain, period_start, (hashtext(product_no) & 15);
+$$;
+
+-- Nenhuma venda pode entrar entre o backfill e a criação dos triggers
+LOCK TABLE sales_transaction IN SHARE ROW EXCLUSIVE MODE;
+
+SELECT rebuild_sales_rollups();
+
+DROP TRIGGER IF EXISTS sales_rollup_insert ON sales_transaction;
+CREATE TRIGGER sales_rollup_insert
+    AFTER INSERT ON sales_transaction
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sales_rollup_after_insert();
+
+DROP TRIGGER IF EXISTS sales_rollup_delete ON sales_transaction;
+CREATE TRIGGER sales_rollup_delete
+    AFTER DELETE ON sales_transaction
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sales_rollup_after_delete();
+
+ANALYZE sales_rollup_product;
+ANALYZE sales_rollup_total;
@@ -0,0 +1,154 @@
+-- Contadores de estoque mantidos incrementalmente por triggers em product,
+-- com limites de estoque crítico/baixo configuráveis por categoria ou produto.
+
+ALTER TABLE product ADD COLUMN IF NOT EXISTS category TEXT;
+
+-- Limites: o de produto prevalece sobre o de categoria, que prevalece sobre o padrão.
+-- Um produto está "critical" se quantity < critical e "low" se quantity < low.
+CREATE TABLE IF NOT EXISTS stock_threshold (
+    scope    TEXT NOT NULL CHECK (scope IN ('default', 'category', 'product')),
+    key      TEXT NOT NULL DEFAULT '',
+    critical INT NOT NULL,
+    low      INT NOT NULL,
+    PRIMARY KEY (scope, key),
+    CHECK (critical <= low),
+    CHECK (scope <> 'default' OR key = '')
+);
+
+INSERT INTO stock_threshold (scope, key, critical, low)
+VALUES ('default', '', 20, 50)
+ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION stock_tier(p_quantity INT, p_product_no TEXT, p_category TEXT)
+RETURNS TEXT
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT CASE
+        WHEN p_quantity <= 0 THEN 'out_of_stock'
+        WHEN p_quantity < t.critical THEN 'critical'
+        WHEN p_quantity < t.low THEN 'low'
+        ELSE 'ok'
+    END
+    FROM stock_threshold t
+    WHERE (t.scope = 'product' AND t.key = p_product_no)
+       OR (t.scope = 'category' AND t.key = p_category)
+       OR t.scope = 'default'
+    ORDER BY CASE t.scope WHEN 'product' THEN 0 WHEN 'category' THEN 1 ELSE 2 END
+    LIMIT 1;
+$$;
+
+-- Produtos e unidades por faixa, divididos em 16 fatias por produto para
+-- que baixas de estoque simultâneas não disputem a mesma linha.
+CREATE TABLE IF NOT EXISTS inventory_counter (
+    slot     SMALLINT NOT NULL,
+    tier     TEXT NOT NULL,
+    products BIGINT NOT NULL,
+    units    BIGINT NOT NULL,
+    PRIMARY KEY (slot, tier)
+);
+
+-- Aplica linhas de product com sinal +1 (entrando) ou -1 (saindo) nos contadores
+CREATE OR REPLACE FUNCTION inventory_counter_merge(
+    p_product_no TEXT[],
+    p_quantity   INT[],
+    p_category   TEXT[],
+    p_sign       INT[]
+)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    INSERT INTO inventory_counter AS c (slot, tier, products, units)
+    SELECT (hashtext(d.product_no) & 15),
+           stock_tier(d.quantity, d.product_no, d.category),
+           SUM(d.sign),
+           SUM(d.sign * d.quantity::BIGINT)
+    FROM unnest(p_product_no, p_quantity, p_category, p_sign)
+        AS d(product_no, quantity, category, sign)
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (slot, tier) DO UPDATE
+    SET products = c.products + EXCLUDED.products,
+        units    = c.units + EXCLUDED.units;
+$$;
+
+CREATE OR REPLACE FUNCTION inventory_counter_after_insert()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM inventory_counter_merge(
+        array_agg(product_no::TEXT), array_agg(quantity), array_agg(category), array_agg(1)
+    )
+    FROM new_rows;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION inventory_counter_after_update()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM inventory_counter_merge(
+        array_agg(product_no), array_agg(quantity), array_agg(category), array_agg(sign)
+    )
+    FROM (
+        SELECT product_no::TEXT, quantity, category, -1 AS sign FROM old_rows
+        UNION ALL
+        SELECT product_no::TEXT, quantity, category, 1 AS sign FROM new_rows
+    ) d;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION inventory_counter_after_delete()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM inventory_counter_merge(
+        array_agg(product_no::TEXT), array_agg(quantity), array_agg(category), array_agg(-1)
+    )
+    FROM old_rows;
+    RETURN NULL;
+END
+$$;
+
+-- Recalcula os contadores (necessário quando os limites mudam)
+CREATE OR REPLACE FUNCTION refresh_inventory_counters()
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    TRUNCATE inventory_counter;
+
+    INSERT INTO inventory_counter (slot, tier, products, units)
+    SELECT (hashtext(product_no) & 15),
+           stock_tier(quantity, product_no, category),
+           COUNT(*),
+           SUM(quantity)
+    FROM product
+    GROUP BY 1, 2;
+$$;
+
+LOCK TABLE product IN SHARE ROW EXCLUSIVE MODE;
+
+SELECT refresh_inventory_counters();
+
+DROP TRIGGER IF EXISTS inventory_counter_insert ON product;
+CREATE TRIGGER inventory_counter_insert
+    AFTER INSERT ON product
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION inventory_counter_after_insert();
+
+DROP TRIGGER IF EXISTS inventory_counter_update ON product;
+CREATE TRIGGER inventory_counter_update
+    AFTER UPDATE ON product
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION inventory_counter_after_update();
+
+DROP TRIGGER IF EXISTS inventory_counter_delete ON product;
+CREATE TRIGGER inventory_counter_delete
+    AFTER DELETE ON product
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION inventory_counter_after_delete();
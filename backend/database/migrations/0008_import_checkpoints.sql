@@ -0,0 +1,48 @@
+-- Importação de CSVs em chunks, retomável.
+-- import_run guarda cada importação e a identidade do arquivo (tamanho e
+-- mtime) para que só a mesma versão do arquivo seja retomada; import_chunk
+-- registra cada chunk copiado para o staging (staged_at) e aplicado às
+-- tabelas finais (applied_at), no mesmo commit que faz o trabalho.
+
+CREATE TABLE IF NOT EXISTS import_run (
+    import_id    BIGSERIAL PRIMARY KEY,
+    source       TEXT NOT NULL,
+    source_size  BIGINT NOT NULL,
+    source_mtime DOUBLE PRECISION NOT NULL,
+    chunk_rows   INT NOT NULL,
+    status       TEXT NOT NULL DEFAULT 'running'
+                 CHECK (status IN ('running', 'failed', 'completed')),
+    error        TEXT,
+    rows_read    BIGINT NOT NULL DEFAULT 0,
+    rows_applied BIGINT NOT NULL DEFAULT 0,
+    started_at   TIMESTAMPTZ NOT NULL DEFAULT now(),
+    finished_at  TIMESTAMPTZ
+);
+
+CREATE TABLE IF NOT EXISTS import_chunk (
+    import_id  BIGINT NOT NULL REFERENCES import_run(import_id) ON DELETE CASCADE,
+    chunk_no   INT NOT NULL,
+    rows       INT NOT NULL,
+    staged_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+    applied_at TIMESTAMPTZ,
+    inserted   INT,
+    PRIMARY KEY (import_id, chunk_no)
+);
+
+-- Sem WAL: a carga é rápida, e o conteúdo, que o PostgreSQL esvazia após
+-- um crash, é recopiado do arquivo a partir dos checkpoints
+CREATE UNLOGGED TABLE IF NOT EXISTS import_staging (
+    import_id        BIGINT NOT NULL,
+    chunk_no         INT NOT NULL,
+    transaction_no   VARCHAR(10),
+    transaction_date TEXT,
+    product_no       VARCHAR(10),
+    product_name     TEXT,
+    price            NUMERIC(10,2),
+    quantity         INT,
+    customer_no      INT,
+    country          TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_import_staging_chunk
+    ON import_staging (import_id, chunk_no);
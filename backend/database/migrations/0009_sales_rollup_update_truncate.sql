@@ -0,0 +1,145 @@
+-- Completa a manutenção dos rollups (0006), que só acompanhavam INSERT e
+-- DELETE: um UPDATE em sales_transaction subtrai as linhas antigas e soma as
+-- novas, e o TRUNCATE de uma partição (ou da tabela inteira, que dispara o
+-- trigger de cada partição) subtrai o que ela continha.
+
+-- Subtrai dos rollups as vendas de uma tabela com as colunas de sales_transaction
+CREATE OR REPLACE FUNCTION sales_rollup_subtract_table(p_table REGCLASS)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    EXECUTE format(
+        'SELECT sales_rollup_merge(
+             array_agg(product_no::TEXT), array_agg(day), array_agg(transactions),
+             array_agg(quantity), array_agg(revenue), -1
+         )
+         FROM (
+             SELECT product_no, transaction_date AS day, COUNT(*) AS transactions,
+                    SUM(quantity) AS quantity, SUM(price_at_sale * quantity) AS revenue
+             FROM %s
+             GROUP BY product_no, transaction_date
+         ) d',
+        p_table
+    );
+END
+$$;
+
+CREATE OR REPLACE FUNCTION sales_rollup_after_update()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM sales_rollup_merge(
+        array_agg(product_no::TEXT), array_agg(day), array_agg(transactions),
+        array_agg(quantity), array_agg(revenue), -1
+    )
+    FROM (
+        SELECT product_no, transaction_date AS day, COUNT(*) AS transactions,
+               SUM(quantity) AS quantity, SUM(price_at_sale * quantity) AS revenue
+        FROM old_rows
+        GROUP BY product_no, transaction_date
+    ) d;
+    PERFORM sales_rollup_merge(
+        array_agg(product_no::TEXT), array_agg(day), array_agg(transactions),
+        array_agg(quantity), array_agg(revenue), 1
+    )
+    FROM (
+        SELECT product_no, transaction_date AS day, COUNT(*) AS transactions,
+               SUM(quantity) AS quantity, SUM(price_at_sale * quantity) AS revenue
+        FROM new_rows
+        GROUP BY product_no, transaction_date
+    ) d;
+    RETURN NULL;
+END
+$$;
+
+CREATE OR REPLACE FUNCTION sales_rollup_before_truncate()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM sales_rollup_subtract_table(TG_RELID);
+    RETURN NULL;
+END
+$$;
+
+-- Triggers de comando não são herdados pelas partições: o de TRUNCATE é
+-- criado em cada uma (e não na tabela particionada, o que subtrairia duas vezes)
+CREATE OR REPLACE FUNCTION sales_rollup_track_truncate(p_partition REGCLASS)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    EXECUTE format('DROP TRIGGER IF EXISTS sales_rollup_truncate ON %s', p_partition);
+    EXECUTE format(
+        'CREATE TRIGGER sales_rollup_truncate
+             BEFORE TRUNCATE ON %s
+             FOR EACH STATEMENT EXECUTE FUNCTION sales_rollup_before_truncate()',
+        p_partition
+    );
+END
+$$;
+
+-- Igual à de 0005, mais o trigger de TRUNCATE em cada partição criada
+CREATE OR REPLACE FUNCTION ensure_sales_transaction_partitions(from_month DATE, to_month DATE)
+RETURNS INT
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    month_start DATE := date_trunc('month', from_month);
+    month_end   DATE;
+    part        TEXT;
+    created     INT := 0;
+BEGIN
+    WHILE month_start <= date_trunc('month', to_month) LOOP
+        month_end := month_start + INTERVAL '1 month';
+        part := format('sales_transaction_%s', to_char(month_start, 'YYYY_MM'));
+
+        IF to_regclass(part) IS NULL THEN
+            IF EXISTS (
+                SELECT 1 FROM sales_transaction_default
+                WHERE transaction_date >= month_start AND transaction_date < month_end
+            ) THEN
+                EXECUTE format(
+                    'CREATE TABLE %I (LIKE sales_transaction INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                    part
+                );
+                EXECUTE format(
+                    'WITH moved AS (
+                         DELETE FROM sales_transaction_default
+                         WHERE transaction_date >= %L AND transaction_date < %L
+                         RETURNING *
+                     )
+                     INSERT INTO %I SELECT * FROM moved',
+                    month_start, month_end, part
+                );
+                EXECUTE format(
+                    'ALTER TABLE sales_transaction ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                    part, month_start, month_end
+                );
+            ELSE
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF sales_transaction FOR VALUES FROM (%L) TO (%L)',
+                    part, month_start, month_end
+                );
+            END IF;
+            PERFORM sales_rollup_track_truncate(part::REGCLASS);
+            created := created + 1;
+        END IF;
+
+        month_start := month_end;
+    END LOOP;
+    RETURN created;
+END
+$$;
+
+DROP TRIGGER IF EXISTS sales_rollup_update ON sales_transaction;
+CREATE TRIGGER sales_rollup_update
+    AFTER UPDATE ON sales_transaction
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sales_rollup_after_update();
+
+SELECT sales_rollup_track_truncate(inhrelid::REGCLASS)
+FROM pg_inherits
+WHERE inhparent = 'sales_transaction'::REGCLASS;
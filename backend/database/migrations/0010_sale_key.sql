@@ -0,0 +1,66 @@
+-- Unicidade global de (transaction_no, product_no). A chave primária da tabela
+-- particionada (0005) precisa incluir transaction_date e só impede duplicatas
+-- na mesma data; sale_key, sem partições, devolve a garantia da 0001. Quem
+-- insere em sales_transaction registra antes a chave aqui com
+-- ON CONFLICT DO NOTHING e só insere as vendas cujas chaves entraram.
+-- Partições desanexadas (arquivadas) mantêm suas chaves: o número não volta a
+-- ser aceito.
+
+CREATE TABLE IF NOT EXISTS sale_key (
+    transaction_no VARCHAR(10),
+    product_no     VARCHAR(10),
+    PRIMARY KEY (transaction_no, product_no)
+);
+
+INSERT INTO sale_key (transaction_no, product_no)
+SELECT DISTINCT transaction_no, product_no FROM sales_transaction
+ON CONFLICT DO NOTHING;
+
+-- Vendas apagadas liberam a chave, a menos que outra linha (duplicata anterior
+-- a esta migração, ou a mesma venda movida de partição) ainda a use
+CREATE OR REPLACE FUNCTION sale_key_after_delete()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    DELETE FROM sale_key k
+    USING (SELECT DISTINCT transaction_no, product_no FROM old_rows) o
+    WHERE k.transaction_no = o.transaction_no
+      AND k.product_no = o.product_no
+      AND NOT EXISTS (
+          SELECT 1 FROM sales_transaction s
+          WHERE s.transaction_no = o.transaction_no AND s.product_no = o.product_no
+      );
+    RETURN NULL;
+END
+$$;
+
+DROP TRIGGER IF EXISTS sale_key_delete ON sales_transaction;
+CREATE TRIGGER sale_key_delete
+    AFTER DELETE ON sales_transaction
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION sale_key_after_delete();
+
+-- O TRUNCATE de uma partição (0009) também libera as chaves das suas vendas
+CREATE OR REPLACE FUNCTION sales_rollup_before_truncate()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM sales_rollup_subtract_table(TG_RELID);
+    EXECUTE format(
+        'DELETE FROM sale_key k
+         USING (SELECT DISTINCT transaction_no, product_no FROM %s) t
+         WHERE k.transaction_no = t.transaction_no
+           AND k.product_no = t.product_no
+           AND NOT EXISTS (
+               SELECT 1 FROM sales_transaction s
+               WHERE s.tableoid <> %s
+                 AND s.transaction_no = t.transaction_no
+                 AND s.product_no = t.product_no
+           )',
+        TG_RELID::REGCLASS, TG_RELID::OID
+    );
+    RETURN NULL;
+END
+$$;
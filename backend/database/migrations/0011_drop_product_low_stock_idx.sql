@@ -0,0 +1,5 @@
+-- migrate:no-transaction
+-- O índice parcial da 0004 fixava o antigo limite de estoque baixo (50). Os
+-- alertas e a contagem em estoque vêm de inventory_counter (0007), com limites
+-- configuráveis, e nenhuma consulta filtra product por quantity.
+DROP INDEX CONCURRENTLY IF EXISTS idx_product_low_stock;
@@ -0,0 +1,143 @@
+import os
+import sys
+
+import psycopg2
+import pytest
+
+# Os módulos do backend importam uns aos outros pelo nome (import db), como
+# quando rodam a partir de backend/app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+import migrations  # noqa: E402
+from constants import db_config  # noqa: E402
+
+_MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "database", "migrations"
+)
+_TEST_DATABASE = "stooorage_test"
+
+
+def _server_params():
+    """
+    Server used by the database tests: TEST_DATABASE_URL (a libpq connection
+    string) or the app's db_config. The tests create and drop their own database.
+    """
+
+    url = os.environ.get("TEST_DATABASE_URL")
+    if url:
+        return psycopg2.extensions.parse_dsn(url)
+    return {key: value for key, value in db_config.items() if value is not None}
+
+
+@pytest.fixture(scope="session")
+def database():
+    """
+    Connection parameters of a fresh database with every migration applied.
+    Skips the tests that use it when no PostgreSQL server is reachable.
+    """
+
+    params = _server_params()
+    try:
+        admin = psycopg2.connect(
+            **{**params, "dbname": params.get("dbname", "postgres")}, connect_timeout=3
+        )
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"PostgreSQL not available: {e}")
+    admin.autocommit = True
+
+    with admin.cursor() as cur:
+        cur.execute(f"DROP DATABASE IF EXISTS {_TEST_DATABASE}")
+        cur.execute(f"CREATE DATABASE {_TEST_DATABASE}")
+
+    params = {**params, "dbname": _TEST_DATABASE}
+    conn = psycopg2.connect(**params)
+    try:
+        migrations.run_migrations(conn, _MIGRATIONS_DIR)
+    finally:
+        conn.close()
+
+    yield params
+
+    with admin.cursor() as cur:
+        cur.execute(f"DROP DATABASE IF EXISTS {_TEST_DATABASE}")
+    admin.close()
+
+
+@pytest.fixture
+def pg(database):
+    """Connection to the test database; whatever the test did not commit is rolled back."""
+
+    conn = psycopg2.connect(**database)
+    yield conn
+    conn.rollback()
+    conn.close()
+
+
+def _rows(cur, query):
+    cur.execute(query)
+    return sorted(cur.fetchall())
+
+
+@pytest.fixture
+def assert_consistent():
+    """
+    Returns a check that the sales rollups and the inventory counters seen by
+    cur match the same totals computed from sales_transaction and product.
+    """
+
+    def check(cur):
+        assert _rows(
+            cur,
+            """
+            SELECT grain, product_no, period_start, transactions, quantity, revenue
+            FROM sales_rollup_product
+            WHERE transactions <> 0 OR quantity <> 0 OR revenue <> 0
+            """,
+        ) == _rows(
+            cur,
+            """
+            SELECT g.grain, s.product_no, date_trunc(g.grain, s.transaction_date)::DATE,
+                   COUNT(*), SUM(s.quantity), SUM(s.price_at_sale * s.quantity)
+            FROM sales_transaction s
+            CROSS JOIN (VALUES ('day'), ('week'), ('month')) AS g(grain)
+            GROUP BY 1, 2, 3
+            """,
+        )
+
+        assert _rows(
+            cur,
+            """
+            SELECT grain, period_start, SUM(transactions), SUM(quantity), SUM(revenue)
+            FROM sales_rollup_total
+            GROUP BY 1, 2
+            HAVING SUM(transactions) <> 0 OR SUM(quantity) <> 0 OR SUM(revenue) <> 0
+            """,
+        ) == _rows(
+            cur,
+            """
+            SELECT g.grain, date_trunc(g.grain, s.transaction_date)::DATE,
+                   COUNT(*), SUM(s.quantity), SUM(s.price_at_sale * s.quantity)
+            FROM sales_transaction s
+            CROSS JOIN (VALUES ('day'), ('week'), ('month')) AS g(grain)
+            GROUP BY 1, 2
+            """,
+        )
+
+        assert _rows(
+            cur,
+            """
+            SELECT slot, tier, products, units
+            FROM inventory_counter
+            WHERE products <> 0 OR units <> 0
+            """,
+        ) == _rows(
+            cur,
+            """
+            SELECT (hashtext(product_no) & 15), stock_tier(quantity, product_no, category),
+                   COUNT(*), SUM(quantity)
+            FROM product
+            GROUP BY 1, 2
+            """,
+        )
+
+    return check
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import ai
+from model_cache import ModelCache
+
+KWARGS = {"growth": "linear", "weekly_seasonality": False, "yearly_seasonality": False}
+
+
+def _frame(values):
+    return pd.DataFrame({"ds": pd.date_range("2019-01-06", periods=len(values), freq="W"), "y": values})
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ModelCache(str(tmp_path), 8)
+    monkeypatch.setattr(ai, "model_cache", cache)
+    return cache
+
+
+def test_warm_start_without_previous_model(cache):
+    assert ai._warm_start("missing") is None
+
+
+def test_warm_start_from_fitted_model(cache):
+    model = ai._fit_new(KWARGS, _frame(np.arange(20.0) % 7))
+    cache.put("key", "w1", model)
+
+    init = ai._warm_start("key")
+
+    assert all(isinstance(init[name], float) for name in ("k", "m", "sigma_obs"))
+    assert init["delta"].shape == model.params["delta"][0].shape
+    assert init["beta"].shape == model.params["beta"][0].shape
+
+
+def test_warm_start_from_constant_series_model(cache):
+    # Série constante: o Prophet não roda o Stan e guarda os parâmetros como (1,)
+    model = ai._fit_new(KWARGS, _frame(np.full(20, 3.0)))
+    assert model.params["k"].shape == (1,)
+    cache.put("key", "w1", model)
+
+    init = ai._warm_start("key")
+
+    assert isinstance(init["k"], float)
+    # O refit a partir dele funciona quando a série deixa de ser constante
+    refit = ai._fit_new(KWARGS, _frame(np.arange(20.0) % 7), init)
+    assert refit.params["k"].shape == (1, 1)
+
+
+def test_warm_start_with_unreadable_params_falls_back_to_cold_fit(cache):
+    model = ai._fit_new(KWARGS, _frame(np.arange(20.0) % 7))
+    model.params["k"] = np.array([])
+    cache.put("key", "w1", model)
+
+    assert ai._warm_start("key") is None
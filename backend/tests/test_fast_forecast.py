@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+import fast_forecast
+
+
+def test_forecast_matrix_shapes_and_bounds():
+    rng = np.random.default_rng(0)
+    Y = rng.poisson(5, size=(3, 30)).astype(float)
+
+    forecast = fast_forecast.forecast_matrix(Y, 4, season_length=12)
+
+    for column in ("yhat", "yhat_lower", "yhat_upper"):
+        assert forecast[column].shape == (3, 4)
+        assert (forecast[column] >= 0).all()
+    assert (forecast["yhat_lower"] <= forecast["yhat"]).all()
+    assert (forecast["yhat"] <= forecast["yhat_upper"]).all()
+    assert set(forecast["model"]) <= set(fast_forecast.MODELS)
+
+
+def test_forecast_matrix_constant_series():
+    forecast = fast_forecast.forecast_matrix(np.full((2, 10), 7.0), 3)
+
+    np.testing.assert_array_equal(forecast["yhat"], np.full((2, 3), 7.0))
+    np.testing.assert_array_equal(forecast["yhat_lower"], forecast["yhat_upper"])
+
+
+def test_forecast_matrix_rows_are_independent(monkeypatch):
+    rng = np.random.default_rng(1)
+    Y = rng.poisson(3, size=(5, 20)).astype(float)
+    whole = fast_forecast.forecast_matrix(Y, 2)
+
+    # Blocos pequenos não podem mudar o resultado de cada série
+    monkeypatch.setattr(fast_forecast, "BLOCK_SIZE", 2)
+    blocked = fast_forecast.forecast_matrix(Y, 2)
+    np.testing.assert_array_equal(whole["yhat"], blocked["yhat"])
+    np.testing.assert_array_equal(
+        whole["yhat"][3], fast_forecast.forecast_matrix(Y[3:4], 2)["yhat"][0]
+    )
+
+
+@pytest.mark.parametrize("Y", [np.zeros((2, 1)), np.zeros(5)])
+def test_forecast_matrix_rejects_short_or_flat_input(Y):
+    with pytest.raises(ValueError):
+        fast_forecast.forecast_matrix(Y, 2)
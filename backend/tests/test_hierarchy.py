@@ -0,0 +1,46 @@
+import numpy as np
+
+import hierarchy
+
+
+def test_group_index_and_series():
+    labels, index = hierarchy.group_index(["b", "a", "b", None])
+    assert labels == ["None", "a", "b"]
+
+    Y = np.array([[1.0, 2.0], [3.0, 4.0], [5.0, 6.0], [7.0, 8.0]])
+    np.testing.assert_array_equal(
+        hierarchy.group_series(Y, index, len(labels)), [[7, 8], [3, 4], [6, 8]]
+    )
+
+
+def test_group_shares_use_recent_history_and_ignore_returns():
+    Y = np.array([[100.0, 1.0, 1.0], [0.0, 3.0, 3.0], [5.0, -2.0, -2.0]])
+    shares = hierarchy.group_shares(Y, np.zeros(3, dtype=int), 1, history=2)
+
+    np.testing.assert_allclose(shares, [[0.25, 0.75, 0.0]])
+
+
+def test_normalize_shares():
+    shares = hierarchy.normalize_shares(np.array([[1.0, 3.0, -1.0], [0.0, 0.0, 0.0]]))
+
+    np.testing.assert_allclose(shares, [[0.25, 0.75, 0.0], [0.0, 0.0, 0.0]])
+
+
+def test_disaggregate_keeps_group_totals():
+    # O produto 1 vende nos dois grupos
+    shares = hierarchy.normalize_shares(np.array([[2.0, 2.0, 0.0], [0.0, 1.0, 3.0]]))
+    forecast = np.array([[10.0, 20.0], [4.0, 8.0]])
+
+    products = hierarchy.disaggregate(shares, forecast)
+
+    np.testing.assert_allclose(products, [[5, 10], [6, 12], [3, 6]])
+    np.testing.assert_allclose(products.sum(axis=0), forecast.sum(axis=0))
+
+
+def test_forecast_proportions_fall_back_where_groups_forecast_nothing():
+    forecast = np.array([[1.0, 0.0], [3.0, 0.0]])
+
+    proportions = hierarchy.forecast_proportions(forecast, [0.5, 0.5])
+
+    np.testing.assert_allclose(proportions, [[0.25, 0.5], [0.75, 0.5]])
+    np.testing.assert_allclose((proportions * np.array([8.0, 6.0])).sum(axis=0), [8, 6])
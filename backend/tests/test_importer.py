@@ -0,0 +1,21 @@
+import io
+
+import importer
+
+
+def test_records_keep_quoted_line_breaks_together():
+    f = io.StringIO('a,b\n1,"two\nlines"\n\n2,"x ""quoted"" y"\n3,"open\n\nstill open"\n4,last')
+
+    assert list(importer._records(f)) == [
+        "a,b\n",
+        '1,"two\nlines"\n',
+        '2,"x ""quoted"" y"\n',
+        '3,"open\n\nstill open"\n',
+        "4,last\n",
+    ]
+
+
+def test_records_unterminated_quote_yields_rest():
+    f = io.StringIO('1,"never closed\n2,x\n')
+
+    assert list(importer._records(f)) == ['1,"never closed\n2,x\n']
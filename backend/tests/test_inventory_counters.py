@@ -0,0 +1,95 @@
+import storage
+
+_PRODUCTS = [
+    ("IC1", "Out", 1.0, 0, "A"),
+    ("IC2", "Critical", 1.0, 10, "A"),
+    ("IC3", "Low", 1.0, 30, "B"),
+    ("IC4", "Ok", 1.0, 80, "B"),
+]
+
+
+def _seed(cur):
+    cur.executemany(
+        """
+        INSERT INTO product (product_no, product_name, price, quantity, category)
+        VALUES (%s, %s, %s, %s, %s)
+        """,
+        _PRODUCTS,
+    )
+
+
+def _histogram(cur):
+    cur.execute(
+        """
+        SELECT tier, SUM(products), SUM(units)
+        FROM inventory_counter
+        GROUP BY tier
+        HAVING SUM(products) <> 0
+        """
+    )
+    return {tier: (products, units) for tier, products, units in cur.fetchall()}
+
+
+def test_product_changes_move_tiers(pg, assert_consistent):
+    with pg.cursor() as cur:
+        _seed(cur)
+        assert_consistent(cur)
+        assert _histogram(cur) == {
+            "out_of_stock": (1, 0),
+            "critical": (1, 10),
+            "low": (1, 30),
+            "ok": (1, 80),
+        }
+
+        cur.execute(
+            """
+            UPDATE product
+            SET quantity = CASE product_no WHEN 'IC2' THEN 60 ELSE 5 END
+            WHERE product_no IN ('IC2', 'IC4')
+            """
+        )
+        assert_consistent(cur)
+        assert _histogram(cur) == {
+            "out_of_stock": (1, 0),
+            "critical": (1, 5),
+            "low": (1, 30),
+            "ok": (1, 60),
+        }
+
+        cur.execute("DELETE FROM product WHERE product_no IN ('IC1', 'IC3')")
+        assert_consistent(cur)
+        assert _histogram(cur) == {"critical": (1, 5), "ok": (1, 60)}
+
+
+def test_threshold_changes_move_tiers(pg, assert_consistent):
+    with pg.cursor() as cur:
+        _seed(cur)
+
+        storage._save_stock_threshold(
+            cur, storage.StockThreshold(scope="default", critical=5, low=25)
+        )
+        assert_consistent(cur)
+        assert _histogram(cur) == {"out_of_stock": (1, 0), "low": (1, 10), "ok": (2, 110)}
+
+        # A categoria prevalece sobre o padrão
+        storage._save_stock_threshold(
+            cur, storage.StockThreshold(scope="category", key="B", critical=40, low=90)
+        )
+        assert_consistent(cur)
+        assert _histogram(cur) == {
+            "out_of_stock": (1, 0),
+            "critical": (1, 30),
+            "low": (2, 90),
+        }
+
+        # E o produto sobre a categoria
+        storage._save_stock_threshold(
+            cur, storage.StockThreshold(scope="product", key="IC4", critical=0, low=0)
+        )
+        assert_consistent(cur)
+        assert _histogram(cur) == {
+            "out_of_stock": (1, 0),
+            "critical": (1, 30),
+            "low": (1, 10),
+            "ok": (1, 80),
+        }
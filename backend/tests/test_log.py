@@ -0,0 +1,99 @@
+import logging
+import queue
+from logging.handlers import QueueListener
+
+import pytest
+
+import log
+
+
+class _Collect(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+
+@pytest.fixture
+def isolated(monkeypatch):
+    """A logger wired like the root one, with its own queue handler and listener."""
+
+    handler = log._DeferredQueueHandler(queue.SimpleQueue())
+    collect = _Collect()
+    listener = QueueListener(handler.queue, collect)
+    listener.start()
+    logger = logging.getLogger("test_log.isolated")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    monkeypatch.setattr(log, "_queue_handler", handler)
+    monkeypatch.setattr(log, "_listener", listener)
+    monkeypatch.setattr(logging.getLogger(), "handlers", [handler])
+    yield logger, handler, listener, collect
+    if listener._thread is not None:
+        listener.stop()
+    logger.removeHandler(handler)
+
+
+def test_message_is_snapshotted_when_logged(isolated):
+    logger, _, listener, collect = isolated
+    items = [1]
+
+    logger.info("items %s", items)
+    items.append(2)
+    listener.stop()
+
+    assert collect.messages == ["items [1]"]
+
+
+def test_filtered_records_are_not_formatted(isolated):
+    _, handler, listener, collect = isolated
+    handler.addFilter(log.DebugSampler(0))
+
+    class Boom:
+        def __str__(self):
+            raise AssertionError("formatted a dropped record")
+
+    for level, args in ((logging.DEBUG, (Boom(),)), (logging.INFO, ("kept",))):
+        handler.handle(logging.LogRecord("x", level, __file__, 1, "%s", args, None))
+    listener.stop()
+
+    assert collect.messages == ["kept"]
+
+
+def test_records_after_stop_are_written_directly(isolated):
+    _, handler, _, collect = isolated
+    handler.addFilter(log.LevelFilter({"noisy": "WARNING"}))
+
+    log.stop()
+    log.stop()
+    logging.getLogger("after.stop").warning("late %d", 1)
+    logging.getLogger("noisy").info("still filtered")
+
+    assert logging.getLogger().handlers == [collect]
+    assert collect.messages == ["late 1"]
+
+
+def test_module_loggers_are_children_of_log():
+    assert log.get_logger("storage").name == "log.storage"
+    assert log.get_logger("storage").parent is log.logger
+
+
+def test_caller_is_not_resolved_without_log_caller():
+    if log.LOG_CALLER:
+        pytest.skip("LOG_CALLER is set")
+
+    records = []
+    logger = logging.getLogger("test_log.caller")
+    logger.propagate = False
+    handler = logging.Handler()
+    handler.emit = records.append
+    logger.addHandler(handler)
+    try:
+        logger.warning("where")
+    finally:
+        logger.removeHandler(handler)
+
+    assert (records[0].funcName, records[0].lineno) == ("(unknown function)", 0)
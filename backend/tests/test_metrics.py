@@ -0,0 +1,43 @@
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    monkeypatch.setattr(metrics, "_registry", [])
+
+
+def test_counter_and_gauge_render():
+    counter = metrics.Counter("rows_total", "Rows.", ("query",))
+    counter.inc(2, query='say "hi"')
+    counter.inc(query='say "hi"')
+    gauge = metrics.Gauge("in_flight", "In flight.")
+    gauge.inc()
+    gauge.dec(0.5)
+
+    assert metrics.render() == (
+        "# HELP rows_total Rows.\n"
+        "# TYPE rows_total counter\n"
+        'rows_total{query="say \\"hi\\""} 3\n'
+        "# HELP in_flight In flight.\n"
+        "# TYPE in_flight gauge\n"
+        "in_flight 0.5\n"
+    )
+
+
+def test_histogram_render_is_cumulative():
+    histogram = metrics.Histogram("wait_seconds", "Wait.", ("kind",), buckets=(1.0, 0.1))
+    histogram.observe(0.05, kind="a")
+    histogram.observe(0.1, kind="a")
+    histogram.observe(3, kind="a")
+
+    assert histogram.render() == [
+        "# HELP wait_seconds Wait.",
+        "# TYPE wait_seconds histogram",
+        'wait_seconds_bucket{kind="a",le="0.1"} 2',
+        'wait_seconds_bucket{kind="a",le="1.0"} 2',
+        'wait_seconds_bucket{kind="a",le="+Inf"} 3',
+        'wait_seconds_sum{kind="a"} 3.15',
+        'wait_seconds_count{kind="a"} 3',
+    ]
@@ -0,0 +1,41 @@
+import pytest
+
+import migrations
+
+
+def test_statements_skip_comments_and_blanks():
+    sql = """
+    -- índices criados fora de transação
+    CREATE INDEX CONCURRENTLY a ON t (x);
+      -- outro
+    CREATE INDEX CONCURRENTLY b
+        ON t (y);
+
+    ;
+    """
+
+    assert migrations._statements(sql) == [
+        "CREATE INDEX CONCURRENTLY a ON t (x)",
+        "CREATE INDEX CONCURRENTLY b\n        ON t (y)",
+    ]
+
+
+def test_discover_orders_by_version_and_reads_marker(tmp_path):
+    (tmp_path / "0010_later.sql").write_text("SELECT 2;")
+    (tmp_path / "0002_indexes.sql").write_text(migrations.NO_TRANSACTION_MARKER + "\nSELECT 1;")
+    (tmp_path / "notes.txt").write_text("ignored")
+
+    found = migrations.discover(str(tmp_path))
+
+    assert [(m.version, m.name, m.transactional) for m in found] == [
+        (2, "indexes", False),
+        (10, "later", True),
+    ]
+
+
+def test_discover_rejects_duplicate_versions(tmp_path):
+    (tmp_path / "0001_a.sql").write_text("SELECT 1;")
+    (tmp_path / "1_b.sql").write_text("SELECT 1;")
+
+    with pytest.raises(ValueError):
+        migrations.discover(str(tmp_path))
@@ -0,0 +1,74 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ai
+from model_cache import ModelCache
+
+KWARGS = {"growth": "linear", "weekly_seasonality": False, "yearly_seasonality": False}
+
+
+@pytest.fixture(scope="module")
+def model():
+    df = pd.DataFrame({"ds": pd.date_range("2019-01-06", periods=12, freq="W"), "y": np.arange(12.0)})
+    return ai._fit_new(KWARGS, df)
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    count = {"reads": 0}
+    original = ModelCache._read
+
+    def counting(self, key):
+        count["reads"] += 1
+        return original(self, key)
+
+    monkeypatch.setattr(ModelCache, "_read", counting)
+    return count
+
+
+def test_get_from_disk_after_restart(tmp_path, model, reads):
+    ModelCache(str(tmp_path), 4).put("key", "w1", model)
+    cache = ModelCache(str(tmp_path), 4)
+
+    assert cache.get("key", "w1") is not None
+    assert cache.get("key", "w1") is not None
+    assert reads["reads"] == 1
+    assert cache.stats()["disk_hits"] == 1 and cache.stats()["hits"] == 1
+
+
+@pytest.mark.parametrize("check", ["get", "is_current"])
+def test_outdated_model_is_read_once(tmp_path, model, reads, check):
+    ModelCache(str(tmp_path), 4).put("key", "w1", model)
+    cache = ModelCache(str(tmp_path), 4)
+
+    assert not getattr(cache, check)("key", "w2")
+    watermark, previous = cache.previous("key")
+
+    assert watermark == "w1"
+    assert previous.params.keys() == model.params.keys()
+    assert reads["reads"] == 1
+
+
+def test_lru_evicts_least_recently_used(tmp_path, model):
+    cache = ModelCache(str(tmp_path), 2)
+    for key in ("a", "b", "c"):
+        cache.put(key, "w", model)
+
+    assert cache.stats()["size"] == 2
+    assert cache.get("a", "w") is not None
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_concurrent_saves_of_one_key_leave_one_file(tmp_path, model):
+    caches = [ModelCache(str(tmp_path), 4) for _ in range(4)]
+    threads = [threading.Thread(target=c.put, args=("key", "w1", model)) for c in caches]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [p.suffix for p in tmp_path.iterdir()] == [".json"]
+    assert ModelCache(str(tmp_path), 4).get("key", "w1") is not None
@@ -0,0 +1,70 @@
+import querylog
+
+
+def test_shape_replaces_literals_and_parameters():
+    assert (
+        querylog.shape("SELECT * FROM product\n  WHERE product_no = %s AND name = 'it''s' LIMIT 10")
+        == "SELECT * FROM product WHERE product_no = ? AND name = ? LIMIT ?"
+    )
+
+
+def test_shape_drops_comments_and_named_parameters():
+    assert (
+        querylog.shape("/* rota */ UPDATE t SET x = %(x)s -- fim\n WHERE id = 1.5")
+        == "UPDATE t SET x = ? WHERE id = ?"
+    )
+
+
+def test_shape_keeps_digits_inside_identifiers():
+    assert querylog.shape("SELECT col1 FROM sales_2024") == "SELECT col1 FROM sales_2024"
+
+
+class _FakeCursor:
+    def __init__(self, fail_analyze=False):
+        self.fail_analyze = fail_analyze
+        self.executed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement):
+        self.executed.append(statement)
+        if self.fail_analyze and statement == b"EXPLAIN (ANALYZE, BUFFERS) SELECT nextval('s')":
+            raise querylog.DatabaseError("cannot execute nextval() in a read-only transaction")
+
+    def fetchall(self):
+        return [("Result (x = 'a')",)]
+
+
+class _FakeConnection:
+    def __init__(self, cur):
+        self.cur = cur
+
+    def cursor(self):
+        return self.cur
+
+
+def test_explain_analyzes_selects_in_a_rolled_back_read_only_transaction():
+    cur = _FakeCursor()
+    plan = querylog._explain(_FakeConnection(cur), "SELECT 1", b"SELECT 1")
+    assert plan == "Result (x = ?)"
+    assert cur.executed == [
+        "BEGIN READ ONLY",
+        b"EXPLAIN (ANALYZE, BUFFERS) SELECT 1",
+        "ROLLBACK",
+        "SELECT pg_advisory_unlock_all()",
+    ]
+
+
+def test_explain_falls_back_to_plain_explain():
+    cur = _FakeCursor(fail_analyze=True)
+    querylog._explain(_FakeConnection(cur), "SELECT nextval(?)", b"SELECT nextval('s')")
+    assert cur.executed[-1] == b"EXPLAIN SELECT nextval('s')"
+    assert "ROLLBACK" in cur.executed
+
+    cur = _FakeCursor()
+    querylog._explain(_FakeConnection(cur), "UPDATE t SET x = ?", b"UPDATE t SET x = 1")
+    assert cur.executed == [b"EXPLAIN UPDATE t SET x = 1"]
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+import replenishment
+
+
+def _plan(on_hand, yhat, spread, lead_time=2, review_period=1, service_level=0.95):
+    yhat = np.asarray(yhat, dtype=float)
+    return replenishment.plan(
+        on_hand, yhat, yhat - spread, yhat + spread, lead_time, review_period, service_level
+    )
+
+
+def test_plan_without_uncertainty():
+    result = _plan([5.0], [[10.0, 10.0, 10.0, 10.0]], 0.0)
+
+    assert result["safety_stock"][0] == 0
+    assert result["reorder_point"][0] == 20
+    assert result["order_up_to"][0] == 30
+    assert result["order_quantity"][0] == 25
+    assert result["needs_reorder"][0]
+    assert result["periods_of_cover"][0] == 0
+
+
+def test_plan_safety_stock_from_interval():
+    # sigma por período = 1, três períodos independentes
+    spread = 1.2816
+    result = _plan([0.0], [[10.0, 10.0, 10.0]], spread, service_level=0.5)
+    assert result["safety_stock"][0] == pytest.approx(0)
+
+    result = _plan([0.0], [[10.0, 10.0, 10.0]], spread, service_level=0.8413)
+    assert result["safety_stock"][0] == pytest.approx(np.sqrt(3), rel=1e-3)
+    assert result["reorder_point"][0] == pytest.approx(20 + np.sqrt(2), rel=1e-3)
+
+
+def test_plan_cover_beyond_horizon_and_order():
+    result = _plan([100.0, 15.0, 5.0, 0.0], [[10.0] * 3, [10.0] * 3, [10.0] * 3, [0.0] * 3], 0.0)
+
+    assert result["periods_of_cover"].tolist() == [10.0, 1.0, 0.0, np.inf]
+    assert not result["needs_reorder"][0]
+    assert result["order_quantity"][0] == 0
+    # Menor cobertura primeiro
+    assert result["order"].tolist() == [2, 1, 0, 3]
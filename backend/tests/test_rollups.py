@@ -0,0 +1,127 @@
+from datetime import date
+
+import partitions
+
+_PRODUCTS = [("RT1", "Rollup one", 2.5, 100), ("RT2", "Rollup two", 10.0, 100)]
+
+_SALES = [
+    ("R1", date(2030, 1, 3), "RT1", 2, 2.5),
+    ("R2", date(2030, 1, 3), "RT2", 1, 10.0),
+    ("R3", date(2030, 1, 20), "RT1", 5, 2.0),
+    ("R4", date(2030, 2, 1), "RT1", 1, 2.5),
+    ("R5", date(2030, 2, 14), "RT2", 3, 9.5),
+]
+
+
+def _seed(cur, sales=_SALES, products=_PRODUCTS):
+    cur.executemany(
+        "INSERT INTO product (product_no, product_name, price, quantity) VALUES (%s, %s, %s, %s)",
+        products,
+    )
+    cur.execute(
+        "SELECT ensure_sales_transaction_partitions(%s, %s)",
+        (min(sale[1] for sale in sales), max(sale[1] for sale in sales)),
+    )
+    # Um INSERT só, para o trigger de comando receber várias linhas de uma vez
+    cur.execute(
+        """
+        WITH s AS (
+            SELECT * FROM unnest(%s::TEXT[], %s::DATE[], %s::TEXT[], %s::INT[], %s::NUMERIC[])
+                AS s(transaction_no, transaction_date, product_no, quantity, price_at_sale)
+        ), claimed AS (
+            INSERT INTO sale_key (transaction_no, product_no)
+            SELECT transaction_no, product_no FROM s
+        )
+        INSERT INTO sales_transaction
+        (transaction_no, transaction_date, customer_no, country, product_no, quantity,
+         price_at_sale)
+        SELECT transaction_no, transaction_date, 1, 'Brazil', product_no, quantity, price_at_sale
+        FROM s
+        """,
+        [list(column) for column in zip(*sales)],
+    )
+
+
+def _month_totals(cur, month):
+    cur.execute(
+        """
+        SELECT SUM(transactions), SUM(quantity), SUM(revenue)
+        FROM sales_rollup_total
+        WHERE grain = 'month' AND period_start = %s
+        """,
+        (month,),
+    )
+    return cur.fetchone()
+
+
+def test_insert_adds_to_every_grain(pg, assert_consistent):
+    with pg.cursor() as cur:
+        _seed(cur)
+        assert_consistent(cur)
+        assert _month_totals(cur, date(2030, 1, 1)) == (3, 8, 25)
+
+
+def test_delete_subtracts(pg, assert_consistent):
+    with pg.cursor() as cur:
+        _seed(cur)
+        cur.execute("DELETE FROM sales_transaction WHERE transaction_no IN ('R1', 'R5')")
+        assert_consistent(cur)
+        assert _month_totals(cur, date(2030, 2, 1)) == (1, 1, 2.5)
+
+
+def test_update_moves_totals_between_periods(pg, assert_consistent):
+    with pg.cursor() as cur:
+        _seed(cur)
+        cur.execute("UPDATE sales_transaction SET quantity = quantity * 2 WHERE product_no = 'RT1'")
+        assert_consistent(cur)
+
+        # Muda de mês, e portanto de partição
+        cur.execute(
+            "UPDATE sales_transaction SET transaction_date = '2030-02-10' "
+            "WHERE transaction_no = 'R3'"
+        )
+        assert_consistent(cur)
+        assert _month_totals(cur, date(2030, 1, 1)) == (2, 5, 20)
+
+
+def test_truncate_subtracts_the_partition(pg, assert_consistent):
+    with pg.cursor() as cur:
+        _seed(cur)
+        cur.execute("TRUNCATE sales_transaction_2030_01")
+        assert_consistent(cur)
+        assert _month_totals(cur, date(2030, 1, 1)) == (0, 0, 0)
+        cur.execute("SELECT COUNT(*) FROM sale_key WHERE transaction_no IN ('R1', 'R2', 'R3')")
+        assert cur.fetchone()[0] == 0
+
+        cur.execute("TRUNCATE sales_transaction")
+        assert_consistent(cur)
+
+
+def test_detach_subtracts_and_keeps_keys(pg, assert_consistent):
+    sales = [
+        ("D1", date(2031, 3, 5), "DT1", 4, 1.0),
+        ("D2", date(2031, 4, 5), "DT1", 1, 1.0),
+    ]
+    with pg.cursor() as cur:
+        _seed(cur, sales, [("DT1", "Detached", 1.0, 9)])
+        # detach_partition confirma a própria transação
+        pg.commit()
+
+        try:
+            partitions.detach_partition(pg, date(2031, 3, 1))
+            assert_consistent(cur)
+            assert _month_totals(cur, date(2031, 3, 1)) == (0, 0, 0)
+            assert _month_totals(cur, date(2031, 4, 1)) == (1, 1, 1)
+
+            # Arquivada, a tabela não mexe mais nos rollups
+            cur.execute("TRUNCATE sales_transaction_2031_03")
+            assert_consistent(cur)
+            cur.execute("SELECT COUNT(*) FROM sale_key WHERE transaction_no = 'D1'")
+            assert cur.fetchone()[0] == 1
+        finally:
+            pg.rollback()
+            cur.execute("DROP TABLE IF EXISTS sales_transaction_2031_03")
+            cur.execute("DELETE FROM sales_transaction WHERE product_no = 'DT1'")
+            cur.execute("DELETE FROM sale_key WHERE product_no = 'DT1'")
+            cur.execute("DELETE FROM product WHERE product_no = 'DT1'")
+            pg.commit()
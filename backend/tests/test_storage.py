@@ -0,0 +1,110 @@
+import base64
+
+import pytest
+from fastapi import HTTPException
+
+import storage
+
+
+@pytest.mark.parametrize("product_no", ["22423", "85123A", "ç/+?=", ""])
+def test_cursor_round_trip(product_no):
+    cursor = storage._encode_cursor(product_no)
+
+    assert "=" not in cursor
+    assert storage._decode_cursor(cursor) == product_no
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not a cursor!",
+        base64.urlsafe_b64encode(b"[1, 2]").decode(),
+        base64.urlsafe_b64encode(b'{"before": "1"}').decode(),
+        base64.urlsafe_b64encode(b'{"after": 1}').decode(),
+    ],
+)
+def test_decode_cursor_rejects_malformed(cursor):
+    with pytest.raises(HTTPException) as e:
+        storage._decode_cursor(cursor)
+    assert e.value.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "output_format, marker",
+    [("ndjson", '{"error": "Transaction export failed"}\n'), ("csv", "# error: Transaction export failed\n")],
+)
+def test_stream_ends_with_error_marker(monkeypatch, output_format, marker):
+    def failing(query, params, output_format):
+        yield "first batch\n"
+        raise RuntimeError("connection lost")
+
+    monkeypatch.setattr(storage, "_transaction_chunks", failing)
+
+    assert list(storage._stream_transactions("SELECT 1", [], output_format)) == [
+        "first batch\n",
+        marker,
+    ]
+
+
+def _sale(transaction_no, product_no, quantity):
+    return storage.TransactionCreate(
+        transaction_no=transaction_no,
+        transaction_date="2030-05-02",
+        customer_no=1,
+        country="Brazil",
+        product_no=product_no,
+        quantity=quantity,
+        price_at_sale=2.0,
+    )
+
+
+def test_bulk_load_checks_duplicates_and_running_stock(pg, assert_consistent):
+    with pg.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO product (product_no, product_name, price, quantity)
+            VALUES ('BK1', 'Bulk one', 2, 10), ('BK2', 'Bulk two', 2, 3)
+            """
+        )
+        storage._record_sale(cur, _sale("E1", "BK2", 1).dict())
+
+        batch = [
+            _sale("T1", "BK1", 4),
+            _sale("T2", "BK1", 4),
+            _sale("T3", "BK1", 4),
+            _sale("T1", "BK1", 1),
+            _sale("E1", "BK2", 1),
+            _sale("T4", "NOPE", 1),
+            _sale("T5", "BK2", 2),
+        ]
+        outcome = storage._load_bulk_transactions(cur, list(enumerate(batch)))
+
+        assert [status for _, status, _ in outcome] == [
+            "accepted",
+            "accepted",
+            "insufficient_inventory",
+            "duplicate",
+            "duplicate",
+            "product_not_found",
+            "accepted",
+        ]
+        assert outcome[2][2] == 10
+
+        cur.execute("SELECT product_no, quantity FROM product ORDER BY product_no")
+        assert cur.fetchall() == [("BK1", 2), ("BK2", 0)]
+        cur.execute("SELECT transaction_no, product_no, quantity FROM sales_transaction")
+        assert sorted(cur.fetchall()) == [
+            ("E1", "BK2", 1),
+            ("T1", "BK1", 4),
+            ("T2", "BK1", 4),
+            ("T5", "BK2", 2),
+        ]
+        # Só as vendas aceitas ficam com a chave
+        cur.execute("SELECT transaction_no, product_no FROM sale_key")
+        assert sorted(cur.fetchall()) == [
+            ("E1", "BK2"),
+            ("T1", "BK1"),
+            ("T2", "BK1"),
+            ("T5", "BK2"),
+        ]
+        assert_consistent(cur)